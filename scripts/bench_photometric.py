@@ -0,0 +1,114 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/22 10:40
+# @Author : liumin
+# @File : bench_photometric.py
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_path)
+
+from src.data.transforms.seg_transforms import PhotoMetricDistortion
+from src.data.transforms.det_transforms import ColorHSV
+
+"""
+    Micro-benchmark of the LUT based seg PhotoMetricDistortion and det ColorHSV against the
+    previous implementations, kept below as reference functions.
+
+        python scripts/bench_photometric.py --image demo.jpg --iters 200
+
+    Both versions run with the same seeds, so they draw the same parameters; the report shows the
+    time per call and the mean/max absolute pixel difference of the outputs.
+"""
+
+parser = argparse.ArgumentParser(description='Benchmark the photometric transforms')
+parser.add_argument('--image', default=None, help='Image to distort, a random 640x640 image by default.')
+parser.add_argument('--size', type=int, nargs=2, default=[640, 640], help='h w of the random image.')
+parser.add_argument('--iters', type=int, default=200, help='Calls per implementation.')
+
+
+def _convert(img, alpha=1, beta=0):
+    img = img.astype(np.float32) * alpha + beta
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def reference_photometric(t, img):
+    # PhotoMetricDistortion before the LUT rewrite
+    def contrast(img):
+        if random.randint(0, 1):
+            return _convert(img, alpha=random.uniform(t.contrast_lower, t.contrast_upper))
+        return img
+
+    if random.randint(0, 1):
+        img = _convert(img, beta=random.uniform(-t.brightness_delta, t.brightness_delta))
+    mode = random.randint(0, 1)
+    if mode == 1:
+        img = contrast(img)
+    if random.randint(0, 1):
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        img[:, :, 1] = _convert(img[:, :, 1], alpha=random.uniform(t.saturation_lower, t.saturation_upper))
+        img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
+    if random.randint(0, 1):
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        img[:, :, 0] = (img[:, :, 0].astype(int) + random.randint(-t.hue_delta, t.hue_delta)) % 180
+        img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
+    if mode == 0:
+        img = contrast(img)
+    return img
+
+
+def reference_color_hsv(t, img):
+    # ColorHSV before the LUT rewrite
+    if random.random() < t.p:
+        r = np.random.uniform(-1, 1, 3) * [t.hue, t.saturation, t.value] + 1
+        hue, sat, val = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+        x = np.arange(0, 256, dtype=r.dtype)
+        lut_hue = ((x * r[0]) % 180).astype(img.dtype)
+        lut_sat = np.clip(x * r[1], 0, 255).astype(img.dtype)
+        lut_val = np.clip(x * r[2], 0, 255).astype(img.dtype)
+        im_hsv = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val)))
+        return cv2.cvtColor(im_hsv, cv2.COLOR_HSV2BGR, dst=img)
+    return img
+
+
+def run(fn, img, iters, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    outs = []
+    start = time.perf_counter()
+    for _ in range(iters):
+        outs.append(fn(img.copy()))
+    return (time.perf_counter() - start) / iters, outs
+
+
+def compare(name, old, new, img, iters):
+    t_old, out_old = run(old, img, iters, 0)
+    t_new, out_new = run(new, img, iters, 0)
+    diff = np.stack([np.abs(a.astype(np.int16) - b.astype(np.int16)) for a, b in zip(out_old, out_new)])
+    print('{:<24} old {:8.3f} ms   new {:8.3f} ms   speedup {:5.2f}x   |diff| mean {:.3f} max {}'.format(
+        name, t_old * 1000, t_new * 1000, t_old / t_new, diff.mean(), diff.max()))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.image is not None:
+        img = cv2.imread(args.image)
+        assert img is not None, 'Image Not Found: {}'.format(args.image)
+    else:
+        img = np.random.RandomState(0).randint(0, 256, tuple(args.size) + (3,), dtype=np.uint8)
+    print('image {}x{}, {} iters'.format(img.shape[0], img.shape[1], args.iters))
+
+    pmd = PhotoMetricDistortion()
+    compare('PhotoMetricDistortion', lambda x: reference_photometric(pmd, x),
+            lambda x: pmd({'image': x, 'target': None})['image'], img, args.iters)
+    hsv = ColorHSV(p=1.0, hue=0.015, saturation=0.7, value=0.4)
+    compare('ColorHSV', lambda x: reference_color_hsv(hsv, x),
+            lambda x: hsv({'image': x, 'target': None})['image'], img, args.iters)
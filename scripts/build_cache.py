@@ -0,0 +1,74 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/18 15:10
+# @Author : liumin
+# @File : build_cache.py
+
+import argparse
+import os
+import sys
+from importlib import import_module
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_path)
+
+from src.utils.config import CommonConfiguration
+
+"""
+    Builds (or brings up to date) the packed caches of a training setting outside of the trainer.
+
+        python scripts/build_cache.py --setting conf/coco_yolov5.yml --workers 32
+
+    Works for any DATASET.CLASS with a cache_data() method. Images are read by --workers processes
+    and streamed into shard files, progress is checkpointed, so an interrupted build resumes where
+    it stopped when the command is run again. Set CACHE_READONLY: True in the config to make the
+    trainer only attach to finished caches.
+"""
+
+parser = argparse.ArgumentParser(description='Build the packed dataset caches of a training setting')
+parser.add_argument('--setting', default='conf/coco_yolov5.yml', help='The path to the training setting file you want to use.')
+parser.add_argument('--stages', nargs='+', default=['train', 'val'], help='Dataset sections to build.')
+parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of reader processes.')
+parser.add_argument('--shard-gb', type=float, default=None, help='Shard size in GB, CACHE_SHARD_GB by default.')
+parser.add_argument('--mode', default=None, choices=['raw', 'encoded'], help='Cache mode, CACHE_MODE by default.')
+
+
+def parse_dictionary(cfg):
+    dictionary = CommonConfiguration.from_yaml(cfg.DATASET.DICTIONARY)
+    if cfg.DATASET.BACKGROUND_AS_CATEGORY:
+        return dictionary[cfg.DATASET.DICTIONARY_NAME]
+    return dictionary[cfg.DATASET.DICTIONARY_NAME][1:]
+
+
+def main(args):
+    cfg = CommonConfiguration.from_yaml(args.setting)
+    *dataset_str_parts, dataset_class_str = cfg.DATASET.CLASS.split(".")
+    dataset_class = getattr(import_module(".".join(dataset_str_parts)), dataset_class_str)
+    if not hasattr(dataset_class, 'cache_data'):
+        print(f'{cfg.DATASET.CLASS} has no packed cache, nothing to build.')
+        return
+
+    dictionary = parse_dictionary(cfg)
+    for stage in args.stages:
+        data_cfg = cfg.DATASET[stage.upper()]
+        if data_cfg is None:
+            print(f'WARNING: {args.setting} has no DATASET.{stage.upper()} section, skipped.')
+            continue
+        data_cfg.CACHE = True
+        data_cfg.CACHE_READONLY = False
+        data_cfg.CACHE_SHM = False
+        data_cfg.CACHE_MAX_GB = None
+        data_cfg.CACHE_WORKERS = args.workers
+        if args.shard_gb is not None:
+            data_cfg.CACHE_SHARD_GB = args.shard_gb
+        if args.mode is not None:
+            data_cfg.CACHE_MODE = args.mode
+
+        dataset = dataset_class(data_cfg=data_cfg, dictionary=dictionary, transform=None, target_transform=None, stage=stage)
+        if not dataset.is_cache:
+            print(f'ERROR: {stage} cache of {cfg.DATASET.CLASS} could not be built.')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/24 16:30
+# @Author : liumin
+# @File : build_shards.py
+
+import argparse
+import os
+import random
+import sys
+from importlib import import_module
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_path)
+
+from src.utils.config import CommonConfiguration
+from src.data.datasets.shards import ShardWriter, encode_sample
+
+"""
+    Converts the datasets of a training setting into tar shards for ShardDataset.
+
+        python scripts/build_shards.py --setting conf/coco_yolov5.yml --out /data/coco_shards --workers 32
+
+    The DATASET.CLASS of the setting is run without transforms, without caches and with LOAD_NUM 1,
+    and its raw samples are written to <out>/<stage>/ in a shuffled order (train only by default),
+    so shard-level shuffling plus the reader's shuffle buffer mix the whole dataset. Datasets with
+    get_file_paths store the original image files, the others losslessly re-encoded images.
+    Then point the trainer at the shards with SHARDS: '<out>/train' in DATASET.TRAIN, the val set is
+    always read map-style since the evaluators need all of its samples, exactly once, with annotations.
+"""
+
+parser = argparse.ArgumentParser(description='Convert the datasets of a training setting into tar shards')
+parser.add_argument('--setting', default='conf/coco_yolov5.yml', help='The path to the training setting file you want to use.')
+parser.add_argument('--stages', nargs='+', default=['train'], help='Dataset sections to convert.')
+parser.add_argument('--out', required=True, help='Output directory, one sub-directory per stage.')
+parser.add_argument('--samples-per-shard', type=int, default=1000, help='Samples per tar shard.')
+parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of reader processes.')
+parser.add_argument('--no-shuffle', action='store_true', help='Keep the dataset order in every stage.')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the shuffled sample order.')
+
+_dataset = None
+
+
+def parse_dictionary(cfg):
+    dictionary = CommonConfiguration.from_yaml(cfg.DATASET.DICTIONARY)
+    if cfg.DATASET.BACKGROUND_AS_CATEGORY:
+        return dictionary[cfg.DATASET.DICTIONARY_NAME]
+    return dictionary[cfg.DATASET.DICTIONARY_NAME][1:]
+
+
+def raw_sample(sample):
+    # stands in for the transforms, the shards keep the samples as the dataset loads them
+    return sample
+
+
+def build_dataset(cfg, stage):
+    *dataset_str_parts, dataset_class_str = cfg.DATASET.CLASS.split(".")
+    dataset_class = getattr(import_module(".".join(dataset_str_parts)), dataset_class_str)
+    data_cfg = cfg.DATASET[stage.upper()]
+    data_cfg.CACHE = False
+    data_cfg.CACHE_MAX_GB = None
+    data_cfg.DECODE_SIZE = None
+    data_cfg.LOAD_NUM = 1
+    data_cfg.RESERVOIR_SIZE = None
+    return dataset_class(data_cfg=data_cfg, dictionary=parse_dictionary(cfg), transform=raw_sample,
+                         target_transform=None, stage=stage)
+
+
+def init_worker(setting, stage):
+    global _dataset
+    _dataset = build_dataset(CommonConfiguration.from_yaml(setting), stage)
+
+
+def encode(idx):
+    paths = _dataset.get_file_paths(idx) if hasattr(_dataset, 'get_file_paths') else []
+    return encode_sample(_dataset[idx], paths[0] if paths else None)
+
+
+def main(args):
+    cfg = CommonConfiguration.from_yaml(args.setting)
+    for stage in args.stages:
+        if cfg.DATASET[stage.upper()] is None:
+            print(f'WARNING: {args.setting} has no DATASET.{stage.upper()} section, skipped.')
+            continue
+        num = len(build_dataset(cfg, stage))
+        order = list(range(num))
+        if stage == 'train' and not args.no_shuffle:
+            random.Random(args.seed).shuffle(order)
+
+        writer = ShardWriter(os.path.join(args.out, stage), stage, args.samples_per_shard)
+        with Pool(args.workers, initializer=init_worker, initargs=(args.setting, stage)) as pool:
+            for key, (ext, data, record) in tqdm(zip(order, pool.imap(encode, order, chunksize=16)),
+                                                 total=num, desc=f'{stage} shards'):
+                writer.write('{:08d}'.format(key), ext, data, record)
+        index = writer.close(dataset=cfg.DATASET.CLASS, stage=stage)
+        print(f"{stage}: {index['samples']} samples in {len(index['shards'])} shards at {writer.root}")
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,52 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/17 14:30
+# @Author : liumin
+# @File : clean_shm.py
+
+import argparse
+import os
+import shutil
+import sys
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_path)
+
+from src.data.cache.shm import SHM_ROOT, remove_dead_tmp, stale_copies
+
+"""
+    Frees the /dev/shm copies of packed caches (CACHE_SHM) that are no longer current.
+
+        python scripts/clean_shm.py            # list the stale copies
+        python scripts/clean_shm.py --remove   # remove them
+
+    A copy is stale when its source cache is gone or has been rebuilt or updated since it was
+    staged. The trainers never remove copies themselves, since a job may still run on one; run
+    this on a node when no job uses the listed copies. Unfinished copies of killed processes are
+    always removed.
+"""
+
+parser = argparse.ArgumentParser(description='Remove stale shared memory copies of the packed caches')
+parser.add_argument('--root', default=os.path.join(SHM_ROOT, 'cvpytorch'), help='Directory of the shared memory copies.')
+parser.add_argument('--remove', action='store_true', help='Remove the stale copies instead of listing them.')
+parser.add_argument('--all', action='store_true', help='Treat every copy as stale.')
+
+
+def main(args):
+    freed = remove_dead_tmp(args.root)
+    if args.all:
+        copies = sorted(e.path for e in os.scandir(args.root) if e.is_dir() and '.tmp' not in e.name) \
+            if os.path.isdir(args.root) else []
+    else:
+        copies = stale_copies(args.root)
+    for path in copies:
+        nbytes = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+        if args.remove:
+            shutil.rmtree(path, ignore_errors=True)
+            freed += nbytes
+        print('{} {} ({:.2f} GB)'.format('removed' if args.remove else 'stale', path, nbytes / (1 << 30)))
+    print('{:.2f} GB freed'.format(freed / (1 << 30)))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -4,12 +4,12 @@
 # @Author : liumin
 # @File : base_dataset.py
 
-import glob
-import os
 from PIL import Image
 from torch.utils.data import Dataset
 from torchvision.datasets import ImageFolder
 
+from src.data.cache import load_image_folder
+
 class BaseDataset(Dataset):
     def __init__(self, root_path='', transform=None, target_transform=None, stage='train'):
         super(BaseDataset, self).__init__()
@@ -22,22 +22,14 @@ class BaseDataset(Dataset):
 
     def _set_files(self):
         # self.imgs = ImageFolder(os.path.join(root_path,self.stage))
-        self._imgs = []
-        self._labels = []
-        if self.stage == 'infer':
-            for root, fnames, _ in sorted(os.walk(self.root_path)):
-                for fname in sorted(fnames):
-                    self._imgs.extend(glob.glob(os.path.join(root, fname, '*.jpg')))
-        else:
-            self.cls_label = [d.name for d in os.scandir(self.root_path) if d.is_dir()]
-            for root, fnames, _ in sorted(os.walk(self.root_path)):
-                for fname in sorted(fnames):
-                    imgs = glob.glob(os.path.join(root, fname, '*.jpg'))
-                    self._imgs.extend(imgs)
-                    self._labels.extend([self.cls_label.index(fname) for _ in imgs])
+        # cached file manifest of the image folder, labels looked up through a dict
+        self.manifest = load_image_folder(self.root_path, '*.jpg', labeled=self.stage != 'infer')
+        self.cls_label = self.manifest.classes
+        self._imgs = self.manifest
+        self._labels = self.manifest.labels
 
     def __getitem__(self, idx):
-        _img, _label = Image.open(self._imgs[idx]).convert('RGB'),self._labels[idx]
+        _img, _label = Image.open(self._imgs[idx]).convert('RGB'),int(self._labels[idx])
         if self.transform is not None:
             _img = self.transform(_img)
         if self.target_transform is not None:
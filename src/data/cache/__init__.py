@@ -0,0 +1,19 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/16 10:05
+# @Author : liumin
+# @File : __init__.py
+
+from .packed import PackedImageWriter, PackedImageReader
+from .annotations import pack_annotations, save_annotations, AnnotationColumns, pack_box_targets, BoxTargetColumns
+from .manifest import scan_manifest, load_manifest
+from .builder import CACHE_MODES, read_image, cache_options, update_image_cache
+from .stats import WorkerCounters
+from .lru import LRUImageCache, build_lru_cache
+from .coco_index import CocoIndex
+from .shm import stage_to_shm
+from .folder import ImageFolderManifest, load_image_folder
+from .decode import imread_reduced, imdecode_reduced, read_reduced, scale_annotations
+from .resize import resize_scale, read_resized
+from .reservoir import SampleReservoir, build_reservoir
+from .loader_pool import ThreadedLoader, build_loader_pool
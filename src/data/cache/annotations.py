@@ -0,0 +1,119 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/16 10:40
+# @Author : liumin
+# @File : annotations.py
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+"""
+    Columnar storage of coco-style annotation lists.
+
+    The i-th entry owns annotations [ann_offset[i], ann_offset[i + 1]) of the flat arrays below.
+    Variable sized fields (segmentation, keypoints, ...) are kept as one json record per
+    annotation inside a single uint8 blob and are only decoded when the entry is read.
+"""
+
+ANN_COLUMNS = {
+    'id': np.int64,
+    'image_id': np.int64,
+    'category_id': np.int64,
+    'iscrowd': np.uint8,
+    # float64 like the json floats, a COCO api built from the columns evaluates exactly as the json
+    'area': np.float64,
+    'bbox': np.float64,
+}
+
+
+def pack_annotations(anns_per_entry):
+    counts = np.array([len(anns) for anns in anns_per_entry], dtype=np.int64)
+    cols = {'ann_offset': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)}
+    flat = [obj for anns in anns_per_entry for obj in anns]
+
+    for k, dtype in ANN_COLUMNS.items():
+        if k == 'bbox':
+            cols[k] = np.array([obj[k] for obj in flat], dtype=dtype).reshape(-1, 4)
+        else:
+            cols[k] = np.array([obj.get(k, 0) for obj in flat], dtype=dtype)
+
+    extras = [json.dumps({k: v for k, v in obj.items() if k not in ANN_COLUMNS}).encode() for obj in flat]
+    cols['extra_offset'] = np.concatenate([[0], np.cumsum([len(e) for e in extras])]).astype(np.int64)
+    cols['extra'] = np.frombuffer(b''.join(extras), dtype=np.uint8)
+    return cols
+
+
+def save_annotations(root, cols):
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    for k, v in cols.items():
+        # replaced atomically, readers may still have the previous columns mapped
+        np.save(root / 'ann_{}.tmp.npy'.format(k), v)
+        os.replace(root / 'ann_{}.tmp.npy'.format(k), root / 'ann_{}.npy'.format(k))
+
+
+class AnnotationColumns(object):
+    '''
+        Rebuilds the list of annotation dicts of one entry from the columnar arrays.
+    '''
+    def __init__(self, root, mmap_mode='r'):
+        self.root = Path(root)
+        keys = ['ann_offset', 'extra_offset', 'extra'] + list(ANN_COLUMNS.keys())
+        for k in keys:
+            setattr(self, k, np.load(self.root / 'ann_{}.npy'.format(k), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.ann_offset) - 1
+
+    def count(self, idx):
+        return int(self.ann_offset[idx + 1] - self.ann_offset[idx])
+
+    def __getitem__(self, idx):
+        return self.get(idx)
+
+    def get(self, idx, extras=True):
+        '''
+            extras=False skips decoding the json fields (segmentation, keypoints, ...), the dicts
+            then only hold the columns, which is all a box target needs.
+        '''
+        start, end = self.ann_offset[idx], self.ann_offset[idx + 1]
+        anns = []
+        for j in range(start, end):
+            obj = json.loads(self.extra[self.extra_offset[j]:self.extra_offset[j + 1]].tobytes()) if extras else {}
+            obj.update(id=int(self.id[j]), image_id=int(self.image_id[j]), category_id=int(self.category_id[j]),
+                       iscrowd=int(self.iscrowd[j]), area=float(self.area[j]), bbox=self.bbox[j].tolist())
+            anns.append(obj)
+        return anns
+
+
+def pack_box_targets(targets):
+    '''
+        targets: list of (boxes[M, 4], labels[M]) in x1y1x2y2 pixel coordinates.
+    '''
+    counts = np.array([len(boxes) for boxes, _ in targets], dtype=np.int64)
+    cols = {'box_offset': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)}
+    cols['boxes'] = np.concatenate([np.asarray(boxes, dtype=np.float32).reshape(-1, 4) for boxes, _ in targets] +
+                                   [np.zeros((0, 4), dtype=np.float32)], 0)
+    cols['labels'] = np.concatenate([np.asarray(labels, dtype=np.int64).reshape(-1) for _, labels in targets] +
+                                    [np.zeros((0,), dtype=np.int64)], 0)
+    return cols
+
+
+class BoxTargetColumns(object):
+    '''
+        Per-entry (boxes, labels) of datasets whose labels are parsed from txt/xml files.
+    '''
+    def __init__(self, root, mmap_mode='r'):
+        self.root = Path(root)
+        for k in ['box_offset', 'boxes', 'labels']:
+            setattr(self, k, np.load(self.root / 'ann_{}.npy'.format(k), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.box_offset) - 1
+
+    def __getitem__(self, idx):
+        start, end = self.box_offset[idx], self.box_offset[idx + 1]
+        return np.array(self.boxes[start:end]), np.array(self.labels[start:end])
@@ -0,0 +1,154 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/16 14:20
+# @Author : liumin
+# @File : builder.py
+
+from functools import partial
+from multiprocessing.pool import Pool
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from .packed import PackedImageWriter, PackedImageReader, load_meta
+from .manifest import scan_manifest, manifest_hash, save_manifest, load_manifest
+from .resize import read_resized
+
+CACHE_MODES = ('raw', 'encoded')
+# rebuild from scratch once less than this share of the shard bytes is still referenced
+MIN_LIVE_RATIO = 0.5
+
+
+def read_image(path, mode):
+    if mode == 'encoded':
+        return np.fromfile(path, dtype=np.uint8)
+    return cv2.imread(path)
+
+
+def load_entry(args):
+    i, path, mode, loader = args
+    buf, src_shape = loader(path, mode), None
+    if isinstance(buf, tuple):
+        buf, src_shape = buf
+    assert buf is not None and buf.size > 0, 'Image Not Found: {}'.format(path)
+    return i, buf, src_shape
+
+
+def open_base(cache_path, mode, max_size=None):
+    '''
+        The existing cache at cache_path if it can be updated in place, else None.
+        Its stored manifest must hash to meta['hash'], i.e. the last update was committed completely.
+    '''
+    meta = load_meta(cache_path)
+    if meta is None or meta.get('mode', 'raw') != mode:
+        return None, None
+    manifest = load_manifest(cache_path)
+    if manifest is None or manifest_hash(*manifest, key=max_size) != meta.get('hash'):
+        return None, None
+    return PackedImageReader(cache_path), manifest
+
+
+def cache_options(data_cfg):
+    '''
+        update_image_cache() keyword arguments from the CACHE_* keys of a dataset config section.
+    '''
+    def get(key, default):
+        return data_cfg[key] if data_cfg.__contains__(key) and data_cfg[key] is not None else default
+    return dict(mode=get('CACHE_MODE', 'raw'), shard_gb=get('CACHE_SHARD_GB', 4),
+                num_workers=get('CACHE_WORKERS', 8), readonly=get('CACHE_READONLY', False),
+                max_size=get('CACHE_MAX_SIZE', None))
+
+
+def update_image_cache(cache_path, paths, mode='raw', shard_gb=4, num_workers=8, loader=read_image,
+                       flags=cv2.IMREAD_COLOR, extras=None, deps=(), readonly=False, desc=None,
+                       max_size=None, interpolation=cv2.INTER_AREA):
+    '''
+        Brings the packed cache at cache_path in sync with paths and returns a PackedImageReader of it,
+        or None when the cache location is not writeable.
+
+        The sources are validated by a per-entry (size, mtime) manifest. Entries whose file did not
+        change keep their bytes in the existing shards, new or modified files are read with a process
+        pool (loader(path, mode), a module level function) and appended as new shards. The cache is
+        rebuilt from scratch when the mode changed or when most of the shard bytes became garbage.
+        extras(root) may write additional per-entry data into the cache before it is committed; it is
+        called whenever the cache is (re)written. deps are the files extras reads (e.g. label files),
+        they are part of the manifest but never packed.
+
+        Progress is checkpointed while packing, an interrupted build resumes where it stopped. With
+        readonly, a missing or outdated cache is not built here (see scripts/build_cache.py) and
+        None is returned.
+
+        With max_size every entry is stored shrunk to max_size (see resize.py) and its original shape
+        is recorded; max_size is part of the hash, so changing it rebuilds the cache.
+    '''
+    assert mode in CACHE_MODES, 'Unsupported CACHE_MODE: {}, must be one of {}'.format(mode, CACHE_MODES)
+    if max_size is not None:
+        max_size = int(max_size) if isinstance(max_size, int) else [int(s) for s in max_size]
+        loader = partial(read_resized, size=max_size, loader=loader, interpolation=interpolation)
+    paths = [str(p) for p in paths]
+    sources = paths + [str(p) for p in deps]
+    size, mtime = scan_manifest(sources)
+    _hash = manifest_hash(sources, size, mtime, key=max_size)
+    if PackedImageReader.is_valid(cache_path, _hash, mode):
+        print(f'Cache {cache_path} is up to date.')
+        return PackedImageReader(cache_path)
+    if readonly:
+        print(f'WARNING: Cache {cache_path} is missing or outdated, build it with scripts/build_cache.py. '
+              f'Images are read from disk.')
+        return None
+
+    base, manifest = open_base(cache_path, mode, max_size)
+    reuse = {}
+    if base is not None:
+        old = {p: j for j, p in enumerate(manifest[0])}
+        for i, p in enumerate(paths):
+            j = old.get(p)
+            if j is not None and size[i] == manifest[1][j] and mtime[i] == manifest[2][j]:
+                reuse[i] = j
+        live = int(base.length[list(reuse.values())].sum())
+        disk = base.meta.get('disk_bytes', base.nbytes)
+        if live < MIN_LIVE_RATIO * disk:
+            print(f'Cache {cache_path}: only {live / max(disk, 1) * 100:.1f}% of the shard bytes are live, rebuilding.')
+            base, reuse = None, {}
+
+    resume_key = '{}:{}:{}'.format(_hash, mode, base.meta['hash'] if base is not None else '')
+    try:
+        writer = PackedImageWriter(cache_path, len(paths), shard_bytes=shard_gb * (1 << 30), base=base,
+                                   resume_key=resume_key)
+    except OSError as e:
+        print(f'WARNING: Cache directory {cache_path.parent} is not writeable: {e}')  # path not writeable
+        return None
+
+    try:
+        if writer.resumed:
+            print(f'Cache {cache_path}: resuming, {writer.resumed} entries were already packed.')
+        else:
+            for i, j in reuse.items():
+                writer.reuse(i, j)
+        todo = writer.pending()
+        if todo:
+            with Pool(num_workers) as pool:
+                pbar = tqdm(pool.imap_unordered(load_entry, [(i, paths[i], mode, loader) for i in todo],
+                                                chunksize=max(1, min(64, len(todo) // (num_workers * 16)))),
+                            desc=desc, total=len(todo))
+                for i, buf, src_shape in pbar:
+                    writer.add(i, buf, src_shape)
+                pbar.close()
+        if extras is not None:
+            extras(writer.tmp_root)
+        # manifest before index and meta: an interrupted update leaves a manifest that does not
+        # match meta['hash'], and the next run rebuilds instead of trusting a mixed state
+        save_manifest(writer, sources, size, mtime)
+        writer.close(mode=mode, flags=flags, hash=_hash, max_size=max_size)
+    except BaseException:
+        # also on KeyboardInterrupt, so a stopped build keeps its checkpoint
+        writer.abort()
+        raise
+
+    if base is not None:
+        print(f'Cache {cache_path} updated: {len(todo)} new or modified, {len(reuse)} reused, '
+              f'{len(base) - len(reuse)} dropped.')
+    else:
+        print(f'New cache created: {cache_path}')
+    return PackedImageReader(cache_path)
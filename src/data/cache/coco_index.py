@@ -0,0 +1,177 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/17 9:40
+# @Author : liumin
+# @File : coco_index.py
+
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from pycocotools.coco import COCO
+
+from .annotations import pack_annotations, save_annotations, AnnotationColumns
+
+"""
+    Precompiled columnar index of a coco annotation file.
+
+    instances_train2017.index/
+        meta.json                           source size/mtime and the (small) categories list
+        img_id.npy img_height.npy ...       one row per image, sorted by image id
+        img_file.npy                        file names
+        ann_*.npy                           annotations grouped per image row, see annotations.py
+        ann_num_visible.npy                 number of labeled keypoints per annotation
+
+    The json is parsed once, when the index is missing or stale. Afterwards dataset startup only
+    loads a few .npy files, filtering is vectorized, and a COCO api object is only materialized
+    from the columns when an evaluator actually needs one.
+"""
+
+# bumped whenever the layout or dtypes of the columns change, older indexes are recompiled
+INDEX_VERSION = 2
+
+
+class CocoIndex(object):
+    def __init__(self, root):
+        self.root = Path(root)
+        with open(self.root / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        self.categories = self.meta['categories']
+        self.cat_ids = [cat['id'] for cat in self.categories]
+
+        self.img_id = np.load(self.root / 'img_id.npy')
+        self.img_height = np.load(self.root / 'img_height.npy')
+        self.img_width = np.load(self.root / 'img_width.npy')
+        self.img_file = np.load(self.root / 'img_file.npy')
+        self.ann = AnnotationColumns(self.root)
+        self.ann_num_visible = np.load(self.root / 'ann_num_visible.npy', mmap_mode='r')
+        self.pos = {int(img_id): i for i, img_id in enumerate(self.img_id)}
+
+    @classmethod
+    def load_or_compile(cls, ann_file):
+        root = index_path(ann_file)
+        if not is_fresh(root, ann_file):
+            try:
+                compile_coco_index(ann_file, root)
+            except OSError as e:
+                root = Path(tempfile.gettempdir()) / root.name
+                print(f'WARNING: Annotation directory {Path(ann_file).parent} is not writeable: {e}, using {root}')
+                if not is_fresh(root, ann_file):
+                    compile_coco_index(ann_file, root)
+        return cls(root)
+
+    def __len__(self):
+        return len(self.img_id)
+
+    def get_cat_ids(self, cat_names=()):
+        return [cat['id'] for cat in self.categories if not cat_names or cat['name'] in cat_names]
+
+    def file_name(self, img_id):
+        return str(self.img_file[self.pos[img_id]])
+
+    def load_anns(self, img_id, cat_ids=None, extras=True):
+        anns = self.ann.get(self.pos[img_id], extras)
+        if cat_ids is not None:
+            anns = [obj for obj in anns if obj['category_id'] in cat_ids]
+        return anns
+
+    def image_shapes(self, img_ids):
+        '''
+            (h, w) of img_ids as stored in the annotation file, rows of 0 when it has no size.
+        '''
+        rows = np.array([self.pos[int(i)] for i in img_ids], dtype=np.int64)
+        return np.stack([self.img_height[rows], self.img_width[rows]], 1)
+
+    def _count_per_image(self, flags):
+        csum = np.concatenate([[0], np.cumsum(flags, dtype=np.int64)])
+        return csum[self.ann.ann_offset[1:]] - csum[self.ann.ann_offset[:-1]]
+
+    def valid_image_ids(self, min_size=1):
+        '''
+            Images with at least one box whose width and height are both larger than min_size.
+        '''
+        bbox = self.ann.bbox
+        good = (bbox[:, 2] > min_size) & (bbox[:, 3] > min_size)
+        return [int(i) for i in self.img_id[self._count_per_image(good) > 0]]
+
+    def keypoint_image_ids(self, cat_ids):
+        '''
+            Images with at least one annotation of cat_ids that has a labeled keypoint.
+        '''
+        good = np.isin(self.ann.category_id, cat_ids) & (self.ann_num_visible > 0)
+        return [int(i) for i in self.img_id[self._count_per_image(good) > 0]]
+
+    def to_coco(self):
+        '''
+            Builds a fresh pycocotools COCO object from the columns, without parsing the json.
+        '''
+        images = [{'id': int(self.img_id[i]), 'file_name': str(self.img_file[i]),
+                   'height': int(self.img_height[i]), 'width': int(self.img_width[i])} for i in range(len(self))]
+        annotations = [obj for i in range(len(self)) for obj in self.ann[i]]
+        coco = COCO()
+        coco.dataset = {'images': images, 'annotations': annotations, 'categories': json.loads(json.dumps(self.categories))}
+        coco.createIndex()
+        return coco
+
+
+def index_path(ann_file):
+    ann_file = Path(ann_file)
+    return ann_file.with_name(ann_file.stem + '.index')
+
+
+def source_stat(ann_file):
+    st = os.stat(ann_file)
+    return {'source': os.path.basename(ann_file), 'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+def is_fresh(root, ann_file):
+    meta_path = Path(root) / 'meta.json'
+    if not meta_path.is_file():
+        return False
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    return meta.get('version') == INDEX_VERSION and all(meta.get(k) == v for k, v in source_stat(ann_file).items())
+
+
+def compile_coco_index(ann_file, root):
+    root = Path(root)
+    print(f'Compiling annotation index {root} ...')
+    with open(ann_file, 'r') as f:
+        dataset = json.load(f)
+
+    images = sorted(dataset.get('images', []), key=lambda img: img['id'])
+    anns_per_image = {img['id']: [] for img in images}
+    for obj in dataset.get('annotations', []):
+        anns_per_image[obj['image_id']].append(obj)
+    anns_per_image = [anns_per_image[img['id']] for img in images]
+
+    tmp_root = root.with_name('{}.tmp{}'.format(root.name, os.getpid()))
+    if tmp_root.exists():
+        shutil.rmtree(tmp_root)
+    tmp_root.mkdir(parents=True)
+    try:
+        np.save(tmp_root / 'img_id.npy', np.array([img['id'] for img in images], dtype=np.int64))
+        np.save(tmp_root / 'img_height.npy', np.array([img.get('height', 0) for img in images], dtype=np.int32))
+        np.save(tmp_root / 'img_width.npy', np.array([img.get('width', 0) for img in images], dtype=np.int32))
+        np.save(tmp_root / 'img_file.npy', np.array([img['file_name'] for img in images], dtype=np.str_))
+        save_annotations(tmp_root, pack_annotations(anns_per_image))
+
+        num_visible = [sum(1 for v in obj['keypoints'][2::3] if v > 0) if 'keypoints' in obj else 0
+                       for anns in anns_per_image for obj in anns]
+        np.save(tmp_root / 'ann_num_visible.npy', np.array(num_visible, dtype=np.int32))
+
+        meta = source_stat(ann_file)
+        meta['version'] = INDEX_VERSION
+        meta['categories'] = dataset.get('categories', [])
+        with open(tmp_root / 'meta.json', 'w') as f:
+            json.dump(meta, f)
+
+        if root.exists():
+            shutil.rmtree(root)
+        os.replace(tmp_root, root)
+    except Exception:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        raise
@@ -0,0 +1,115 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/19 15:40
+# @Author : liumin
+# @File : decode.py
+
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+"""
+    Reduced-resolution decoding.
+
+    When an image is only going to be shrunk to fit `size` (mosaic tiles, letterbox resize), a
+    JPEG can be decoded at 1/2, 1/4 or 1/8 of its resolution directly in the DCT domain with
+    cv2.IMREAD_REDUCED_COLOR_*, which is several times cheaper than a full decode followed by a
+    resize. The factor is the largest power of two that still leaves the image at least as large
+    as the resize target, so the later resize never has to upsample. Callers get the actual
+    (sx, sy) decode scale back to rescale their annotations.
+"""
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+NO_SCALE = (1.0, 1.0)
+
+
+def reduction_factor(h0, w0, size):
+    # EXIF orientation may swap the axes after decoding, so both orientations have to fit
+    limit = min(max(h0 / size[0], w0 / size[1]), max(w0 / size[0], h0 / size[1]))
+    factor = 1
+    while factor < 8 and factor * 2 <= limit:
+        factor *= 2
+    return factor
+
+
+def decode_scale(img, h0, w0):
+    h, w = img.shape[:2]
+    if (h > w) != (h0 > w0) and h != w:
+        h0, w0 = w0, h0
+    return w / w0, h / h0
+
+
+def _header(src):
+    try:
+        with Image.open(src) as im:
+            return im.format, im.size
+    except OSError:
+        return None, None
+
+
+def imread_reduced(path, size=None):
+    '''
+        Returns (img, (sx, sy)), img decoded as small as size allows.
+    '''
+    if size is not None:
+        fmt, wh = _header(path)
+        factor = reduction_factor(wh[1], wh[0], size) if fmt == 'JPEG' else 1
+        if factor > 1:
+            img = cv2.imread(path, REDUCED_FLAGS[factor])
+            if img is not None:
+                return img, decode_scale(img, wh[1], wh[0])
+    return cv2.imread(path), NO_SCALE
+
+
+def imdecode_reduced(buf, size=None):
+    '''
+        Same as imread_reduced for the bytes of an encoded file.
+    '''
+    if size is not None:
+        fmt, wh = _header(io.BytesIO(buf))
+        factor = reduction_factor(wh[1], wh[0], size) if fmt == 'JPEG' else 1
+        if factor > 1:
+            img = cv2.imdecode(buf, REDUCED_FLAGS[factor])
+            if img is not None:
+                return img, decode_scale(img, wh[1], wh[0])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR), NO_SCALE
+
+
+def read_reduced(path, size=None, cache=None, idx=None):
+    '''
+        Returns (img, scale), scale = float32 [sx, sy]. Reads entry idx of a packed cache when one is
+        given (raw caches are returned as they are), path otherwise. For a pre-resized cache the scale
+        is relative to the source image, not to the cached entry.
+    '''
+    if cache is None:
+        img, scale = imread_reduced(path, size)
+    elif cache.encoded:
+        img, scale = imdecode_reduced(cache.get_bytes(idx), size)
+    else:
+        img, scale = cache[idx], NO_SCALE
+    assert img is not None, 'Image Not Found: {}'.format(path)
+    if cache is not None and cache.resized:
+        scale = cache.source_scale(idx, img) or scale
+    return img, np.array(scale, dtype=np.float32)
+
+
+def scale_annotations(anns, sx, sy):
+    '''
+        Rescales coco annotation dicts in place: bbox, polygon segmentations, keypoints and area.
+    '''
+    for obj in anns:
+        x, y, w, h = obj['bbox']
+        obj['bbox'] = [x * sx, y * sy, w * sx, h * sy]
+        if isinstance(obj.get('segmentation'), list):
+            obj['segmentation'] = [(np.asarray(poly, dtype=np.float64).reshape(-1, 2) * (sx, sy)).ravel().tolist()
+                                   for poly in obj['segmentation']]
+        if 'keypoints' in obj:
+            kps = np.asarray(obj['keypoints'], dtype=np.float64).reshape(-1, 3)
+            kps[:, :2] *= (sx, sy)
+            obj['keypoints'] = kps.ravel().tolist()
+        if 'area' in obj:
+            obj['area'] = obj['area'] * sx * sy
+    return anns
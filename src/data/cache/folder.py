@@ -0,0 +1,123 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/19 10:05
+# @Author : liumin
+# @File : folder.py
+
+import os
+import tempfile
+from fnmatch import fnmatch
+from pathlib import Path
+
+import numpy as np
+
+"""
+    File manifest of a folder classification dataset (IMG_DIR/<class>/<image>).
+
+    <IMG_DIR>.manifest.npz
+        files                       image paths relative to IMG_DIR, utf-8 bytes
+        labels                      int64 class index per image, -1 when unlabeled
+        classes                     class directory names, in label order
+        dirs, dir_mtime             every scanned directory and its st_mtime_ns
+
+    Adding, removing or renaming an image changes the mtime of its directory, so the manifest is
+    validated with one stat per directory instead of listing every file. It is written atomically
+    by whichever process gets there first (local rank 0 in the trainers) and then only loaded.
+    Paths and labels stay numpy arrays, which DataLoader workers share without copy-on-write.
+"""
+
+
+class ImageFolderManifest(object):
+    def __init__(self, root, files, labels, classes):
+        self.root = str(root)
+        self.files = files
+        self.labels = labels
+        self.classes = classes
+        self.class_to_idx = {c: i for i, c in enumerate(classes)}
+
+    def __getitem__(self, idx):
+        return os.path.join(self.root, os.fsdecode(self.files[idx]))
+
+    def __len__(self):
+        return len(self.files)
+
+
+def manifest_path(img_dir):
+    img_dir = Path(img_dir)
+    return img_dir.with_name(img_dir.name + '.manifest.npz')
+
+
+def scan_image_folder(img_dir, suffix='*.jpg', labeled=True):
+    '''
+        Same file list as walking IMG_DIR and globbing suffix in every sub directory, with a dict
+        class lookup. Returns files, labels, classes, dirs.
+    '''
+    classes = [d.name for d in os.scandir(img_dir) if d.is_dir()] if labeled else []
+    class_to_idx = {c: i for i, c in enumerate(classes)}
+    files, labels, dirs = [], [], ['.']
+    for root, fnames, _ in sorted(os.walk(img_dir)):
+        for fname in sorted(fnames):
+            folder = os.path.join(root, fname)
+            rel = os.path.relpath(folder, img_dir)
+            dirs.append(rel)
+            names = sorted(e.name for e in os.scandir(folder)
+                           if not e.name.startswith('.') and fnmatch(e.name, suffix) and e.is_file())
+            files.extend(os.fsencode(os.path.join(rel, name)) for name in names)
+            labels.extend([class_to_idx[fname] if labeled else -1] * len(names))
+    return files, labels, classes, dirs
+
+
+def dir_mtimes(img_dir, dirs):
+    mtimes = np.full(len(dirs), -1, dtype=np.int64)
+    for i, d in enumerate(dirs):
+        try:
+            mtimes[i] = os.stat(os.path.join(img_dir, d)).st_mtime_ns
+        except OSError:
+            pass
+    return mtimes
+
+
+def load_manifest_file(path, img_dir, suffix, labeled):
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as m:
+        if str(m['suffix']) != suffix or bool(m['labeled']) != labeled:
+            return None
+        dirs = [os.fsdecode(d) for d in m['dirs']]
+        if not np.array_equal(dir_mtimes(img_dir, dirs), m['dir_mtime']):
+            return None
+        return ImageFolderManifest(img_dir, m['files'], m['labels'], [str(c) for c in m['classes']])
+
+
+def save_manifest_file(path, manifest, suffix, labeled, dirs):
+    path = Path(path)
+    tmp = path.with_name('{}.tmp{}.npz'.format(path.stem, os.getpid()))
+    np.savez(tmp, files=manifest.files, labels=manifest.labels, classes=np.array(manifest.classes, dtype=np.str_),
+             dirs=np.array([os.fsencode(d) for d in dirs], dtype=np.bytes_),
+             dir_mtime=dir_mtimes(manifest.root, dirs), suffix=suffix, labeled=labeled)
+    os.replace(tmp, path)
+
+
+def load_image_folder(img_dir, suffix='*.jpg', labeled=True):
+    '''
+        Returns the ImageFolderManifest of img_dir, scanning the folder only when the manifest is
+        missing or stale. Falls back to the temp dir when next to IMG_DIR is not writeable.
+    '''
+    img_dir = str(img_dir)
+    paths = [manifest_path(img_dir), Path(tempfile.gettempdir()) / manifest_path(img_dir).name]
+    for path in paths:
+        manifest = load_manifest_file(path, img_dir, suffix, labeled)
+        if manifest is not None:
+            return manifest
+
+    print(f'Scanning {img_dir} ...')
+    files, labels, classes, dirs = scan_image_folder(img_dir, suffix, labeled)
+    manifest = ImageFolderManifest(img_dir, np.array(files, dtype=np.bytes_), np.array(labels, dtype=np.int64), classes)
+    for path in paths:
+        try:
+            save_manifest_file(path, manifest, suffix, labeled, dirs)
+            print(f'File manifest saved: {path}')
+            break
+        except OSError as e:
+            print(f'WARNING: {path.parent} is not writeable: {e}')
+    return manifest
@@ -0,0 +1,48 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/24 9:50
+# @Author : liumin
+# @File : loader_pool.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+    Concurrent loading of the images of one multi-image sample (mosaic, MixUp) inside a worker.
+
+    cv2.imread/imdecode and file reads release the GIL, so with LOAD_THREADS the LOAD_NUM tiles
+    of a sample are read and decoded by a small thread pool of the DataLoader worker instead of one
+    after the other. Per-sample latency drops without more worker processes, each of which would
+    hold its own copy of the dataset, LRU cache and reservoir.
+"""
+
+
+class ThreadedLoader(object):
+    def __init__(self, num_threads=1):
+        self.num_threads = max(1, int(num_threads))
+        self._pool = None
+        self._pid = None
+
+    def map(self, fn, items):
+        '''
+            [fn(item) for item in items], run on the pool when there is more than one item.
+        '''
+        items = list(items)
+        if self.num_threads == 1 or len(items) < 2:
+            return [fn(item) for item in items]
+        if self._pool is None or self._pid != os.getpid():
+            # created in the worker process, a pool forked from the parent has no threads
+            self._pool = ThreadPoolExecutor(self.num_threads)
+            self._pid = os.getpid()
+        return list(self._pool.map(fn, items))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_pid'] = None
+        return state
+
+
+def build_loader_pool(data_cfg, stage):
+    num_threads = data_cfg.LOAD_THREADS if data_cfg.__contains__('LOAD_THREADS') and stage == 'train' else 1
+    return ThreadedLoader(num_threads)
@@ -0,0 +1,126 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/16 16:05
+# @Author : liumin
+# @File : lru.py
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from torch.utils.data import get_worker_info
+
+from .stats import WorkerCounters
+
+"""
+    Byte-budgeted LRU cache of decoded samples, for datasets too large to cache fully.
+
+    Every DataLoader worker owns one instance (the dataset is forked into each worker), so the
+    configured budget is split evenly between the workers on first use. Mosaic/MixUp draw extra
+    random images for every sample, so even a partial cache removes a large share of the decodes.
+    Lookups are thread-safe (LOAD_THREADS), loads of missing keys run outside the lock.
+    The counters of all workers are summed by report(), which the trainer logs every epoch.
+"""
+
+
+class LRUImageCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.budget = None
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = WorkerCounters(('hits', 'misses', 'evictions', 'entries', 'nbytes', 'budget'))
+
+    def _init_budget(self):
+        info = get_worker_info()
+        num_workers = info.num_workers if info is not None else 1
+        self.budget = self.max_bytes // max(num_workers, 1)
+
+    def get(self, key, loader):
+        '''
+            Returns a private copy of the cached value of key, calling loader(key) on a miss.
+            Values are ndarrays or tuples of ndarrays.
+        '''
+        if self.budget is None:
+            self._init_budget()
+
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+        if value is None:
+            value = loader(key)
+            with self._lock:
+                self.misses += 1
+                self.put(key, value)
+        self.counters.set(self.hits, self.misses, self.evictions, len(self._data), self.nbytes, self.budget)
+        return _copy(value)
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        if size > self.budget or key in self._data:
+            return
+        while self._data and self.nbytes + size > self.budget:
+            _, old = self._data.popitem(last=False)
+            self.nbytes -= _nbytes(old)
+            self.evictions += 1
+        self._data[key] = value
+        self.nbytes += size
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._data), nbytes=self.nbytes, budget=self.budget or 0)
+
+    def summary(self):
+        return 'hits {}, misses {}, hit rate {:.1f}%, evictions {}, {} entries, {:.2f}/{:.2f} GB'.format(
+            self.hits, self.misses, 100.0 * self.hit_rate, self.evictions, len(self._data),
+            self.nbytes / (1 << 30), (self.budget or 0) / (1 << 30))
+
+    def report(self):
+        '''
+            Counters summed over the DataLoader workers, call it in the main process.
+        '''
+        c, workers = self.counters.totals()
+        return 'LRU cache ({} workers): hits {:.0f}, misses {:.0f}, hit rate {:.1f}%, evictions {:.0f}, {:.0f} entries, {:.2f}/{:.2f} GB'.format(
+            workers, c['hits'], c['misses'], 100.0 * c['hits'] / max(c['hits'] + c['misses'], 1), c['evictions'],
+            c['entries'], c['nbytes'] / (1 << 30), c['budget'] / (1 << 30))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def _nbytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(v.nbytes for v in value)
+    return value.nbytes
+
+
+def _copy(value):
+    # transforms modify images in place, never hand out the cached buffer itself
+    if isinstance(value, (tuple, list)):
+        return tuple(np.array(v) for v in value)
+    return np.array(value)
+
+
+def build_lru_cache(data_cfg, stage):
+    if stage == 'infer' or not data_cfg.__contains__('CACHE_MAX_GB') or not data_cfg.CACHE_MAX_GB:
+        return None
+    return LRUImageCache(float(data_cfg.CACHE_MAX_GB) * (1 << 30))
@@ -0,0 +1,85 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/18 10:20
+# @Author : liumin
+# @File : manifest.py
+
+import hashlib
+import os
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+"""
+    Per-entry file manifest of a packed cache.
+
+    root/
+        manifest_path.npy           source path of every entry
+        manifest_size.npy           st_size at the time the entry was cached, -1 if missing
+        manifest_mtime.npy          st_mtime_ns at the time the entry was cached
+
+    The sources are stat-ed with one os.scandir pass per directory instead of one stat call per
+    file, and meta['hash'] is the md5 of the whole manifest. An unchanged dataset is recognized by
+    a single hash compare; a changed one is diffed entry by entry so only new or modified files
+    are read again.
+"""
+
+MANIFEST_KEYS = ('path', 'size', 'mtime')
+
+
+def scan_manifest(paths):
+    '''
+        Returns (size, mtime_ns) int64 arrays aligned with paths.
+    '''
+    size = np.full(len(paths), -1, dtype=np.int64)
+    mtime = np.full(len(paths), -1, dtype=np.int64)
+    by_dir = defaultdict(dict)
+    for i, p in enumerate(paths):
+        by_dir[os.path.dirname(p)][os.path.basename(p)] = i
+
+    for dirname, names in by_dir.items():
+        try:
+            it = os.scandir(dirname or '.')
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                i = names.get(entry.name)
+                if i is None:
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                size[i] = st.st_size
+                mtime[i] = st.st_mtime_ns
+    return size, mtime
+
+
+def manifest_hash(paths, size, mtime, key=None):
+    # key: build options that change the cached bytes (e.g. the pre-resize size)
+    h = hashlib.md5('\n'.join(paths).encode())
+    h.update(np.ascontiguousarray(size, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(mtime, dtype=np.int64).tobytes())
+    if key is not None:
+        h.update(str(key).encode())
+    return h.hexdigest()
+
+
+def save_manifest(writer, paths, size, mtime):
+    writer.save_array('manifest_path', np.array(paths, dtype=np.str_))
+    writer.save_array('manifest_size', size)
+    writer.save_array('manifest_mtime', mtime)
+
+
+def load_manifest(root):
+    '''
+        Returns (paths, size, mtime) stored in root, or None when the cache has no manifest.
+    '''
+    root = Path(root)
+    files = [root / 'manifest_{}.npy'.format(k) for k in MANIFEST_KEYS]
+    if not all(f.is_file() for f in files):
+        return None
+    paths, size, mtime = (np.load(f) for f in files)
+    return [str(p) for p in paths], size, mtime
@@ -0,0 +1,286 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/16 10:12
+# @Author : liumin
+# @File : packed.py
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+"""
+    Packed on-disk image cache.
+
+    root/
+        meta.json                   hash and layout information
+        shard_00000.bin ...         contiguous uint8 blobs, one image after another
+        shard.npy  offset.npy       per-entry shard id and byte offset
+        length.npy shape.npy        per-entry byte length and (H, W, C) shape, C == 0 for 2-D arrays
+        src_shape.npy               per-entry (H, W) of the source image, 0 when stored at full size
+
+    In 'raw' mode the shards hold decoded pixels. In 'encoded' mode they hold the original
+    compressed file bytes (jpg/png), which are decoded with cv2.imdecode on every read, so the
+    cache stays close to the on-disk dataset size.
+
+    Shards are opened through np.memmap, so startup only reads the small index, the page cache
+    is shared by every DataLoader worker and DDP rank on the node, and resident memory is bounded
+    by what is actually touched.
+"""
+
+SHARD_NAME = 'shard_{:05d}.bin'
+INDEX_KEYS = ('shard', 'offset', 'length', 'shape', 'src_shape')
+
+
+class PackedImageWriter(object):
+    '''
+        Streams images into shard files under `root.tmp`, then renames it to `root` on close,
+        so a reader never sees a partially written cache.
+
+        With base (a PackedImageReader of root) the writer appends instead: unchanged entries keep
+        their old location, new bytes go to new shard files in root, and the index is replaced file
+        by file at close, meta.json last. Readers that are already open keep working on the old index.
+
+        With resume_key, the partial index is checkpointed to progress.npz every checkpoint_every
+        added entries. A later writer with the same key continues after the last checkpoint instead
+        of starting over; see pending().
+    '''
+    def __init__(self, root, num_entries, shard_bytes=4 << 30, base=None, resume_key=None, checkpoint_every=1000):
+        self.root = Path(root)
+        self.base = base
+        self.resume_key = resume_key
+        self.checkpoint_every = checkpoint_every
+        if base is None:
+            self.tmp_root = self.root.with_name(self.root.name + '.tmp')
+        else:
+            self.tmp_root = self.root
+
+        self.shard_bytes = int(shard_bytes)
+        self.shard = np.full(num_entries, -1, dtype=np.int32)
+        self.offset = np.zeros(num_entries, dtype=np.int64)
+        self.length = np.zeros(num_entries, dtype=np.int64)
+        self.shape = np.zeros((num_entries, 3), dtype=np.int32)
+        self.src_shape = np.zeros((num_entries, 2), dtype=np.int32)
+
+        self._first_shard = base.meta['num_shards'] if base is not None else 0
+        self._shard_id = self._first_shard - 1
+        self._fd = None
+        self._pos = 0
+        self._since_checkpoint = 0
+        self.resumed = 0
+
+        if not self._resume() and base is None:
+            if self.tmp_root.exists():
+                shutil.rmtree(self.tmp_root)
+            self.tmp_root.mkdir(parents=True)
+
+    @property
+    def progress_path(self):
+        return self.tmp_root / 'progress.npz'
+
+    def _resume(self):
+        if self.resume_key is None or not self.progress_path.is_file():
+            return False
+        with np.load(self.progress_path) as progress:
+            if str(progress['key']) != self.resume_key or len(progress['shard']) != len(self.shard) \
+                    or not all(k in progress for k in INDEX_KEYS):
+                return False
+            for k in INDEX_KEYS:
+                getattr(self, k)[:] = progress[k]
+            self._shard_id, self._pos = int(progress['shard_id']), int(progress['pos'])
+        if self._shard_id >= self._first_shard:
+            # drop whatever was written to the open shard after the checkpoint
+            self._fd = open(self.tmp_root / SHARD_NAME.format(self._shard_id), 'r+b')
+            self._fd.truncate(self._pos)
+            self._fd.seek(self._pos)
+        self.resumed = int((self.shard >= self._first_shard).sum())
+        return True
+
+    def pending(self):
+        return np.flatnonzero(self.shard < 0).tolist()
+
+    def checkpoint(self):
+        if self.resume_key is None:
+            return
+        if self._fd is not None:
+            self._fd.flush()
+            os.fsync(self._fd.fileno())
+        tmp = self.tmp_root / 'progress.tmp.npz'
+        np.savez(tmp, key=self.resume_key, shard_id=self._shard_id, pos=self._pos,
+                 **{k: getattr(self, k) for k in INDEX_KEYS})
+        os.replace(tmp, self.progress_path)
+        self._since_checkpoint = 0
+
+    def _next_shard(self):
+        if self._fd is not None:
+            self._fd.close()
+        self._shard_id += 1
+        self._fd = open(self.tmp_root / SHARD_NAME.format(self._shard_id), 'wb')
+        self._pos = 0
+
+    def add(self, idx, img, src_shape=None):
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        nbytes = img.nbytes
+        if self._fd is None or (self._pos > 0 and self._pos + nbytes > self.shard_bytes):
+            self._next_shard()
+        self._fd.write(img.tobytes())
+
+        self.shard[idx] = self._shard_id
+        self.offset[idx] = self._pos
+        self.length[idx] = nbytes
+        if img.ndim == 3:
+            self.shape[idx] = img.shape
+        elif img.ndim == 2:
+            self.shape[idx] = img.shape + (0,)
+        if src_shape is not None:
+            self.src_shape[idx] = src_shape[:2]
+        self._pos += nbytes
+
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def reuse(self, idx, base_idx):
+        # keep entries that did not change at their location in the base cache
+        for k in INDEX_KEYS:
+            getattr(self, k)[idx] = getattr(self.base, k)[base_idx]
+
+    def save_array(self, name, arr):
+        path = self.tmp_root / '{}.npy'.format(name)
+        if self.base is None:
+            np.save(path, arr)
+        else:
+            tmp = self.tmp_root / '{}.tmp.npy'.format(name)
+            np.save(tmp, arr)
+            os.replace(tmp, path)
+
+    def close(self, mode='raw', flags=cv2.IMREAD_COLOR, **meta):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        assert (self.shard >= 0).all(), 'some cache entries were never written'
+
+        for k in INDEX_KEYS:
+            self.save_array(k, getattr(self, k))
+        num_shards = self._shard_id + 1
+        disk_bytes = sum((self.tmp_root / SHARD_NAME.format(i)).stat().st_size for i in range(num_shards)
+                         if (self.tmp_root / SHARD_NAME.format(i)).is_file())
+        meta.update(mode=mode, flags=int(flags), num_entries=len(self.shard), num_shards=num_shards,
+                    nbytes=int(self.length.sum()), disk_bytes=int(disk_bytes))
+        with open(self.tmp_root / 'meta.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.tmp_root / 'meta.json.tmp', self.tmp_root / 'meta.json')
+        if self.progress_path.is_file():
+            self.progress_path.unlink()
+
+        if self.base is None:
+            if self.root.exists():
+                shutil.rmtree(self.root)
+            os.replace(self.tmp_root, self.root)
+
+    def abort(self):
+        '''
+            Checkpoints what was written so far when resumable, otherwise removes it.
+        '''
+        if self.resume_key is not None:
+            self.checkpoint()
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+            return
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        if self.base is None:
+            shutil.rmtree(self.tmp_root, ignore_errors=True)
+        else:
+            for i in range(self._first_shard, self._shard_id + 1):
+                (self.tmp_root / SHARD_NAME.format(i)).unlink()
+
+
+class PackedImageReader(object):
+    '''
+        Random access to a packed cache. Returned arrays are private copies, because
+        the transforms modify images in place and the shards are mapped read-only.
+    '''
+    def __init__(self, root):
+        self.root = Path(root)
+        self.meta = load_meta(self.root)
+        self.encoded = self.meta.get('mode', 'raw') == 'encoded'
+        self.flags = self.meta.get('flags', cv2.IMREAD_COLOR)
+        for k in INDEX_KEYS:
+            path = self.root / '{}.npy'.format(k)
+            if k == 'src_shape' and not path.is_file():
+                # caches written before pre-resizing existed
+                self.src_shape = np.zeros((len(self.shard), 2), dtype=np.int32)
+                continue
+            setattr(self, k, np.load(path))
+        self.resized = self.meta.get('max_size') is not None
+        self._shards = {}
+
+    @staticmethod
+    def is_valid(root, hash=None, mode=None):
+        meta = load_meta(root)
+        if meta is None:
+            return False
+        if mode is not None and meta.get('mode', 'raw') != mode:
+            return False
+        return hash is None or meta.get('hash') == hash
+
+    def _get_shard(self, shard_id):
+        mm = self._shards.get(shard_id)
+        if mm is None:
+            mm = np.memmap(self.root / SHARD_NAME.format(shard_id), dtype=np.uint8, mode='r')
+            self._shards[shard_id] = mm
+        return mm
+
+    def get_bytes(self, idx):
+        start = self.offset[idx]
+        return self._get_shard(self.shard[idx])[start:start + self.length[idx]]
+
+    def __getitem__(self, idx):
+        buf = self.get_bytes(idx)
+        if self.encoded:
+            return cv2.imdecode(buf, self.flags)
+        h, w, c = self.shape[idx]
+        return np.array(buf).reshape((h, w, c) if c else (h, w))
+
+    def source_scale(self, idx, img):
+        '''
+            (sx, sy) from the source image of entry idx to img, a decoded copy of that entry.
+        '''
+        h0, w0 = self.src_shape[idx]
+        if not h0:
+            return None
+        h, w = img.shape[:2]
+        return w / w0, h / h0
+
+    def __len__(self):
+        return len(self.shard)
+
+    @property
+    def nbytes(self):
+        return int(self.length.sum())
+
+    def summary(self, total=None):
+        total = len(self) if total is None else total
+        return '{}/{} entries cached ({:.1f}%), mode={}, max_size={}, {:.2f} GB in {} shards'.format(
+            len(self), total, 100.0 * len(self) / max(total, 1), self.meta.get('mode', 'raw'),
+            self.meta.get('max_size'), self.nbytes / (1 << 30), self.meta.get('num_shards', 0))
+
+    def __getstate__(self):
+        # memmaps are re-opened lazily in each worker instead of being pickled by value
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+
+def load_meta(root):
+    meta_path = Path(root) / 'meta.json'
+    if not meta_path.is_file():
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
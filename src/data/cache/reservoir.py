@@ -0,0 +1,123 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/23 16:40
+# @Author : liumin
+# @File : reservoir.py
+
+import random
+
+import cv2
+import numpy as np
+
+from .resize import resize_scale
+from .stats import WorkerCounters
+
+"""
+    Reservoir of recently decoded training images that mosaic and MixUp partners are drawn from.
+
+    With LOAD_NUM: 4 every sample decodes its own image plus three random ones, 4x the dataset per
+    epoch. With RESERVOIR_SIZE the dataset decodes only the indexed image; the LOAD_NUM - 1
+    partners are copies drawn from a reservoir of the images this worker decoded recently, and the
+    indexed image is then offered to the reservoir. Every DataLoader worker owns its reservoir.
+
+    Randomness, with R = RESERVOIR_SIZE, p = RESERVOIR_REFRESH and k = LOAD_NUM - 1:
+        - Partners are drawn uniformly with replacement from the R entries, as random.choices draws
+          them from the dataset. Once full, every decoded image replaces a uniformly chosen entry
+          with probability p, so an entry survives a geometric number of samples with mean R / p.
+        - An image that enters is drawn k / p times on average (k, the random.choices expectation,
+          for p = 1), and a fraction p of the images enters at all: lower p trades diversity for
+          fewer reservoir copies. The total number of partner draws per epoch is unchanged.
+        - The use counts are more spread than with random.choices because of the geometric
+          lifetimes: a fraction of about p * k / (k + p) of the images serves as a partner at least
+          once per epoch (0.75 for k = 3, p = 1) against 1 - exp(-k) (0.95) for random.choices.
+        - Partners come from the last ~R / p images of the same worker, which are themselves a
+          uniform random slice of the sampler order, so no class or image is favoured; only images
+          far apart in the epoch order never meet in one mosaic. The partners of the first R / 4
+          samples of a worker are still read from disk (warm-up) instead of a near empty reservoir.
+    With RESERVOIR_MAX_SIZE the entries are stored shrunk like CACHE_MAX_SIZE, which bounds the
+    memory at R images of that size per worker; annotations are scaled along as for the cache.
+    The counters of all workers are summed by report(), which the trainer logs every epoch.
+"""
+
+
+class SampleReservoir(object):
+    def __init__(self, size, refresh=1.0, max_size=None):
+        assert size > 0 and 0 < refresh <= 1, 'reservoir size must be > 0 and refresh in (0, 1]'
+        self.size = int(size)
+        self.refresh = refresh
+        self.max_size = max_size
+        self.min_fill = max(1, self.size // 4)
+        self.offers = 0
+        self.inserts = 0
+        self.draws = 0
+        self.warmup = 0
+        self.nbytes = 0
+        self._keys = []
+        self._data = []
+        self.counters = WorkerCounters(('offers', 'inserts', 'draws', 'warmup', 'entries', 'size', 'nbytes'))
+
+    def draw(self, k):
+        '''
+            k (key, (img, scale)) partners, private copies, or None while the reservoir warms up.
+        '''
+        if len(self._data) < self.min_fill:
+            self.warmup += k
+            return None
+        self.draws += k
+        picks = random.choices(range(len(self._data)), k=k)
+        return [(self._keys[i], (np.array(self._data[i][0]), self._data[i][1].copy())) for i in picks]
+
+    def offer(self, key, image):
+        '''
+            Offers the (img, scale) just decoded for key. img is copied (or shrunk) before it is kept.
+        '''
+        self.offers += 1
+        if len(self._data) < self.size:
+            slot = len(self._data)
+            self._keys.append(None)
+            self._data.append(None)
+        elif random.random() < self.refresh:
+            slot = random.randrange(self.size)
+        else:
+            slot = None
+        if slot is not None:
+            if self._data[slot] is not None:
+                self.nbytes -= self._data[slot][0].nbytes
+            self._keys[slot] = key
+            self._data[slot] = self._shrink(*image)
+            self.nbytes += self._data[slot][0].nbytes
+            self.inserts += 1
+        self.counters.set(self.offers, self.inserts, self.draws, self.warmup, len(self._data), self.size, self.nbytes)
+
+    def _shrink(self, img, scale):
+        f = resize_scale(img.shape[0], img.shape[1], self.max_size) if self.max_size is not None else 1.0
+        if f >= 1:
+            return np.array(img), np.array(scale, dtype=np.float32)
+        h, w = max(1, int(round(img.shape[0] * f))), max(1, int(round(img.shape[1] * f)))
+        small = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+        return small, np.array(scale, dtype=np.float32) * (w / img.shape[1], h / img.shape[0])
+
+    def summary(self):
+        return '{} offers, {} inserted, {} partners drawn, {} read during warm-up, {}/{} entries, {:.2f} GB'.format(
+            self.offers, self.inserts, self.draws, self.warmup, len(self._data), self.size, self.nbytes / (1 << 30))
+
+    def report(self):
+        '''
+            Counters summed over the DataLoader workers, call it in the main process.
+        '''
+        c, workers = self.counters.totals()
+        return 'Reservoir ({} workers): {:.0f} offers, {:.0f} inserted, {:.0f} partners drawn, {:.0f} read during warm-up, {:.0f}/{:.0f} entries, {:.2f} GB'.format(
+            workers, c['offers'], c['inserts'], c['draws'], c['warmup'], c['entries'], c['size'], c['nbytes'] / (1 << 30))
+
+    def __len__(self):
+        return len(self._data)
+
+
+def build_reservoir(data_cfg, stage):
+    if stage != 'train' or not data_cfg.__contains__('RESERVOIR_SIZE') or not data_cfg.RESERVOIR_SIZE:
+        return None
+    refresh = data_cfg.RESERVOIR_REFRESH if data_cfg.__contains__('RESERVOIR_REFRESH') else 1.0
+    max_size = data_cfg.RESERVOIR_MAX_SIZE if data_cfg.__contains__('RESERVOIR_MAX_SIZE') else None
+    if isinstance(max_size, (list, tuple)):
+        max_size = tuple(max_size)
+    return SampleReservoir(data_cfg.RESERVOIR_SIZE, refresh, max_size)
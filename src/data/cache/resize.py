@@ -0,0 +1,48 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/20 10:30
+# @Author : liumin
+# @File : resize.py
+
+import cv2
+
+"""
+    Pre-resized cache entries.
+
+    Training and evaluation only ever see an image after it was shrunk to the network input
+    (640 long side for yolov5, 256 short side for imagenet, ...), so with CACHE_MAX_SIZE the cache
+    stores every image once at that resolution instead of the full-size original. The size follows
+    torchvision's Resize: an int bounds the shorter side, [h, w] fits the image inside h x w in
+    either orientation. Images are never enlarged.
+
+    The original (h, w) of every entry is kept in src_shape.npy. Readers derive the per-image
+    (sx, sy) scale from it, datasets scale the annotations with it, and detection targets carry it
+    as src_scales so predictions are still mapped back to the original image through scales/pads.
+"""
+
+
+def resize_scale(h0, w0, size):
+    if isinstance(size, int):
+        return min(1.0, size / min(h0, w0))
+    return min(1.0, max(min(size[0] / h0, size[1] / w0), min(size[0] / w0, size[1] / h0)))
+
+
+def read_resized(path, mode, size, loader, interpolation=cv2.INTER_AREA):
+    '''
+        Cache loader: loader(path, 'raw') shrunk to size, re-encoded in 'encoded' mode.
+        Returns (buf, (h0, w0)) with the original image shape.
+    '''
+    img = loader(path, 'raw')
+    assert img is not None, 'Image Not Found: {}'.format(path)
+    h0, w0 = img.shape[:2]
+    scale = resize_scale(h0, w0, size)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, int(round(w0 * scale))), max(1, int(round(h0 * scale)))),
+                         interpolation=interpolation)
+    if mode == 'encoded':
+        # labels and png sources stay lossless
+        if img.ndim == 2 or path.lower().endswith('.png'):
+            img = cv2.imencode('.png', img)[1]
+        else:
+            img = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 95])[1]
+    return img, (h0, w0)
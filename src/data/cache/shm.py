@@ -0,0 +1,130 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/17 14:30
+# @Author : liumin
+# @File : shm.py
+
+import hashlib
+import os
+import re
+import shutil
+from pathlib import Path
+
+from .packed import PackedImageReader, load_meta
+
+"""
+    Node-wide shared-memory copy of a packed cache.
+
+    The first process on a node (local rank 0, the trainers build datasets under
+    torch_distributed_zero_first) copies the finished on-disk cache into /dev/shm. Every other
+    rank and DataLoader worker on the node then maps the same tmpfs pages read-only, so the
+    node holds exactly one copy of the cache in RAM, whatever the number of ranks and workers.
+
+    A copy is named after the resolved path of the cache and its content hash, so caches of
+    different datasets never share a name and a rebuilt or updated cache gets a new copy. Copies
+    are never removed while staging, since DataLoader workers reopen the shards by path every
+    epoch and a job may still run on an older copy. Staging only removes the tmp directories of
+    copies whose process is gone; older copies are removed explicitly with scripts/clean_shm.py,
+    when no job uses them any more.
+"""
+
+SHM_ROOT = '/dev/shm'
+SOURCE_FILE = 'source.txt'
+
+
+def _source_id(cache_path):
+    return hashlib.md5(str(Path(cache_path).resolve()).encode()).hexdigest()[:8]
+
+
+def shm_path(cache_path):
+    meta = load_meta(cache_path)
+    name = '{}_{}_{}_{}'.format(Path(cache_path).name, _source_id(cache_path), meta.get('mode', 'raw'), meta['hash'][:12])
+    return Path(SHM_ROOT) / 'cvpytorch' / name
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _dir_bytes(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+
+def remove_dead_tmp(root=None):
+    '''
+        Removes the tmp directories of copies whose process is gone. Returns the number of bytes freed.
+    '''
+    root = Path(root or Path(SHM_ROOT) / 'cvpytorch')
+    if not root.is_dir():
+        return 0
+    freed = 0
+    for entry in root.iterdir():
+        match = re.search(r'\.tmp(\d+)$', entry.name)
+        if match is None or _pid_alive(int(match.group(1))):
+            continue
+        freed += _dir_bytes(entry)
+        shutil.rmtree(entry, ignore_errors=True)
+        print(f'Removed unfinished shared memory copy {entry}')
+    return freed
+
+
+def stale_copies(root=None):
+    '''
+        Copies in /dev/shm whose source cache is gone or has been rebuilt or updated since.
+    '''
+    root = Path(root or Path(SHM_ROOT) / 'cvpytorch')
+    if not root.is_dir():
+        return []
+    stale = []
+    for entry in sorted(root.iterdir()):
+        if not entry.is_dir() or '.tmp' in entry.name:
+            continue
+        source = entry / SOURCE_FILE
+        source = Path(source.read_text().strip()) if source.is_file() else None
+        if source is None or load_meta(source) is None or shm_path(source).name != entry.name:
+            stale.append(entry)
+    return stale
+
+
+def stage_to_shm(cache_path):
+    '''
+        Returns the path of the /dev/shm copy of cache_path, creating it if needed.
+        Falls back to cache_path when /dev/shm is missing or too small.
+    '''
+    cache_path = Path(cache_path)
+    meta = load_meta(cache_path)
+    target = shm_path(cache_path)
+    if PackedImageReader.is_valid(target, meta['hash'], meta.get('mode', 'raw')):
+        return target
+
+    if not os.path.isdir(SHM_ROOT):
+        print(f'WARNING: {SHM_ROOT} is not available, cache {cache_path} is used from disk.')
+        return cache_path
+    remove_dead_tmp(target.parent)
+    nbytes = _dir_bytes(cache_path)
+    free = shutil.disk_usage(SHM_ROOT).free
+    if nbytes > free:
+        print(f'WARNING: cache {cache_path} needs {nbytes / (1 << 30):.2f} GB but {SHM_ROOT} has '
+              f'{free / (1 << 30):.2f} GB free, it is used from disk. Older copies can be removed '
+              f'with scripts/clean_shm.py.')
+        return cache_path
+
+    tmp = target.with_name('{}.tmp{}'.format(target.name, os.getpid()))
+    try:
+        shutil.copytree(cache_path, tmp)
+        (tmp / SOURCE_FILE).write_text(str(cache_path.resolve()))
+        if target.exists():
+            shutil.rmtree(target)
+        os.replace(tmp, target)
+    except OSError as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        print(f'WARNING: failed to stage cache {cache_path} into {SHM_ROOT}: {e}')
+        return cache_path
+    print(f'Cache {cache_path} is staged into shared memory {target}')
+    return target
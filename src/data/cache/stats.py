@@ -0,0 +1,50 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/16 16:05
+# @Author : liumin
+# @File : stats.py
+
+import os
+
+import torch
+from torch.utils.data import get_worker_info
+
+"""
+    Counters of the per-worker caches, readable from the main process.
+
+    The LRU cache and the reservoir live in the DataLoader workers, so their counters are mirrored
+    into a block in shared memory, allocated in the main process when the dataset is built. Every
+    worker overwrites its own row with its current values (no locking), and the trainer sums the
+    rows and logs them at the end of the epoch, like the PROFILE counters.
+"""
+
+
+class WorkerCounters(object):
+    '''
+        :param fields: names of the counters, one column each.
+        :param max_workers: rows of the block, DataLoader workers beyond it share rows.
+    '''
+    def __init__(self, fields, max_workers=64):
+        self.fields = tuple(fields)
+        self.rows = torch.zeros(max_workers, len(self.fields), dtype=torch.float64).share_memory_()
+        self._view = None
+
+    def set(self, *values):
+        pid = os.getpid()
+        if self._view is None or self._view[0] != pid:
+            info = get_worker_info()
+            row = (info.id if info is not None else 0) % self.rows.shape[0]
+            self._view = (pid, self.rows.numpy()[row])
+        self._view[1][:] = values
+
+    def totals(self):
+        '''
+            Counters summed over the workers, and the number of workers that reported.
+        '''
+        rows = self.rows.numpy()
+        return dict(zip(self.fields, rows.sum(0).tolist())), int((rows != 0).any(1).sum())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_view'] = None
+        return state
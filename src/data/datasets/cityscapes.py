@@ -5,23 +5,62 @@
 # @File : cityscapes.py
 
 import os
-import hashlib
+from functools import partial
 from multiprocessing.pool import Pool
 from pathlib import Path
 
+import cv2
 from glob2 import glob
 import numpy as np
 from PIL import Image
-from torch.utils.data import Dataset
 from tqdm import tqdm
+from torch.utils.data import Dataset
 
 from src.utils import palette
+from src.data.cache import PackedImageReader, update_image_cache, cache_options, build_lru_cache, stage_to_shm
 
 """
     Cityscapes dataset
     https://www.cityscapes-dataset.com/
 """
 
+INVALID_CLASSES = [0, 1, 2, 3, 4, 5, 6, 9, 10, 14, 15, 16, 18, 29, 30, -1]
+VALID_CLASSES = [7, 8, 11, 12, 13, 17, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 31, 32, 33]
+
+
+def build_label_lut(ignore_index=255):
+    # 256-entry labelId -> trainId table, void classes go to ignore_index, unknown ids stay as they are
+    lut = np.arange(256, dtype=np.uint8)
+    lut[[c for c in INVALID_CLASSES if c >= 0]] = ignore_index
+    lut[VALID_CLASSES] = np.arange(len(VALID_CLASSES), dtype=np.uint8)
+    return lut
+
+
+LABEL_LUT = build_label_lut()
+
+
+def encode_label(target, lut=LABEL_LUT):
+    # single pass over the label instead of one masked assignment per class id
+    return cv2.LUT(np.asarray(target, dtype=np.uint8), lut)
+
+
+def load_target(path, mode, remap=True):
+    # packed into the targets cache, png-encoded in 'encoded' mode
+    target = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    assert target is not None, 'Label Not Found: {}'.format(path)
+    if remap:
+        target = encode_label(target)
+    return cv2.imencode('.png', target)[1] if mode == 'encoded' else target
+
+
+def save_train_ids(args):
+    src, dst = args
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + '.tmp.png'
+    cv2.imwrite(tmp, load_target(src, 'raw'))
+    os.replace(tmp, dst)
+
+
 class CityscapesSegmentation(Dataset):
     ignore_index = 255
     def __init__(self, data_cfg, dictionary=None, transform=None, target_transform=None, stage='train'):
@@ -31,6 +70,9 @@ class CityscapesSegmentation(Dataset):
         self.target_transform = target_transform
         self.stage = stage
         self.is_cache = self.data_cfg.CACHE if hasattr(self.data_cfg, 'CACHE') else False
+        self.cache_mode = data_cfg.CACHE_MODE if data_cfg.__contains__('CACHE_MODE') else 'raw'
+        self.lru = build_lru_cache(data_cfg, self.stage)
+        self.train_ids = data_cfg.SAVE_TRAIN_IDS if data_cfg.__contains__('SAVE_TRAIN_IDS') else False
 
         self.num_classes = len(self.dictionary)
         self.category = [v for d in self.dictionary for v in d.keys()]
@@ -38,9 +80,10 @@ class CityscapesSegmentation(Dataset):
         self.id2category = {v: k for k, v in self.category2id.items()}
         self.palette = palette.CityScpates_palette
 
-        self.invalid_classes = [0, 1, 2, 3, 4, 5, 6, 9, 10, 14, 15, 16, 18, 29, 30, -1]
-        self.valid_classes = [7, 8, 11, 12, 13, 17, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 31, 32, 33]
+        self.invalid_classes = INVALID_CLASSES
+        self.valid_classes = VALID_CLASSES
         self.class_map = dict(zip(self.valid_classes, range(self.num_classes)))
+        self.label_lut = build_label_lut(self.ignore_index)
 
         self._imgs = []
         self._targets = []
@@ -69,9 +112,14 @@ class CityscapesSegmentation(Dataset):
             assert len(self._imgs) == len(self._targets), 'len(self._imgs) should be equals to len(self._targets)'
             assert len(self._imgs) > 0, 'Found 0 images in the specified location, pls check it!'
 
-        # Cache images into memory for faster training (WARNING: large datasets may exceed system RAM)
+        # Remap labelIds to trainIds once, the saved labels are then used as they are
+        if self.train_ids and self.stage != 'infer':
+            self._targets = self.save_train_ids()
+
+        # Pack images and encoded targets into memory-mapped shards
         if self.is_cache and self.stage != 'infer':
-            self.cache = self.cache_data()
+            self.cache, self.cache_targets = self.cache_data()
+            self.is_cache = self.cache is not None
 
     def __getitem__(self, idx):
         if self.stage == 'infer':
@@ -81,75 +129,83 @@ class CityscapesSegmentation(Dataset):
             sample = {'image': _img, 'mask': None}
             return self.transform(sample), img_id
         else:
-            if self.is_cache:
-                sample = self.cache[self._imgs[idx]]
+            if self.lru is not None:
+                _img, _target = self.lru.get(idx, self._read_arrays)
+                sample = {'image': Image.fromarray(_img), 'target': Image.fromarray(_target)}
+            elif self.is_cache:
+                _img, _target = self._read_arrays(idx)
+                sample = {'image': Image.fromarray(_img), 'target': Image.fromarray(_target)}
             else:
                 # _img, _target = Image.open(self._imgs[idx]).convert('RGB'), Image.open(self._targets[idx])
-                _img, _target = Image.open(self._imgs[idx]), Image.open(self._targets[idx])
-                _target = self.encode_target(_target)
+                _img = Image.open(self._imgs[idx])
+                _target = Image.fromarray(load_target(self._targets[idx], 'raw', remap=not self.train_ids))
                 sample = {'image': _img, 'target': _target}
             return self.transform(sample)
 
+    def _read_arrays(self, idx):
+        if self.is_cache:
+            return cv2.cvtColor(self.cache[idx], cv2.COLOR_BGR2RGB), self.cache_targets[idx]
+        _img = np.asarray(Image.open(self._imgs[idx]).convert('RGB'))
+        _target = load_target(self._targets[idx], 'raw', remap=not self.train_ids)
+        return _img, _target
+
     def encode_target(self, target):
-        # This is used to convert tags
-        target = np.asarray(target, dtype=np.uint8).copy()
-        # Put all void classes to zero
-        for _voidc in self.invalid_classes:
-            target[target == _voidc] = self.ignore_index
-        # index from zero 0:18
-        for _validc in self.valid_classes:
-            target[target == _validc] = self.class_map[_validc]
-        target = Image.fromarray(target.astype(np.uint8))
-        return target
+        return Image.fromarray(encode_label(target, self.label_lut))
 
     @classmethod
     def decode_target(self, target):
         target[target == 255] = 19
         return target
 
+    def get_file_paths(self, idx):
+        # files read for sample idx (ReadAheadSampler), none when it comes from the packed cache
+        if self.is_cache:
+            return []
+        return [self._imgs[idx]] + self._targets[idx:idx + 1]
+
     def __len__(self):
         return len(self._imgs)
 
     def cache_data(self):
-        cache = {}  # dict
-        NUM_THREADS = 8
-        cache_path = (Path(self.data_cfg.IMG_DIR)/self.stage).with_suffix('.cache')
-
-        if cache_path.is_file():
-            cache = np.load(cache_path, allow_pickle=True).item()
-            if cache['hash'] == get_hash(self._imgs + self._targets):
-                print(f'{self.stage} :Cache directory {cache_path} is loaded.')
-                return cache
-
-        desc = f"Scanning '{cache_path.parent / cache_path.stem}' images and labels..."
-        with Pool(NUM_THREADS) as pool:
-            pbar = tqdm(pool.imap_unordered(load_image_label, zip(self._imgs, self._targets)),
-                desc=desc, total=self.__len__())
-            for img_id, _img, _target in pbar:
-                _target = self.encode_target(_target)
-                sample = {'image': _img, 'target': _target}
-                cache[img_id] = sample
-            pbar.close()
-        cache['hash'] = get_hash(self._imgs + self._targets)
-        try:
-            np.save(cache_path, cache)  # save cache for next time
-            cache_path.with_suffix('.cache.npy').rename(cache_path)  # remove .npy suffix
-            print(f'{self.stage} :New cache created: {cache_path}')
-        except Exception as e:
-            print(f'{self.stage} :WARNING: Cache directory {cache_path.parent} is not writeable: {e}')  # path not writeable
-        return cache
-
-
-def load_image_label(args):
-    im_file, lb_file = args
-    _img, _target = Image.open(im_file).convert('RGB'), Image.open(lb_file)
-    return im_file, _img, _target
-
-
-def get_hash(paths):
-    # Returns a single hash value of a list of paths (files or dirs)
-    size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))  # sizes
-    h = hashlib.md5(str(size).encode())  # hash sizes
-    h.update(''.join(paths).encode())  # hash paths
-    return h.hexdigest()  # return hash
-
+        cache_path = (Path(self.data_cfg.IMG_DIR)/self.stage).with_suffix('.shards')
+        options = cache_options(self.data_cfg)
+        if self.stage != 'train':
+            # metrics are computed against full resolution labels
+            options['max_size'] = None
+
+        def save_targets(root):
+            loader = partial(load_target, remap=not self.train_ids)
+            targets = update_image_cache(root / 'targets', self._targets, loader=loader, flags=cv2.IMREAD_UNCHANGED,
+                                         desc=f"Scanning '{cache_path.parent / cache_path.stem}' labels...",
+                                         interpolation=cv2.INTER_NEAREST, **options)
+            assert targets is not None, 'Failed to write the targets cache'
+
+        desc = f"Scanning '{cache_path.parent / cache_path.stem}' images..."
+        cache = update_image_cache(cache_path, self._imgs, extras=save_targets, deps=self._targets, desc=desc,
+                                   **options)
+        if cache is None:
+            return None, None
+        if self.data_cfg.__contains__('CACHE_SHM') and self.data_cfg.CACHE_SHM:
+            # one copy per node in /dev/shm, mapped read-only by every rank and worker
+            cache = PackedImageReader(stage_to_shm(cache_path))
+        print(f'{self.stage} :Cache {cache.summary(self.__len__())}')
+        return cache, PackedImageReader(cache.root / 'targets')
+
+    def save_train_ids(self):
+        '''
+            Writes the trainId version of every label into <IMG_DIR>/<stage>.trainIds, next to the
+            packed cache, and returns their paths. Only missing or outdated files are written.
+        '''
+        out_root = (Path(self.data_cfg.IMG_DIR)/self.stage).with_suffix('.trainIds')
+        dsts = [str(out_root / os.path.relpath(p, self.data_cfg.LABELS.SEG_DIR)) for p in self._targets]
+        todo = [(src, dst) for src, dst in zip(self._targets, dsts)
+                if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src)]
+        if todo:
+            with Pool(cache_options(self.data_cfg)['num_workers']) as pool:
+                pbar = tqdm(pool.imap_unordered(save_train_ids, todo), desc=f'Remapping {self.stage} labels to trainIds',
+                            total=len(todo))
+                for _ in pbar:
+                    pass
+                pbar.close()
+        print(f'{self.stage} :{len(todo)} trainId labels written, {len(dsts) - len(todo)} up to date in {out_root}')
+        return dsts
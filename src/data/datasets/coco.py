@@ -3,18 +3,16 @@
 # @Time : 2021/3/11 15:06
 # @Author : liumin
 # @File : coco.py
-import hashlib
 import os
 import random
-from multiprocessing.pool import Pool
 from pathlib import Path
 
 import cv2
 import torch
 from torch.utils.data import Dataset
-from pycocotools.coco import COCO
-import numpy as np
-from tqdm import tqdm
+
+from src.data.cache import PackedImageReader, CocoIndex, update_image_cache, cache_options, build_lru_cache, stage_to_shm, \
+    read_reduced, scale_annotations, build_reservoir, build_loader_pool
 
 """
     MS Coco Detection
@@ -42,42 +40,55 @@ class CocoDetection(Dataset):
         self.transform = transform
         self.target_transform = target_transform
         self.is_cache = self.data_cfg.CACHE if hasattr(self.data_cfg, 'CACHE') else False
+        self.cache_mode = data_cfg.CACHE_MODE if data_cfg.__contains__('CACHE_MODE') else 'raw'
+        self.lru = build_lru_cache(data_cfg, self.stage)
+        # mosaic/mixup partners drawn from recently decoded images instead of decoded from disk
+        self.reservoir = build_reservoir(data_cfg, self.stage) if self.load_num != 1 else None
+        # the images of a multi-image sample are read and decoded concurrently with LOAD_THREADS
+        self.loader_pool = build_loader_pool(data_cfg, self.stage)
+        # size hint for reduced-resolution jpeg decoding, train only so evaluation stays in original pixels
+        self.decode_size = data_cfg.DECODE_SIZE if data_cfg.__contains__('DECODE_SIZE') and self.stage == 'train' else None
 
         self.num_classes = len(self.dictionary)
-        self.coco = COCO(os.path.join(data_cfg.LABELS.DET_DIR, 'instances_{}.json'.format(os.path.basename(data_cfg.IMG_DIR))))
-        self.ids = list(sorted(self.coco.getImgIds()))
+        self.coco_index = CocoIndex.load_or_compile(os.path.join(data_cfg.LABELS.DET_DIR, 'instances_{}.json'.format(os.path.basename(data_cfg.IMG_DIR))))
+        self._coco = None
+        self.ids = list(sorted(int(i) for i in self.coco_index.img_id))
 
         self._filter_invalid_annotation()
 
-        self.category2id = {v: i for i, v in enumerate(self.coco.getCatIds())}
+        self.category2id = {v: i for i, v in enumerate(self.coco_index.get_cat_ids())}
         # just for FCOS
         if hasattr(data_cfg.TRANSFORMS, 'FilterAndRemapCocoCategories') \
                 and hasattr(data_cfg.TRANSFORMS.FilterAndRemapCocoCategories, 'categories') \
                 and len(data_cfg.TRANSFORMS.FilterAndRemapCocoCategories.categories) > 80:
-            self.category2id = {v: i + 1 for i, v in enumerate(self.coco.getCatIds())}
+            self.category2id = {v: i + 1 for i, v in enumerate(self.coco_index.get_cat_ids())}
         self.id2category = {v: k for k, v in self.category2id.items()}
+        # segmentation and keypoints are only decoded when ConvertCocoPolysToMask turns them into targets
+        convert = data_cfg.TRANSFORMS.ConvertCocoPolysToMask if hasattr(data_cfg.TRANSFORMS, 'ConvertCocoPolysToMask') else None
+        self.ann_extras = bool(convert) and bool(convert.get('use_mask') or convert.get('use_keypoints'))
 
-        # Cache images into memory for faster training (WARNING: large datasets may exceed system RAM)
+        # Pack images into memory-mapped shards, pages are shared across workers and ranks
         if self.is_cache and self.stage != 'infer':
-            self.imgpaths = []
-            self.anns = []
-            for img_id in self.ids:
-                ann_ids = self.coco.getAnnIds(imgIds=img_id)
-                ann = self.coco.loadAnns(ann_ids)
-                path = self.coco.loadImgs(img_id)[0]['file_name']
-                self.imgpaths.append(os.path.join(self.data_cfg.IMG_DIR, path))
-                self.anns.append(ann)
+            self.imgpaths = [os.path.join(self.data_cfg.IMG_DIR, self.coco_index.file_name(img_id)) for img_id in self.ids]
+            self.cache_index = {img_id: i for i, img_id in enumerate(self.ids)}
             self.cache = self.cache_data()
+            self.is_cache = self.cache is not None
+
+    @property
+    def coco(self):
+        # pycocotools api, only built from the index when something asks for it
+        if self._coco is None:
+            self._coco = self.coco_index.to_coco()
+        return self._coco
+
+    def get_img_shapes(self):
+        # (h, w) of every sample from the annotation index, no image is read
+        return self.coco_index.image_shapes(self.ids)
 
     def _filter_invalid_annotation(self):
         # check annotations, filtering invalid data
-        valid_ids = []
-        for id in self.ids:
-            ann_id = self.coco.getAnnIds(imgIds=id, iscrowd=None)
-            ann = self.coco.loadAnns(ann_id)
-            if self._has_valid_annotation(ann):
-                valid_ids.append(id)
-        self.ids = valid_ids
+        valid_ids = set(self.coco_index.valid_image_ids())
+        self.ids = [id for id in self.ids if id in valid_ids]
 
     def _has_valid_annotation(self,annot):
         if len(annot) == 0:
@@ -87,20 +98,27 @@ class CocoDetection(Dataset):
             return False
         return True
 
-    def _load_image(self, img_id):
+    def _read_image(self, img_id):
         if self.is_cache:
-            sample = self.cache[img_id]
-        else:
-            ann_ids = self.coco.getAnnIds(imgIds=img_id)
-            ann = self.coco.loadAnns(ann_ids)
+            return read_reduced(None, self.decode_size, self.cache, self.cache_index[img_id])
+
+        path = self.coco_index.file_name(img_id)
+        assert os.path.exists(os.path.join(self.data_cfg.IMG_DIR, path)), 'Image path does not exist: {}'.format(
+            os.path.join(self.data_cfg.IMG_DIR, path))
+        return read_reduced(os.path.join(self.data_cfg.IMG_DIR, path), self.decode_size)
 
-            path = self.coco.loadImgs(img_id)[0]['file_name']
-            assert os.path.exists(os.path.join(self.data_cfg.IMG_DIR, path)), 'Image path does not exist: {}'.format(
-                os.path.join(self.data_cfg.IMG_DIR, path))
+    def _get_image(self, img_id):
+        return self.lru.get(img_id, self._read_image) if self.lru is not None else self._read_image(img_id)
 
-            _img = cv2.imread(os.path.join(self.data_cfg.IMG_DIR, path))
-            _target = dict(image_id=img_id, annotations=ann)
-            sample = {'image': _img, 'target': _target}
+    def _load_image(self, img_id, image=None):
+        _img, scale = self._get_image(img_id) if image is None else image
+        ann = self.coco_index.load_anns(img_id, extras=self.ann_extras)
+        _target = dict(image_id=img_id, annotations=ann)
+        if (scale != 1).any():
+            # reduced-resolution decode or pre-resized cache, see restore_source_size in det_transforms
+            scale_annotations(ann, *scale)
+            _target['src_scales'] = torch.tensor([scale[1], scale[0]])
+        sample = {'image': _img, 'target': _target}
         return sample
 
     def __getitem__(self, idx):
@@ -108,12 +126,17 @@ class CocoDetection(Dataset):
             self.load_num = random_pick(self.load_num)
 
         assert isinstance(self.load_num, int), 'load_num {} must be int'.format(self.load_num)
-        if self.load_num > 1:
+        if self.load_num > 1 and self.reservoir is not None:
+            img_id = self.ids[idx]
+            image = self._get_image(img_id)
+            partners = self.reservoir.draw(self.load_num - 1)
+            if partners is None:
+                partners = [(i, None) for i in random.choices(self.ids, k=self.load_num - 1)]
+            self.reservoir.offer(img_id, image)
+            sample = [self._load_image(img_id, image)] + self.loader_pool.map(lambda p: self._load_image(*p), partners)
+        elif self.load_num > 1:
             img_ids = [self.ids[idx]] + random.choices(self.ids, k=self.load_num - 1)
-            sample = []
-            for img_id in img_ids:
-                s = self._load_image(img_id)
-                sample.append(s)
+            sample = self.loader_pool.map(self._load_image, img_ids)
         else:
             img_id = self.ids[idx]
             sample = self._load_image(img_id)
@@ -125,6 +148,12 @@ class CocoDetection(Dataset):
         else:
             return sample
 
+    def get_file_paths(self, idx):
+        # files read for sample idx (ReadAheadSampler), none when it comes from the packed cache
+        if self.is_cache:
+            return []
+        return [os.path.join(self.data_cfg.IMG_DIR, self.coco_index.file_name(self.ids[idx]))]
+
     def __len__(self):
         return len(self.ids)
 
@@ -141,48 +170,18 @@ class CocoDetection(Dataset):
         return sample
 
     def cache_data(self):
-        cache = {}  # dict
-        NUM_THREADS = 8
-        cache_path = (Path(self.data_cfg.IMG_DIR).parent.parent/self.stage).with_suffix('.cache')
-
-        if cache_path.is_file():
-            cache = np.load(cache_path, allow_pickle=True).item()
-            if cache['hash'] == get_hash(self.imgpaths):
-                print(f'{self.stage}: Cache directory {cache_path} is loaded.')
-                return cache
-
-        desc = f"Scanning '{cache_path.parent / cache_path.stem}' images and labels..."
-        with Pool(NUM_THREADS) as pool:
-            pbar = tqdm(pool.imap_unordered(load_image_label, zip(self.ids, self.imgpaths, self.anns)), desc=desc, total=self.__len__())
-            for img_id, _img, ann in pbar:
-                _target = dict(image_id=img_id, annotations=ann)
-                sample = {'image': _img, 'target': _target}
-                cache[img_id] = sample
-            pbar.close()
-        cache['hash'] = get_hash(self.imgpaths)
-        try:
-            np.save(cache_path, cache)  # save cache for next time
-            cache_path.with_suffix('.cache.npy').rename(cache_path)  # remove .npy suffix
-            print(f'{self.stage} :New cache created: {cache_path}')
-        except Exception as e:
-            print(f'{self.stage} :WARNING: Cache directory {cache_path.parent} is not writeable: {e}')  # path not writeable
+        cache_path = (Path(self.data_cfg.IMG_DIR).parent.parent/self.stage).with_suffix('.shards')
+        desc = f"Scanning '{cache_path.parent / cache_path.stem}' images..."
+        cache = update_image_cache(cache_path, self.imgpaths, desc=desc, **cache_options(self.data_cfg))
+        if cache is None:
+            return None
+        if self.data_cfg.__contains__('CACHE_SHM') and self.data_cfg.CACHE_SHM:
+            # one copy per node in /dev/shm, mapped read-only by every rank and worker
+            cache = PackedImageReader(stage_to_shm(cache_path))
+        print(f'{self.stage} :Cache {cache.summary(self.__len__())}')
         return cache
 
 
-def load_image_label(args):
-    img_id, imgpath, ann = args
-    _img = cv2.imread(imgpath)
-    return img_id, _img, ann
-
-
-def get_hash(paths):
-    # Returns a single hash value of a list of paths (files or dirs)
-    size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))  # sizes
-    h = hashlib.md5(str(size).encode())  # hash sizes
-    h.update(''.join(paths).encode())  # hash paths
-    return h.hexdigest()  # return hash
-
-
 class CocoKeypoint(Dataset):
     def __init__(self, data_cfg, dictionary=None, transform=None, target_transform=None, stage='train'):
         super(CocoKeypoint, self).__init__()
@@ -194,31 +193,32 @@ class CocoKeypoint(Dataset):
         self.target_transform = target_transform
 
         self.num_classes = len(self.dictionary)
-        self.coco = COCO(os.path.join(data_cfg.LABELS.DET_DIR, 'person_keypoints_{}.json'.format(os.path.basename(data_cfg.IMG_DIR))))
-        self.cat_ids = self.coco.getCatIds(catNms=['person'])
-        self.ids = list(sorted(self.coco.getImgIds(catIds=self.cat_ids)))
+        self.coco_index = CocoIndex.load_or_compile(os.path.join(data_cfg.LABELS.DET_DIR, 'person_keypoints_{}.json'.format(os.path.basename(data_cfg.IMG_DIR))))
+        self._coco = None
+        self.cat_ids = self.coco_index.get_cat_ids(cat_names=['person'])
 
         self._filter_for_keypoint_annotations()
 
-    def _filter_for_keypoint_annotations(self):
-        def has_keypoint_annotation(image_id):
-            ann_ids = self.coco.getAnnIds(imgIds=image_id, catIds=self.cat_ids)
-            anns = self.coco.loadAnns(ann_ids)
-            for ann in anns:
-                if 'keypoints' not in ann:
-                    continue
-                if any(v > 0.0 for v in ann['keypoints'][2::3]):
-                    return True
-            return False
+    @property
+    def coco(self):
+        # pycocotools api, only built from the index when something asks for it
+        if self._coco is None:
+            self._coco = self.coco_index.to_coco()
+        return self._coco
 
-        self.ids = [image_id for image_id in self.ids if has_keypoint_annotation(image_id)]
+    def get_img_shapes(self):
+        # (h, w) of every sample from the annotation index, no image is read
+        return self.coco_index.image_shapes(self.ids)
+
+    def _filter_for_keypoint_annotations(self):
+        # images with at least one person that has a labeled keypoint
+        self.ids = list(sorted(self.coco_index.keypoint_image_ids(self.cat_ids)))
 
     def __getitem__(self, idx):
         img_id = self.ids[idx]
-        ann_ids = self.coco.getAnnIds(imgIds=img_id, catIds=self.cat_ids)
-        ann = self.coco.loadAnns(ann_ids)
+        ann = self.coco_index.load_anns(img_id, cat_ids=self.cat_ids)
 
-        path = self.coco.loadImgs(img_id)[0]['file_name']
+        path = self.coco_index.file_name(img_id)
         assert os.path.exists(os.path.join(self.data_cfg.IMG_DIR, path)), 'Image path does not exist: {}'.format(
             os.path.join(self.data_cfg.IMG_DIR, path))
 
@@ -233,6 +233,10 @@ class CocoKeypoint(Dataset):
         else:
             return sample
 
+    def get_file_paths(self, idx):
+        # files read for sample idx (ReadAheadSampler)
+        return [os.path.join(self.data_cfg.IMG_DIR, self.coco_index.file_name(self.ids[idx]))]
+
     def __len__(self):
         return len(self.ids)
 
@@ -260,24 +264,27 @@ class CocoSegmentation(Dataset):
         self.target_transform = target_transform
 
         self.num_classes = len(self.dictionary)
-        self.coco = COCO(os.path.join(data_cfg.LABELS.DET_DIR, 'instances_{}.json'.format(os.path.basename(data_cfg.IMG_DIR))))
-        self.ids = list(sorted(self.coco.getImgIds()))
+        self.coco_index = CocoIndex.load_or_compile(os.path.join(data_cfg.LABELS.DET_DIR, 'instances_{}.json'.format(os.path.basename(data_cfg.IMG_DIR))))
+        self._coco = None
+        self.ids = list(sorted(int(i) for i in self.coco_index.img_id))
 
         self._filter_invalid_annotation()
 
         ## need to process
-        self.category2id = {v: i for i, v in enumerate(self.coco.getCatIds())}
+        self.category2id = {v: i for i, v in enumerate(self.coco_index.get_cat_ids())}
         self.id2category = {v: k for k, v in self.category2id.items()}
 
+    @property
+    def coco(self):
+        # pycocotools api, only built from the index when something asks for it
+        if self._coco is None:
+            self._coco = self.coco_index.to_coco()
+        return self._coco
+
     def _filter_invalid_annotation(self):
         # check annos, filtering invalid data
-        valid_ids = []
-        for id in self.ids:
-            ann_id = self.coco.getAnnIds(imgIds=id, iscrowd=None)
-            ann = self.coco.loadAnns(ann_id)
-            if self._has_valid_annotation(ann):
-                valid_ids.append(id)
-        self.ids = valid_ids
+        valid_ids = set(self.coco_index.valid_image_ids())
+        self.ids = [id for id in self.ids if id in valid_ids]
 
     def _has_valid_annotation(self,annot):
         if len(annot) == 0:
@@ -289,10 +296,9 @@ class CocoSegmentation(Dataset):
 
     def __getitem__(self, idx):
         img_id = self.ids[idx]
-        ann_ids = self.coco.getAnnIds(imgIds=img_id)
-        ann = self.coco.loadAnns(ann_ids)
+        ann = self.coco_index.load_anns(img_id)
 
-        path = self.coco.loadImgs(img_id)[0]['file_name']
+        path = self.coco_index.file_name(img_id)
         assert os.path.exists(os.path.join(self.data_cfg.IMG_DIR, path)), 'Image path does not exist: {}'.format(
             os.path.join(self.data_cfg.IMG_DIR, path))
 
@@ -303,5 +309,9 @@ class CocoSegmentation(Dataset):
         return self.transform(sample)
 
 
+    def get_file_paths(self, idx):
+        # files read for sample idx (ReadAheadSampler)
+        return [os.path.join(self.data_cfg.IMG_DIR, self.coco_index.file_name(self.ids[idx]))]
+
     def __len__(self):
         return len(self.ids)
\ No newline at end of file
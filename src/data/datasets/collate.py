@@ -0,0 +1,85 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/23 14:30
+# @Author : liumin
+# @File : collate.py
+
+import torch
+from torch.utils.data import get_worker_info
+
+__all__ = ['collate_packed_targets', 'unpack_targets']
+
+"""
+    Detection batches with the targets packed into a few tensors, enabled with PACKED_TARGETS.
+
+    The list of per-image target dicts costs a host-to-device copy per key and image, and the
+    yolo style models concatenate it into one gt tensor on the device again every step. Here the
+    worker builds that layout directly:
+
+        gts      N_total x 6 float32, (batch_idx, label, box) as trans_specific_format builds it
+        offsets  B + 1 int64, the gts of image i are gts[offsets[i]:offsets[i + 1]]
+        image_id, height, width   B
+        scales, pads              B x 2, (1, 1) and (0, 0) when the transforms did not set them
+
+    Inside a worker the tensors are allocated in shared memory and filled in place, so handing the
+    batch to the main process copies nothing, and pin_memory pins a handful of tensors per batch.
+"""
+
+
+def _empty(shape, dtype):
+    out = torch.empty(shape, dtype=dtype)
+    if get_worker_info() is not None:
+        out.share_memory_()
+    return out
+
+
+def collate_packed_targets(batch):
+    '''
+        list[dict(image, target)] with boxes/labels targets to {'image': B x C x H x W, 'target': packed dict}
+    '''
+    imgs = [s['image'] for s in batch]
+    targets = [s['target'] for s in batch]
+    b = len(batch)
+
+    img = torch.stack(imgs, 0, out=_empty((b,) + tuple(imgs[0].shape), imgs[0].dtype))
+
+    counts = torch.tensor([len(t['labels']) for t in targets], dtype=torch.int64)
+    offsets = _empty((b + 1,), torch.int64)
+    offsets[0] = 0
+    torch.cumsum(counts, 0, out=offsets[1:])
+
+    gts = _empty((int(offsets[-1]), 6), torch.float32)
+    scales = _empty((b, 2), torch.float32)
+    pads = _empty((b, 2), torch.float32)
+    image_id = _empty((b,), torch.int64)
+    height = _empty((b,), torch.int64)
+    width = _empty((b,), torch.int64)
+    for i, t in enumerate(targets):
+        rows = gts[offsets[i]:offsets[i + 1]]
+        rows[:, 0] = i
+        rows[:, 1] = torch.as_tensor(t['labels'])
+        rows[:, 2:] = torch.as_tensor(t['boxes']).view(-1, 4)
+        scales[i] = t['scales'] if 'scales' in t else 1
+        pads[i] = t['pads'] if 'pads' in t else 0
+        image_id[i] = int(t['image_id'])
+        height[i] = int(t['height'])
+        width[i] = int(t['width'])
+
+    target = {'gts': gts, 'offsets': offsets, 'image_id': image_id, 'height': height, 'width': width,
+              'scales': scales, 'pads': pads}
+    return {'image': img, 'target': target}
+
+
+def unpack_targets(targets):
+    '''
+        Packed targets back to the list of per-image dicts, for code that expects the usual layout.
+    '''
+    offsets = targets['offsets'].tolist()
+    out = []
+    for i in range(len(offsets) - 1):
+        rows = targets['gts'][offsets[i]:offsets[i + 1]]
+        t = {'boxes': rows[:, 2:], 'labels': rows[:, 1].long(), 'image_id': targets['image_id'][i:i + 1],
+             'height': targets['height'][i], 'width': targets['width'][i],
+             'scales': targets['scales'][i], 'pads': targets['pads'][i]}
+        out.append(t)
+    return out
@@ -3,13 +3,14 @@
 # @Time : 2020/6/11 13:30
 # @Author : liumin
 # @File : flower.py
-from glob2 import glob
 import os
 from PIL import Image
 from torch.utils.data import Dataset
 from torchvision.datasets import ImageFolder
 import torchvision.transforms as T
 
+from src.data.cache import load_image_folder
+
 data_transforms = {
     'train': T.Compose([
         T.RandomResizedCrop(224),
@@ -49,22 +50,14 @@ class FlowerDataset(Dataset):
         self.stage = stage
 
         # self.imgs = ImageFolder(os.path.join(root_path,self.stage))
-        self._imgs = []
-        self._labels = []
-        if self.stage == 'infer':
-            for root, fnames, _ in sorted(os.walk(data_cfg.IMG_DIR)):
-                for fname in sorted(fnames):
-                    self._imgs.extend(glob(os.path.join(root, fname, data_cfg.IMG_SUFFIX)))
-        else:
-            self.cls_label = [d.name for d in os.scandir(data_cfg.IMG_DIR) if d.is_dir()]
-            for root, fnames, _ in sorted(os.walk(data_cfg.IMG_DIR)):
-                for fname in sorted(fnames):
-                    imgs = glob(os.path.join(root, fname, data_cfg.IMG_SUFFIX))
-                    self._imgs.extend(imgs)
-                    self._labels.extend([self.cls_label.index(fname) for _ in imgs])
+        # cached file manifest of the image folder, labels looked up through a dict
+        self.manifest = load_image_folder(data_cfg.IMG_DIR, data_cfg.IMG_SUFFIX, labeled=self.stage != 'infer')
+        self.cls_label = self.manifest.classes
+        self._imgs = self.manifest
+        self._labels = self.manifest.labels
 
     def __getitem__(self, idx):
-        img, label = Image.open(self._imgs[idx]).convert('RGB'), self._labels[idx]
+        img, label = Image.open(self._imgs[idx]).convert('RGB'), int(self._labels[idx])
         if self.transform is not None:
             img = self.transform(img)
         if self.stage == 'infer':
@@ -5,14 +5,13 @@
 # @File : hymenoptera.py
 
 
-import os
-
 import cv2
-from glob2 import glob
 import torch
 from torch.utils.data import Dataset
 import numpy as np
 
+from src.data.cache import load_image_folder
+
 """
     hymenoptera_data
     https://download.pytorch.org/tutorial/hymenoptera_data.zip
@@ -33,21 +32,12 @@ class HymenopteraClassification(Dataset):
         self.name2id = dict(zip(self.category, range(self.num_classes)))
         self.id2name = {v: k for k, v in self.name2id.items()}
 
-        self._imgs = []
-        self._targets = []
-        if self.stage == 'infer':
-            for root, fnames, _ in sorted(os.walk(data_cfg.IMG_DIR)):
-                for fname in sorted(fnames):
-                    self._imgs.extend(glob(os.path.join(root, fname, data_cfg.IMG_SUFFIX)))
-        else:
-            self.cls_label = [d.name for d in os.scandir(data_cfg.IMG_DIR) if d.is_dir()]
-            for root, fnames, _ in sorted(os.walk(data_cfg.IMG_DIR)):
-                for fname in sorted(fnames):
-                    imgs = glob(os.path.join(root, fname, data_cfg.IMG_SUFFIX))
-                    self._imgs.extend(imgs)
-                    self._targets.extend([self.cls_label.index(fname) for _ in imgs])
-
-            assert len(self._imgs) == len(self._targets), 'len(self._imgs) should be equals to len(self._targets)'
+        # cached file manifest of the image folder, labels looked up through a dict
+        self.manifest = load_image_folder(data_cfg.IMG_DIR, data_cfg.IMG_SUFFIX, labeled=self.stage != 'infer')
+        self.cls_label = self.manifest.classes
+        self._imgs = self.manifest
+        self._targets = self.manifest.labels
+        if self.stage != 'infer':
             assert len(self._imgs) > 0, 'Found 0 images in the specified location, pls check it!'
 
     def __getitem__(self, idx):
@@ -59,7 +49,7 @@ class HymenopteraClassification(Dataset):
         else:
             # _img, _target = np.asarray(Image.open(self._imgs[idx]).convert('RGB'), dtype=np.float32), self._targets[idx]
             _img = cv2.imread(self._imgs[idx]) # BGR
-            _target = self._targets[idx]
+            _target = int(self._targets[idx])
             _target = self.encode_target(_target, idx)
             sample = {'image': _img, 'target': _target}
             return self.transform(sample)
@@ -4,9 +4,10 @@
 # @Author : liumin
 # @File : imagenet.py
 
-import glob
 import os
+from pathlib import Path
 
+import cv2
 import torch
 import torchvision.transforms as T
 from PIL import Image
@@ -14,6 +15,8 @@ from torch.utils.data import Dataset
 import numpy as np
 from torchvision.datasets import ImageFolder
 
+from src.data.cache import PackedImageReader, load_image_folder, update_image_cache, cache_options, stage_to_shm
+
 """
     ImageNet
     http://www.image-net.org/
@@ -27,30 +30,26 @@ class ImagenetClassification(Dataset):
         self.transform = transform
         self.target_transform = target_transform
         self.stage = stage
+        self.is_cache = self.data_cfg.CACHE if hasattr(self.data_cfg, 'CACHE') else False
 
         self.num_classes = len(self.dictionary)
         self.category = [v for d in self.dictionary for v in d.keys()]
         self.name2id = dict(zip(self.category, range(self.num_classes)))
         self.id2name = {v: k for k, v in self.name2id.items()}
 
-        self._imgs = []
-        self._targets = []
-        # self.imgs = ImageFolder(root_path)
-        if self.stage == 'infer':
-            for root, fnames, _ in sorted(os.walk(data_cfg.IMG_DIR)):
-                for fname in sorted(fnames):
-                    self._imgs.extend(glob.glob(os.path.join(root, fname, data_cfg.IMG_SUFFIX)))
-        else:
-            self.cls_label = [d.name for d in os.scandir(data_cfg.IMG_DIR) if d.is_dir()]
-            for root, fnames, _ in sorted(os.walk(data_cfg.IMG_DIR)):
-                for fname in sorted(fnames):
-                    imgs = glob.glob(os.path.join(root, fname, data_cfg.IMG_SUFFIX))
-                    self._imgs.extend(imgs)
-                    self._targets.extend([self.cls_label.index(fname) for _ in imgs])
-
-            assert len(self._imgs) == len(self._targets), 'len(self._imgs) should be equals to len(self._targets)'
+        # cached file manifest of the image folder, labels looked up through a dict
+        self.manifest = load_image_folder(data_cfg.IMG_DIR, data_cfg.IMG_SUFFIX, labeled=self.stage != 'infer')
+        self.cls_label = self.manifest.classes
+        self._imgs = self.manifest
+        self._targets = self.manifest.labels
+        if self.stage != 'infer':
             assert len(self._imgs) > 0, 'Found 0 images in the specified location, pls check it!'
 
+        # Pack (pre-resized, with CACHE_MAX_SIZE) images into memory-mapped shards
+        if self.is_cache and self.stage != 'infer':
+            self.cache = self.cache_data()
+            self.is_cache = self.cache is not None
+
     def __getitem__(self, idx):
         if self.stage == 'infer':
             _img = np.asarray(Image.open(self._imgs[idx]).convert('RGB'), dtype=np.float32)
@@ -58,7 +57,11 @@ class ImagenetClassification(Dataset):
             sample = {'image': _img, 'mask': None}
             return self.transform(sample), img_id
         else:
-            _img, _target = np.asarray(Image.open(self._imgs[idx]).convert('RGB'), dtype=np.float32), self._targets[idx]
+            if self.is_cache:
+                _img = cv2.cvtColor(self.cache[idx], cv2.COLOR_BGR2RGB).astype(np.float32)
+            else:
+                _img = np.asarray(Image.open(self._imgs[idx]).convert('RGB'), dtype=np.float32)
+            _target = int(self._targets[idx])
             _target = self.encode_map(_target, idx)
             sample = {'image': _img, 'target': _target}
             return self.transform(sample)
@@ -69,6 +72,18 @@ class ImagenetClassification(Dataset):
     def __len__(self):
         return len(self._imgs)
 
+    def cache_data(self):
+        cache_path = (Path(self.data_cfg.IMG_DIR).parent/self.stage).with_suffix('.shards')
+        desc = f"Scanning '{cache_path.parent / cache_path.stem}' images..."
+        cache = update_image_cache(cache_path, self._imgs, desc=desc, **cache_options(self.data_cfg))
+        if cache is None:
+            return None
+        if self.data_cfg.__contains__('CACHE_SHM') and self.data_cfg.CACHE_SHM:
+            # one copy per node in /dev/shm, mapped read-only by every rank and worker
+            cache = PackedImageReader(stage_to_shm(cache_path))
+        print(f'{self.stage} :Cache {cache.summary(self.__len__())}')
+        return cache
+
 
 if __name__ == '__main__':
     root_path = '/home/lmin/data/hymenoptera/train'
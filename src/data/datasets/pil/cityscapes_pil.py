@@ -41,6 +41,10 @@ class CityscapesSegmentation(Dataset):
         self.invalid_classes = [0, 1, 2, 3, 4, 5, 6, 9, 10, 14, 15, 16, 18, 29, 30, -1]
         self.valid_classes = [7, 8, 11, 12, 13, 17, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 31, 32, 33]
         self.class_map = dict(zip(self.valid_classes, range(self.num_classes)))
+        # 256-entry labelId -> trainId table, applied with a single np.take
+        self.label_lut = np.arange(256, dtype=np.uint8)
+        self.label_lut[[c for c in self.invalid_classes if c >= 0]] = self.ignore_index
+        self.label_lut[self.valid_classes] = [self.class_map[c] for c in self.valid_classes]
 
         self._imgs = []
         self._targets = []
@@ -92,15 +96,7 @@ class CityscapesSegmentation(Dataset):
 
     def encode_target(self, target):
         # This is used to convert tags
-        target = np.asarray(target, dtype=np.uint8).copy()
-        # Put all void classes to zero
-        for _voidc in self.invalid_classes:
-            target[target == _voidc] = self.ignore_index
-        # index from zero 0:18
-        for _validc in self.valid_classes:
-            target[target == _validc] = self.class_map[_validc]
-        target = Image.fromarray(target.astype(np.uint8))
-        return target
+        return Image.fromarray(np.take(self.label_lut, np.asarray(target, dtype=np.uint8)))
 
     @classmethod
     def decode_target(self, target):
@@ -0,0 +1,246 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/24 15:10
+# @Author : liumin
+# @File : shards.py
+
+import io
+import json
+import os
+import pickle
+import random
+import tarfile
+
+import cv2
+import numpy as np
+from PIL import Image
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+__all__ = ['ShardWriter', 'ShardDataset', 'encode_sample', 'decode_sample']
+
+"""
+    Streaming tar shards, for storage where random access to many small files is slow.
+
+    scripts/build_shards.py runs the DATASET.CLASS of a setting without transforms and writes its
+    raw samples, in a shuffled order, to tar shards of a fixed number of samples. Each sample is a
+    pair of members: <key>.<ext> with the original image file (or a lossless png when the dataset
+    has no file for it) and <key>.pyd with the pickled rest of the sample (target, mask, ...).
+    shards.json lists the shards and their sample counts.
+
+    ShardDataset reads the shards sequentially. Every epoch the shard order is shuffled with
+    seed + epoch, the shards are split across the DDP ranks and then across the DataLoader workers,
+    and samples pass through a shuffle buffer of SHUFFLE_BUFFER samples before they go through the
+    same transform / target_transform as the map-style dataset. Every rank yields exactly
+    len(dataset) samples per epoch (workers cycle their shards when they run short), so ranks run
+    the same number of steps. With LOAD_NUM > 1 the mosaic partners are drawn from the buffer.
+    This drops and repeats a few samples per epoch, which is fine for training; the trainers therefore
+    honor SHARDS for DATASET.TRAIN only and always evaluate on the map-style val dataset.
+"""
+
+INDEX_FILE = 'shards.json'
+
+
+def encode_sample(sample, path=None):
+    '''
+        Raw dataset sample to (ext, image bytes, record bytes). The file at path is stored as it is
+        when it decodes to the same image, the image is encoded losslessly otherwise.
+    '''
+    img = sample['image']
+    if isinstance(img, Image.Image):
+        kind, mode = 'pil', img.mode
+    elif isinstance(img, np.ndarray) and img.dtype == np.uint8:
+        kind, mode = 'cv2', None
+    else:
+        kind, mode = 'npy', None
+
+    data, ext = None, None
+    if path is not None and kind != 'npy':
+        with open(path, 'rb') as f:
+            data = f.read()
+        ext = os.path.splitext(path)[1].lstrip('.').lower() or 'img'
+        decoded = _decode_image(data, kind, mode)
+        if kind == 'pil' and decoded.size != img.size or kind == 'cv2' and decoded.shape != img.shape:
+            data = None
+    if data is None:
+        if kind == 'pil':
+            buf = io.BytesIO()
+            img.save(buf, format='PNG')
+            data, ext = buf.getvalue(), 'png'
+        elif kind == 'cv2':
+            data, ext = cv2.imencode('.png', img)[1].tobytes(), 'png'
+        else:
+            buf = io.BytesIO()
+            np.save(buf, img)
+            data, ext = buf.getvalue(), 'npy'
+
+    fields = {k: v for k, v in sample.items() if k != 'image'}
+    record = pickle.dumps({'fields': fields, 'kind': kind, 'mode': mode}, protocol=pickle.HIGHEST_PROTOCOL)
+    return ext, data, record
+
+
+def _decode_image(data, kind, mode):
+    if kind == 'pil':
+        img = Image.open(io.BytesIO(data))
+        return img.convert(mode) if img.mode != mode else img
+    if kind == 'cv2':
+        flags = cv2.IMREAD_UNCHANGED if data[:4] == b'\x89PNG' else cv2.IMREAD_COLOR
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    return np.load(io.BytesIO(data))
+
+
+def decode_sample(data, record):
+    record = pickle.loads(record)
+    sample = dict(record['fields'])
+    sample['image'] = _decode_image(data, record['kind'], record['mode'])
+    return sample
+
+
+class ShardWriter(object):
+    '''
+        Writes encoded samples to <prefix>-00000.tar, ... with samples_per_shard samples each.
+    '''
+    def __init__(self, root, prefix, samples_per_shard=1000):
+        self.root = root
+        self.prefix = prefix
+        self.samples_per_shard = samples_per_shard
+        self.shards = []
+        self._tar = None
+        self._count = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _open(self):
+        name = '{}-{:05d}.tar'.format(self.prefix, len(self.shards))
+        self.shards.append({'name': name, 'samples': 0})
+        self._tar = tarfile.open(os.path.join(self.root, name + '.tmp'), 'w')
+
+    def _close_shard(self):
+        self._tar.close()
+        name = self.shards[-1]['name']
+        os.replace(os.path.join(self.root, name + '.tmp'), os.path.join(self.root, name))
+        self._tar = None
+
+    def write(self, key, ext, data, record):
+        if self._tar is None:
+            self._open()
+        for name, payload in (('{}.{}'.format(key, ext), data), ('{}.pyd'.format(key), record)):
+            info = tarfile.TarInfo(name)
+            info.size = len(payload)
+            self._tar.addfile(info, io.BytesIO(payload))
+        self.shards[-1]['samples'] += 1
+        self._count += 1
+        if self.shards[-1]['samples'] >= self.samples_per_shard:
+            self._close_shard()
+
+    def close(self, **meta):
+        if self._tar is not None:
+            self._close_shard()
+        index = dict(meta, samples=self._count, shards=self.shards)
+        with open(os.path.join(self.root, INDEX_FILE), 'w') as f:
+            json.dump(index, f, indent=1)
+        return index
+
+
+def iter_shard(path):
+    '''
+        (key, image bytes, record bytes) of a shard, read front to back.
+    '''
+    with open(path, 'rb', buffering=1 << 22) as f, tarfile.open(fileobj=f, mode='r|') as tar:
+        key, data = None, None
+        for member in tar:
+            name = member.name
+            stem, ext = name.rsplit('.', 1)
+            payload = tar.extractfile(member).read()
+            if ext == 'pyd':
+                assert stem == key, 'broken shard {}: {} without image'.format(path, name)
+                yield key, data, payload
+            else:
+                key, data = stem, payload
+
+
+class ShardDataset(IterableDataset):
+    '''
+        IterableDataset over the shards in data_cfg.SHARDS, built by scripts/build_shards.py.
+    '''
+    def __init__(self, data_cfg, dictionary=None, transform=None, target_transform=None, stage='train'):
+        super(ShardDataset, self).__init__()
+        self.data_cfg = data_cfg
+        self.dictionary = dictionary
+        self.stage = stage
+        self.transform = transform
+        self.target_transform = target_transform
+        self.num_classes = len(self.dictionary) if self.dictionary is not None else 0
+        self.load_num = data_cfg.LOAD_NUM if data_cfg.__contains__('LOAD_NUM') and self.stage == 'train' else 1
+        assert isinstance(self.load_num, int), 'LOAD_NUM must be an int for shards'
+        self.shuffle = data_cfg.SHUFFLE if data_cfg.__contains__('SHUFFLE') else self.stage == 'train'
+        self.buffer_size = data_cfg.SHUFFLE_BUFFER if data_cfg.__contains__('SHUFFLE_BUFFER') else 1000
+        if not self.shuffle:
+            self.buffer_size = 1
+        self.seed = 0
+        self.epoch = 0
+
+        with open(os.path.join(data_cfg.SHARDS, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.shards = [os.path.join(data_cfg.SHARDS, s['name']) for s in index['shards']]
+        self.num_samples = index['samples']
+        self.num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        self.rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        if len(self.shards) < self.num_replicas:
+            print(f'WARNING: {len(self.shards)} shards for {self.num_replicas} ranks, ranks will share shards.')
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        # samples of this rank per epoch
+        return self.num_samples // self.num_replicas
+
+    def _worker_plan(self):
+        info = get_worker_info()
+        num_workers, worker_id = (info.num_workers, info.id) if info is not None else (1, 0)
+        order = list(range(len(self.shards)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        mine = order[self.rank::self.num_replicas] or order[self.rank % len(order)::len(order)]
+        mine = mine[worker_id::num_workers] or mine[worker_id % len(mine)::len(mine)]
+        quota = len(self) // num_workers + (worker_id < len(self) % num_workers)
+        rng = random.Random((self.seed + self.epoch) * 1000003 + self.rank * 1009 + worker_id)
+        return [self.shards[i] for i in mine], quota, rng
+
+    def _stream(self, shards, rng):
+        while True:
+            for path in shards:
+                for item in iter_shard(path):
+                    yield item
+            # this worker ran short of its quota, go over its shards again in another order
+            shards = rng.sample(shards, len(shards))
+
+    def __iter__(self):
+        shards, quota, rng = self._worker_plan()
+        if quota <= 0:
+            return
+        stream = self._stream(shards, rng)
+        buffer = []
+        # the mosaic partners are drawn from the buffer as well, so it holds at least LOAD_NUM samples
+        fill = max(self.buffer_size, self.load_num)
+        for _ in range(quota):
+            while len(buffer) < fill:
+                buffer.append(next(stream))
+            if self.shuffle:
+                i = rng.randrange(len(buffer))
+                item = buffer[i]
+                buffer[i] = buffer[-1]
+                buffer.pop()
+            else:
+                item = buffer.pop(0)
+            partners = rng.choices(buffer, k=self.load_num - 1) if self.load_num > 1 else []
+            yield self._make(item, partners)
+
+    def _make(self, item, partners):
+        sample = decode_sample(item[1], item[2])
+        if partners:
+            sample = [sample] + [decode_sample(p[1], p[2]) for p in partners]
+        sample = self.transform(sample)
+        if self.target_transform is not None:
+            return self.target_transform(sample)
+        return sample
@@ -7,12 +7,8 @@
 import os
 import random
 
-import cv2
 from PIL.Image import Image
 from glob2 import glob
-from tqdm import tqdm
-import hashlib
-from multiprocessing.pool import Pool
 from pathlib import Path
 import numpy as np
 import pandas as pd
@@ -21,6 +17,9 @@ import torch
 import torch.nn as nn
 from torch.utils.data import Dataset
 
+from src.data.cache import PackedImageReader, update_image_cache, cache_options, save_annotations, pack_box_targets, \
+    BoxTargetColumns, build_lru_cache, stage_to_shm, read_reduced, build_loader_pool
+
 """
     VisDrone Detection
     http://aiskyeye.com/
@@ -36,6 +35,12 @@ class VisDroneDetection(Dataset):
         self.transform = transform
         self.target_transform = target_transform
         self.is_cache = self.data_cfg.CACHE if hasattr(self.data_cfg, 'CACHE') else False
+        self.cache_mode = data_cfg.CACHE_MODE if data_cfg.__contains__('CACHE_MODE') else 'raw'
+        self.lru = build_lru_cache(data_cfg, self.stage)
+        # the images of a multi-image sample are read and decoded concurrently with LOAD_THREADS
+        self.loader_pool = build_loader_pool(data_cfg, self.stage)
+        # size hint for reduced-resolution jpeg decoding, train only so evaluation stays in original pixels
+        self.decode_size = data_cfg.DECODE_SIZE if data_cfg.__contains__('DECODE_SIZE') and self.stage == 'train' else None
 
         self.num_classes = len(self.dictionary)
         self.category = [v for d in self.dictionary for v in d.keys()]
@@ -71,11 +76,12 @@ class VisDroneDetection(Dataset):
             assert len(self._imgs) > 0, 'Found 0 images in the specified location, pls check it!'
 
         self.ids = range(len(self._imgs))
-        # Cache images into memory for faster training (WARNING: large datasets may exceed system RAM)
+        # Pack images and parsed boxes into memory-mapped shards
         if self.is_cache and self.stage != 'infer':
-            self.cache = self.cache_data()
+            self.cache, self.cache_targets = self.cache_data()
+            self.is_cache = self.cache is not None
 
-    def _parse_txt(self, annopath, height, width):
+    def _parse_boxes(self, annopath):
         anno = pd.read_csv(annopath, header=None).values
         boxes = []
         labels = []
@@ -87,40 +93,48 @@ class VisDroneDetection(Dataset):
                 else:
                     labels.append(row[5] - 1)
 
-        boxes = np.array(boxes, dtype=np.float32)
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
         labels = np.array(labels, dtype=np.int64)
 
         keep = (boxes[:, 3] > boxes[:, 1]) & (boxes[:, 2] > boxes[:, 0])
-        boxes = boxes[keep]
-        labels = labels[keep]
+        return boxes[keep], labels[keep]
+
+    def _parse_txt(self, annopath, height, width):
+        boxes, labels = self._parse_boxes(annopath)
+        return self._make_target(boxes, labels, height, width)
 
+    def _make_target(self, boxes, labels, height, width, scale=None):
         target = {}
         target["height"] = torch.tensor(int(height))
         target["width"] = torch.tensor(int(width))
         target["boxes"] = boxes
         target["labels"] = torch.tensor(labels)
+        if scale is not None and (scale != 1).any():
+            # image was read smaller than the source, see restore_source_size in det_transforms
+            target["src_scales"] = torch.tensor([scale[1], scale[0]])
         return target
 
+    def _read_image(self, idx):
+        if self.is_cache:
+            return read_reduced(None, self.decode_size, self.cache, idx)
+        return read_reduced(self._imgs[idx], self.decode_size)
+
+    def _load_image(self, idx):
+        _img, scale = self.lru.get(idx, self._read_image) if self.lru is not None else self._read_image(idx)
+        if self.is_cache:
+            boxes, labels = self.cache_targets[idx]
+        else:
+            boxes, labels = self._parse_boxes(self._targets[idx])
+        boxes = boxes * np.tile(scale, 2)  # boxes of a reduced-resolution decode or pre-resized cache
+        _target = self._make_target(boxes, labels, _img.shape[0], _img.shape[1], scale)
+        return {'image': _img, 'target': _target}
 
     def __getitem__(self, idx):
         if self.load_num > 1:
             idxs = [idx] + random.choices(self.ids, k=self.load_num - 1)
-            sample = []
-            for idx in idxs:
-                if self.is_cache:
-                    s = self.cache[idx]
-                else:
-                    _img = cv2.imread(self._imgs[idx])
-                    _target = self._parse_txt(self._targets[idx], _img.shape[0], _img.shape[1])
-                    s = {'image': _img, 'target': _target}
-                sample.append(s)
+            sample = self.loader_pool.map(self._load_image, idxs)
         else:
-            if self.is_cache:
-                sample = self.cache[idx]
-            else:
-                _img = cv2.imread(self._imgs[idx])
-                _target = self._parse_txt(self._targets[idx], _img.shape[0], _img.shape[1])
-                sample = {'image': _img, 'target': _target}
+            sample = self._load_image(idx)
 
         sample = self.transform(sample)
 
@@ -129,36 +143,31 @@ class VisDroneDetection(Dataset):
         else:
             return sample
 
+    def get_file_paths(self, idx):
+        # files read for sample idx (ReadAheadSampler), none when it comes from the packed cache
+        if self.is_cache:
+            return []
+        return [self._imgs[idx]] + self._targets[idx:idx + 1]
+
     def __len__(self):
         return len(self._imgs)
 
     def cache_data(self):
-        cache = {}  # dict
-        NUM_THREADS = 8
-        cache_path = (Path(self.data_cfg.IMG_DIR)/self.stage).with_suffix('.cache')
-        '''
-        if cache_path.is_file():
-            cache = np.load(cache_path, allow_pickle=True).item()
-            if cache['hash'] == get_hash(self._imgs + self._targets):
-                return cache
-        '''
+        cache_path = (Path(self.data_cfg.IMG_DIR)/self.stage).with_suffix('.shards')
+
+        def save_targets(root):
+            save_annotations(root, pack_box_targets([self._parse_boxes(p) for p in self._targets]))
+
         desc = f"Scanning '{cache_path.parent / cache_path.stem}' images and labels..."
-        with Pool(NUM_THREADS) as pool:
-            pbar = tqdm(pool.imap_unordered(load_det_image_label, zip(self._imgs, self._targets)),
-                desc=desc, total=self.__len__())
-            for img_id, _img, _target in pbar:
-                _target = self._parse_txt(_target, _img.shape[0], _img.shape[1])
-                sample = {'image': _img, 'target': _target}
-                cache[img_id] = sample
-            pbar.close()
-        cache['hash'] = get_hash(self._imgs + self._targets)
-        try:
-            np.save(cache_path, cache)  # save cache for next time
-            cache_path.with_suffix('.cache.npy').rename(cache_path)  # remove .npy suffix
-            print(f'{self.stage} :New cache created: {cache_path}')
-        except Exception as e:
-            print(f'{self.stage} :WARNING: Cache directory {cache_path.parent} is not writeable: {e}')  # path not writeable
-        return cache
+        cache = update_image_cache(cache_path, self._imgs, extras=save_targets, deps=self._targets, desc=desc,
+                                   **cache_options(self.data_cfg))
+        if cache is None:
+            return None, None
+        if self.data_cfg.__contains__('CACHE_SHM') and self.data_cfg.CACHE_SHM:
+            # one copy per node in /dev/shm, mapped read-only by every rank and worker
+            cache = PackedImageReader(stage_to_shm(cache_path))
+        print(f'{self.stage} :Cache {cache.summary(self.__len__())}')
+        return cache, BoxTargetColumns(cache.root)
 
     @staticmethod
     def collate_fn(batch):
@@ -173,20 +182,6 @@ class VisDroneDetection(Dataset):
         return sample
 
 
-def load_det_image_label(args):
-    im_file, lb_file = args
-    _img, _target = cv2.imread(im_file), lb_file
-    return im_file, _img, _target
-
-
-def get_hash(paths):
-    # Returns a single hash value of a list of paths (files or dirs)
-    size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))  # sizes
-    h = hashlib.md5(str(size).encode())  # hash sizes
-    h.update(''.join(paths).encode())  # hash paths
-    return h.hexdigest()  # return hash
-
-
 class VisDroneTrack(Dataset):
     def __init__(self, data_cfg, dictionary=None, transform=None, target_transform=None, stage='train'):
         super(VisDroneTrack, self).__init__()
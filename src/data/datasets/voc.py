@@ -120,6 +120,10 @@ class VOCDetection(Dataset):
             else:
                 return sample
 
+    def get_file_paths(self, idx):
+        # files read for sample idx (ReadAheadSampler)
+        return [self._imgs[idx]] + self._targets[idx:idx + 1]
+
     def __len__(self):
         return len(self._imgs)
 
@@ -4,20 +4,20 @@
 # @Author : liumin
 # @File : widerface.py
 
-import hashlib
 import os
 import random
 from glob2 import glob
-from multiprocessing.pool import Pool
 from pathlib import Path
 
 import cv2
 import torch
 from torch.utils.data import Dataset
 import numpy as np
-from tqdm import tqdm
 import xml.etree.ElementTree as ET
 
+from src.data.cache import PackedImageReader, update_image_cache, cache_options, save_annotations, pack_box_targets, \
+    BoxTargetColumns, build_lru_cache, stage_to_shm, read_reduced
+
 """
     Wider Face
     http://shuoyang1213.me/WIDERFACE/
@@ -34,6 +34,10 @@ class WiderFace(Dataset):
         self.transform = transform
         self.target_transform = target_transform
         self.is_cache = self.data_cfg.CACHE if hasattr(self.data_cfg, 'CACHE') else False
+        self.cache_mode = data_cfg.CACHE_MODE if data_cfg.__contains__('CACHE_MODE') else 'raw'
+        self.lru = build_lru_cache(data_cfg, self.stage)
+        # size hint for reduced-resolution jpeg decoding, train only so evaluation stays in original pixels
+        self.decode_size = data_cfg.DECODE_SIZE if data_cfg.__contains__('DECODE_SIZE') and self.stage == 'train' else None
 
         self.num_classes = len(self.dictionary)
         self.category = [v for d in self.dictionary for v in d.keys()]
@@ -69,16 +73,21 @@ class WiderFace(Dataset):
             assert len(self._imgs) == len(self._targets), 'len(self._imgs) should be equals to len(self._targets)'
             assert len(self._imgs) > 0, 'Found 0 images in the specified location, pls check it!'
 
-        # Cache images into memory for faster training (WARNING: large datasets may exceed system RAM)
+        # Pack images and parsed boxes into memory-mapped shards
         if self.is_cache and self.stage != 'infer':
-            self.cache = self.cache_data()
+            self.cache, self.cache_targets = self.cache_data()
+            self.is_cache = self.cache is not None
 
     def _parse_xml(self, annopath):
         anno = ET.parse(annopath).getroot()
-        boxes = []
-        labels = []
         height = anno.find("size").find("height").text
         width = anno.find("size").find("width").text
+        boxes, labels = self._parse_boxes(anno)
+        return self._make_target(boxes, labels, height, width)
+
+    def _parse_boxes(self, anno):
+        boxes = []
+        labels = []
         for obj in anno.iter("object"):
             difficult = int(obj.find("difficult").text) == 1
             if not self.use_difficult and difficult:
@@ -101,20 +110,28 @@ class WiderFace(Dataset):
             name = obj.find("name").text.lower().strip()
             labels.append(self.category2id[name])
 
-        boxes = np.array(boxes, dtype=np.float32)
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
         labels = np.array(labels, dtype=np.int64)
 
         keep = (boxes[:, 3] > boxes[:, 1]) & (boxes[:, 2] > boxes[:, 0])
-        boxes = boxes[keep]
-        labels = labels[keep]
+        return boxes[keep], labels[keep]
 
+    def _make_target(self, boxes, labels, height, width, scale=None):
         target = {}
         target["height"] = torch.tensor(int(height))
         target["width"] = torch.tensor(int(width))
         target["boxes"] = boxes
         target["labels"] = torch.tensor(labels)
+        if scale is not None and (scale != 1).any():
+            # image was read smaller than the source, see restore_source_size in det_transforms
+            target["src_scales"] = torch.tensor([scale[1], scale[0]])
         return target
 
+    def _read_image(self, idx):
+        if self.is_cache:
+            return read_reduced(None, self.decode_size, self.cache, idx)
+        return read_reduced(self._imgs[idx], self.decode_size)
+
     def __getitem__(self, idx):
         if self.stage == 'infer':
             _img = cv2.imread(self._imgs[idx])
@@ -122,8 +139,13 @@ class WiderFace(Dataset):
             sample = {'image': _img, 'mask': None}
             return self.transform(sample), img_id
         else:
-            _img = cv2.imread(self._imgs[idx])
-            _target = self._parse_xml(self._targets[idx])
+            _img, scale = self.lru.get(idx, self._read_image) if self.lru is not None else self._read_image(idx)
+            if self.is_cache:
+                boxes, labels = self.cache_targets[idx]
+            else:
+                boxes, labels = self._parse_boxes(ET.parse(self._targets[idx]).getroot())
+            boxes = boxes * np.tile(scale, 2)  # boxes of a reduced-resolution decode or pre-resized cache
+            _target = self._make_target(boxes, labels, _img.shape[0], _img.shape[1], scale)
 
             sample = {'image': _img, 'target': _target}
             sample = self.transform(sample)
@@ -147,44 +169,19 @@ class WiderFace(Dataset):
         return sample
 
     def cache_data(self):
-        cache = {}  # dict
-        NUM_THREADS = 8
-        cache_path = (Path(self.data_cfg.IMG_DIR)/self.stage).with_suffix('.cache')
-        '''
-        if cache_path.is_file():
-            cache = np.load(cache_path, allow_pickle=True).item()
-            if cache['hash'] == get_hash(self._imgs + self._targets):
-                return cache
-        '''
-        desc = f"Scanning '{cache_path.parent / cache_path.stem}' images and labels..."
-        with Pool(NUM_THREADS) as pool:
-            pbar = tqdm(pool.imap_unordered(load_image_label, zip(self._imgs, self._targets)),
-                desc=desc, total=self.__len__())
-            for img_id, _img, _target in pbar:
-                _target = self._parse_xml(_target)
-                sample = {'image': _img, 'target': _target}
-                cache[img_id] = sample
-            pbar.close()
-        cache['hash'] = get_hash(self._imgs + self._targets)
-        try:
-            np.save(cache_path, cache)  # save cache for next time
-            cache_path.with_suffix('.cache.npy').rename(cache_path)  # remove .npy suffix
-            print(f'{self.stage} :New cache created: {cache_path}')
-        except Exception as e:
-            print(f'{self.stage} :WARNING: Cache directory {cache_path.parent} is not writeable: {e}')  # path not writeable
-        return cache
-
-
-def load_image_label(args):
-    img_id, imgpath, ann = args
-    _img = cv2.imread(imgpath)
-    return img_id, _img, ann
-
-
-def get_hash(paths):
-    # Returns a single hash value of a list of paths (files or dirs)
-    size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))  # sizes
-    h = hashlib.md5(str(size).encode())  # hash sizes
-    h.update(''.join(paths).encode())  # hash paths
-    return h.hexdigest()  # return hash
+        cache_path = (Path(self.data_cfg.IMG_DIR)/self.stage).with_suffix('.shards')
+
+        def save_targets(root):
+            targets = [self._parse_boxes(ET.parse(p).getroot()) for p in self._targets]
+            save_annotations(root, pack_box_targets(targets))
 
+        desc = f"Scanning '{cache_path.parent / cache_path.stem}' images and labels..."
+        cache = update_image_cache(cache_path, self._imgs, extras=save_targets, deps=self._targets, desc=desc,
+                                   **cache_options(self.data_cfg))
+        if cache is None:
+            return None, None
+        if self.data_cfg.__contains__('CACHE_SHM') and self.data_cfg.CACHE_SHM:
+            # one copy per node in /dev/shm, mapped read-only by every rank and worker
+            cache = PackedImageReader(stage_to_shm(cache_path))
+        print(f'{self.stage} :Cache {cache.summary(self.__len__())}')
+        return cache, BoxTargetColumns(cache.root)
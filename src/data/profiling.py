@@ -0,0 +1,156 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/25 10:20
+# @Author : liumin
+# @File : profiling.py
+
+import os
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, get_worker_info
+
+__all__ = ['TransformProfiler', 'ProfiledDataset']
+
+"""
+    Opt-in timing of the data pipeline, enabled per stage with PROFILE: True.
+
+    TransformProfiler.attach(compose) makes a det/seg/cls/keypoint/ins Compose time every stage it
+    runs (fused geometric chains count as one stage), ProfiledDataset times dataset[idx] as a
+    whole and books what is not spent in the transforms as 'load' (file read, decode, annotation
+    parsing, mosaic loads). The numbers go to a counter block in shared memory that is allocated
+    in the main process before the DataLoader starts its workers; every worker writes its own row,
+    so no locking is needed, and the trainer sums the rows into a table at the end of the epoch.
+    Every worker also keeps its slowest samples by dataset index in the block, so outlier images
+    can be found and shrunk offline.
+"""
+
+COUNT, TOTAL, MAX = 0, 1, 2
+
+
+def stage_name(t):
+    if hasattr(t, 'transforms') and isinstance(t.transforms, (list, tuple)):
+        # GeometricChain, or a nested Compose
+        return '+'.join(type(s).__name__ for s in t.transforms)
+    return type(t).__name__
+
+
+class TransformProfiler(object):
+    '''
+        :param max_workers: rows of the counter block, DataLoader workers beyond it share rows.
+        :param top_k: slowest samples kept per worker.
+    '''
+    def __init__(self, name='train', max_workers=64, max_slots=64, top_k=10):
+        self.name = name
+        self.names = ['load']
+        self.stats = torch.zeros(max_workers, max_slots, 3, dtype=torch.float64).share_memory_()
+        self.slowest = torch.full((max_workers, top_k, 2), -1.0, dtype=torch.float64).share_memory_()
+        self.samples = torch.zeros(max_workers, 2, dtype=torch.float64).share_memory_()  # count, total
+        self._views = None
+        self._sample_time = 0.0
+
+    def attach(self, compose, prefix=''):
+        '''
+            Profiles compose from now on. Call it in the main process, before the workers start.
+        '''
+        slots = []
+        for t in getattr(compose, 'stages', compose.transforms):
+            name = prefix + stage_name(t)
+            if name not in self.names:
+                assert len(self.names) < self.stats.shape[1], 'too many transforms to profile'
+                self.names.append(name)
+            slots.append(self.names.index(name))
+        compose.profiler = self
+        compose.profile_slots = slots
+
+    def _row(self):
+        pid = os.getpid()
+        if self._views is None or self._views[0] != pid:
+            info = get_worker_info()
+            row = (info.id if info is not None else 0) % self.stats.shape[0]
+            self._views = (pid, self.stats.numpy()[row], self.slowest.numpy()[row], self.samples.numpy()[row])
+        return self._views
+
+    def _record(self, slot, dt):
+        st = self._row()[1][slot]
+        st[COUNT] += 1
+        st[TOTAL] += dt
+        if dt > st[MAX]:
+            st[MAX] = dt
+
+    def run(self, compose, stages, sample):
+        for t, slot in zip(stages, compose.profile_slots):
+            start = time.perf_counter()
+            sample = t(sample)
+            dt = time.perf_counter() - start
+            self._record(slot, dt)
+            self._sample_time += dt
+        return sample
+
+    def record_sample(self, idx, total):
+        '''
+            total wall time of dataset[idx]; the part not spent in the transforms is booked as load.
+        '''
+        self._record(0, max(total - self._sample_time, 0.0))
+        self._sample_time = 0.0
+        _, _, slowest, samples = self._row()
+        samples += (1, total)
+        i = slowest[:, 0].argmin()
+        if total > slowest[i, 0]:
+            slowest[i] = (total, idx)
+
+    def reset(self):
+        self.stats.zero_()
+        self.slowest.fill_(-1)
+        self.samples.zero_()
+
+    def report(self, path_fn=None):
+        '''
+            Table of the counters summed over the workers, then the slowest samples.
+        '''
+        stats = self.stats.numpy()[:, :len(self.names)]
+        count, total = stats[..., COUNT].sum(0), stats[..., TOTAL].sum(0)
+        worst = stats[..., MAX].max(0)
+        n, sample_total = self.samples.numpy().sum(0)
+        lines = [f'------------ Data pipeline ({self.name}): {int(n)} samples, '
+                 f'{1000 * sample_total / max(n, 1):.2f} ms per sample ------------',
+                 '{:<40}{:>10}{:>12}{:>12}{:>10}'.format('stage', 'calls', 'mean ms', 'max ms', 'share')]
+        for k in np.argsort(-total):
+            if count[k]:
+                lines.append('{:<40}{:>10d}{:>12.3f}{:>12.3f}{:>9.1f}%'.format(
+                    self.names[k][:39], int(count[k]), 1000 * total[k] / count[k], 1000 * worst[k],
+                    100 * total[k] / max(sample_total, 1e-12)))
+        slowest = self.slowest.numpy().reshape(-1, 2)
+        slowest = slowest[slowest[:, 0] >= 0]
+        if len(slowest):
+            lines.append('slowest samples:')
+            for t, idx in slowest[np.argsort(-slowest[:, 0])][:self.slowest.shape[1]]:
+                paths = path_fn(int(idx)) if path_fn is not None else []
+                lines.append('    index {:<10d}{:>10.2f} ms  {}'.format(int(idx), 1000 * t, paths[0] if paths else ''))
+        return '\n'.join(lines)
+
+
+class ProfiledDataset(Dataset):
+    '''
+        Times dataset[item] for the profiler; item is an index or an (h, w, index) batch sampler item.
+        Other attributes are the wrapped dataset's.
+    '''
+    def __init__(self, dataset, profiler):
+        self.dataset = dataset
+        self.profiler = profiler
+
+    def __getitem__(self, item):
+        start = time.perf_counter()
+        sample = self.dataset[item]
+        self.profiler.record_sample(item[2] if isinstance(item, tuple) else item, time.perf_counter() - start)
+        return sample
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getattr__(self, name):
+        if name in ('dataset', 'profiler'):
+            # not set yet, e.g. while unpickling in a worker
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
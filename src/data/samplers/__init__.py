@@ -0,0 +1,9 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/22 16:20
+# @Author : liumin
+# @File : __init__.py
+
+from .multi_scale_sampler_DDP import MultiScaleBatchSampler, MultiScaleDataset, get_input_size
+from .aspect_ratio_sampler import AspectRatioBatchSampler
+from .readahead import ReadAheadSampler
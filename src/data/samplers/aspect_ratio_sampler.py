@@ -0,0 +1,77 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/23 10:15
+# @Author : liumin
+# @File : aspect_ratio_sampler.py
+
+import math
+
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data.sampler import Sampler
+
+__all__ = ['AspectRatioBatchSampler']
+
+"""
+    Rectangular batches for evaluation.
+
+    Letterboxing every image to the square input size spends up to half of the pixels of a wide
+    image on padding. AspectRatioBatchSampler sorts the samples by aspect ratio and gives every
+    batch the smallest size, a multiple of stride, that holds all of its images letterboxed at the
+    scale the square input would have used. Batches are lists of (h, w, index) as for
+    MultiScaleBatchSampler, MultiScaleDataset passes (h, w) to the transforms, and Resize sets
+    scales/pads for the actual size, so predictions are mapped back to the images as before.
+"""
+
+
+class AspectRatioBatchSampler(Sampler):
+    '''
+        :param img_shapes: (h, w) of every sample, rows of 0 when unknown (such samples get input_size).
+        :param input_size: (h, w) the images are letterboxed into without rectangular batches.
+        :param stride: batch sizes are rounded up to multiples of stride, but never exceed input_size.
+    '''
+    def __init__(self, img_shapes, input_size, batch_size, stride=32, num_replicas=None, rank=None):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.input_size = tuple(input_size)
+
+        shapes = np.asarray(img_shapes, dtype=np.float64).reshape(-1, 2)
+        H, W = input_size
+        known = (shapes > 0).all(1)
+        shapes[~known] = (H, W)
+        # letterbox scale of every image for the square input, as in Resize(keep_ratio=True)
+        scale = np.minimum(H / shapes[:, 0], W / shapes[:, 1])
+        resized = np.round(shapes * scale[:, None])
+
+        order = np.argsort(shapes[:, 0] / shapes[:, 1], kind='stable')
+        self.batches = []
+        for i in range(0, len(order), batch_size):
+            idx = order[i:i + batch_size]
+            h, w = resized[idx].max(0)
+            h = min(int(math.ceil(h / stride) * stride), H)
+            w = min(int(math.ceil(w / stride) * stride), W)
+            self.batches.append((h, w, idx.tolist()))
+
+        # every rank runs the same number of steps, the first batches are repeated to fill up
+        if self.batches and len(self.batches) % num_replicas:
+            extra = num_replicas - len(self.batches) % num_replicas
+            self.batches += (self.batches * extra)[:extra]
+
+    def __iter__(self):
+        for h, w, idx in self.batches[self.rank::self.num_replicas]:
+            yield [(h, w, i) for i in idx]
+
+    def __len__(self):
+        return len(self.batches[self.rank::self.num_replicas])
+
+    def pixel_ratio(self):
+        '''
+            Input pixels of the rectangular batches relative to letterboxing everything to input_size.
+        '''
+        H, W = self.input_size
+        num = sum(len(idx) for _, _, idx in self.batches)
+        return sum(h * w * len(idx) for h, w, idx in self.batches) / max(1, num * H * W)
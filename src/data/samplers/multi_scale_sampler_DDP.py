@@ -1,89 +1,131 @@
-#!/usr/bin/envpython
-# --coding:utf-8--
-# @Time:2021/10/1818:43
-# @Author:liumin
-# @File:multi_scale_sampler_DDP.py
-
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2021/10/18 18:43
+# @Author : liumin
+# @File : multi_scale_sampler_DDP.py
 
+import numpy as np
 import torch
-from torch.utils.data.sampler import Sampler
 import torch.distributed as dist
-import math
-import random
-import numpy as np
+from torch.utils.data import Dataset
+from torch.utils.data.sampler import Sampler
 
-'''
-class MultiScaleSamplerDDP(Sampler):
-    def __init__(self, base_im_w, base_im_h, base_batch_size, n_data_samples,
-                 min_scale_mult=0.5, max_scale_mult=1.5, n_scales=5, is_training=False):
-        # min. and max. spatial dimensions
-        min_im_w, max_im_w = int(
-            base_im_w * min_scale_mult), int(base_im_w * max_scale_mult)
-        min_im_h, max_im_h = int(
-            base_im_h * min_scale_mult), int(base_im_h * max_scale_mult)
-        # Get the GPU and node related information
-        num_replicas = dist.get_world_size()
-        rank = dist.get_rank()
-        # adjust the total samples to avoid batch dropping
-        num_samples_per_replica = int(
-            math.ceil(n_data_samples * 1.0 / num_replicas))
-        total_size = num_samples_per_replica * num_replicas
-        img_indices = [idx for idx in range(n_data_samples)]
-        img_indices += img_indices[:(total_size − n_data_samples)]
-        assert len(img_indices) == total_size
-
-        self.shuffle = False
-        if is_training:
-            # compute the spatial dimensions and corresponding batchsize
-            width_dims = list(np.linspace(min_im_w, max_im_w, n_scales))
-            height_dims = list(np.linspace(min_im_h, max_im_h, n_scales))
-            # ImageNet models down−sample images by a factor of 32.
-            # Ensure that width and height dimensions are multiple of 32.
-            width_dims = [(w // 32) * 32 for w in width_dims]
-            height_dims = [(h // 32) * 32 for h in height_dims]
-
-            img_batch_pairs = list()
-            base_elements = base_im_w * base_im_h * base_batch_size
-            for (h, w) in zip(height_dims, width_dims):
-                batch_size = max(1, (base_elements / (h * w)))
-                img_batch_pairs.append((h, w, batch_size))
-            self.img_batch_pairs = img_batch_pairs
-            self.shuffle = True
-        else:
-            self.img_batch_pairs = [(base_im_h, base_im_w, base_batch_size)]
-
-        self.img_indices = img_indices
-        self.n_samples_per_replica = num_samples_per_replica
-        self.epoch = 0
-        self.rank = rank
+__all__ = ['MultiScaleBatchSampler', 'MultiScaleDataset', 'get_input_size']
+
+"""
+    Multi-scale training at a constant pixel budget.
+
+    MultiScaleBatchSampler draws an input size (h, w) for every step and pairs it with the batch
+    size that keeps h * w * batch_size close to the base setting, so small-scale steps run bigger
+    batches instead of leaving the GPU idle, and large-scale steps do not spike the memory. Every
+    rank draws the same schedule from seed + epoch and takes its own share of each step.
+
+    Batches are lists of (h, w, index). MultiScaleDataset wraps the dataset, sets the size on the
+    transforms (Compose.set_size) and loads the index, so every sample of a batch comes out of the
+    transforms at the same size and the batch collates as usual.
+"""
+
+
+def get_input_size(transform):
+    '''
+        (h, w) of the first transform in a Compose that produces a fixed output size, or None.
+    '''
+    for t in getattr(transform, 'transforms', []):
+        if hasattr(t, 'set_size') and getattr(t, 'size', None) is not None:
+            size = t.size
+            return (int(size), int(size)) if isinstance(size, (int, float)) else (int(size[0]), int(size[1]))
+    return None
+
+
+class MultiScaleBatchSampler(Sampler):
+    '''
+        :param data_source: the dataset, only its length is used.
+        :param base_size: (h, w) the base_batch_size is tuned for.
+        :param scale_range: range of the scale factors applied to base_size.
+        :param n_scales: number of sizes in scale_range, every size a multiple of stride.
+        :param seed: shared by all ranks, the schedule of an epoch depends on seed + epoch only.
+        :param drop_last: drop the samples that do not fill a last step, else wrap around.
+    '''
+    def __init__(self, data_source, base_size, base_batch_size, scale_range=(0.5, 1.5), n_scales=5, stride=32,
+                 shuffle=True, seed=0, drop_last=True, num_replicas=None, rank=None):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.num_samples = len(data_source)
         self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+        base_h, base_w = base_size
+        budget = base_h * base_w * base_batch_size
+        self.img_batch_pairs = []
+        for s in np.linspace(scale_range[0], scale_range[1], n_scales):
+            h = max(stride, int(round(base_h * s / stride)) * stride)
+            w = max(stride, int(round(base_w * s / stride)) * stride)
+            pair = (h, w, max(1, int(budget // (h * w))))
+            if pair not in self.img_batch_pairs:
+                self.img_batch_pairs.append(pair)
+        self._cached = None
+
+    def _schedule(self):
+        '''
+            Sample order and steps (h, w, batch_size, start) of the current epoch, identical on every rank.
+        '''
+        if self._cached is not None and self._cached[0] == self.epoch:
+            return self._cached[1:]
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        n = self.num_samples
+        indices = torch.randperm(n, generator=g).tolist() if self.shuffle else list(range(n))
+        choices = torch.randint(len(self.img_batch_pairs), (max(n, 1),), generator=g).tolist()
+
+        steps, start = [], 0
+        for c in choices:
+            h, w, b = self.img_batch_pairs[c]
+            if start >= n or (self.drop_last and start + b * self.num_replicas > n):
+                break
+            steps.append((h, w, b, start))
+            start += b * self.num_replicas
+        self._cached = (self.epoch, indices, steps)
+        return indices, steps
 
     def __iter__(self):
-        if self.shuffle:
-            random.seed(self.epoch)
-            random.shuffle(self.img_indices)
-            random.shuffle(self.img_batch_pairs)
-            indices_rank_i = self.img_indices[self.rank:len(
-                self.img_indices):self.num_replicas]
-        else:
-            indices_rank_i = self.img_indices[self.rank:len(
-                self.img_indices):self.num_replicas]
-            start_index = 0
-            while start_index < self.n_samples_per_replica:
-                curr_h, curr_w, curr_bsz = random.choice(self.img_batch_pairs)
-                end_index = min(
-                    start_index + curr_bsz,
-                    self.n_samples_per_replica)
-                batch_ids = indices_rank_i[start_index:end_index]
-                n_batch_samples = len(batch_ids)
-                if n_batch_samples != curr_bsz:
-                    batch_ids += indices_rank_i[:(curr_bsz−n_batch_samples)]
-                start_index += curr_bsz
-
-                if len(batch_ids) > 0:
-                    batch = [(curr_h, curr_w, b_id) for b_id in batch_ids]
-                    yield batch
+        indices, steps = self._schedule()
+        n = len(indices)
+        for h, w, b, start in steps:
+            # rank r takes the r-th block of b samples of the step, wrapping around at the end
+            first = start + self.rank * b
+            yield [(h, w, indices[(first + k) % n]) for k in range(b)]
+
+    def __len__(self):
+        return len(self._schedule()[1])
 
     def set_epoch(self, epoch):
         self.epoch = epoch
-'''
\ No newline at end of file
+
+
+class MultiScaleDataset(Dataset):
+    '''
+        Accepts the (h, w, index) items of MultiScaleBatchSampler: sets (h, w) as output size of
+        dataset.transform, then loads dataset[index]. Other attributes are the wrapped dataset's.
+    '''
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, item):
+        h, w, idx = item
+        self.dataset.transform.set_size((h, w))
+        return self.dataset[idx]
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getattr__(self, name):
+        if name == 'dataset':
+            # not set yet, e.g. while unpickling in a worker
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
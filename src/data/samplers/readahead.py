@@ -0,0 +1,129 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/24 11:20
+# @Author : liumin
+# @File : readahead.py
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from torch.utils.data.sampler import Sampler
+
+__all__ = ['ReadAheadSampler']
+
+"""
+    Sampler-driven read-ahead of the files of upcoming samples, enabled with READAHEAD.
+
+    The sampler (RandomSampler, DistributedSampler, the batch samplers) fixes the order of the
+    epoch for this rank before the first sample is loaded. ReadAheadSampler materialises that
+    order and keeps a background thread up to `depth` items ahead of the DataLoader, issuing
+    posix_fadvise(WILLNEED) for the image and label files of every upcoming index on a few threads,
+    so the kernel fetches them from network storage while the workers are still busy and the
+    workers' cv2.imread hits the page cache. mode='read' reads the files instead, for file systems
+    that ignore fadvise.
+
+    In mode='read' a sample counts as a hit when the reads of all its files had completed when the
+    sampler handed it to the DataLoader. Workers read a little later still (prefetch_factor), so the
+    hit rate is a lower bound. posix_fadvise only queues the fetch and returns at once, so in
+    mode='fadvise' the summary reports the share of samples advised ahead of use instead, which says
+    nothing about whether the pages had arrived. Random mosaic partners are drawn in the workers and
+    are not covered.
+"""
+
+
+def _indices(item):
+    # int for samplers, list of ints or of (h, w, index) for batch samplers
+    if isinstance(item, tuple):
+        return [item[2]]
+    if isinstance(item, list):
+        return [i for it in item for i in _indices(it)]
+    return [int(item)]
+
+
+class ReadAheadSampler(Sampler):
+    '''
+        Wraps sampler (or batch_sampler) and yields its items unchanged.
+        :param path_fn: index -> list of the files the dataset reads for it.
+    '''
+    def __init__(self, sampler, path_fn, depth=256, num_threads=8, mode='fadvise'):
+        assert mode in ('fadvise', 'read'), 'read-ahead mode must be fadvise or read'
+        self.sampler = sampler
+        self.path_fn = path_fn
+        self.depth = depth
+        self.num_threads = num_threads
+        self.mode = mode if hasattr(os, 'posix_fadvise') else 'read'
+        self.epoch_stats = None
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def _advise(self, path):
+        try:
+            if self.mode == 'fadvise':
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            else:
+                with open(path, 'rb', buffering=0) as f:
+                    while f.read(1 << 20):
+                        pass
+            return True
+        except OSError:
+            return False
+
+    def __iter__(self):
+        items = list(self.sampler)
+        futures = [None] * len(items)
+        cond = threading.Condition()
+        state = {'consumed': 0, 'stop': False}
+        pool = ThreadPoolExecutor(self.num_threads)
+
+        def produce():
+            for pos, item in enumerate(items):
+                with cond:
+                    while pos >= state['consumed'] + self.depth and not state['stop']:
+                        cond.wait()
+                    if state['stop']:
+                        return
+                paths = [p for i in _indices(item) for p in self.path_fn(i)]
+                futures[pos] = [pool.submit(self._advise, p) for p in paths]
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        hits, used, files, errors = 0, 0, 0, 0
+        try:
+            for pos, item in enumerate(items):
+                used += 1
+                fs = futures[pos]
+                if fs is not None and all(f.done() for f in fs):
+                    hits += 1
+                with cond:
+                    state['consumed'] = pos + 1
+                    cond.notify()
+                yield item
+        finally:
+            with cond:
+                state['stop'] = True
+                cond.notify()
+            producer.join()
+            pool.shutdown(wait=True)
+            for fs in futures:
+                for f in fs or []:
+                    files += 1
+                    errors += not f.result()
+            self.epoch_stats = dict(items=used, hits=hits, files=files, errors=errors)
+
+    def summary(self):
+        s = self.epoch_stats
+        if s is None:
+            return 'no epoch finished'
+        label = 'hit rate' if self.mode == 'read' else 'advised ahead of use'
+        return 'read-ahead ({}): {} {:.1f}% of {} items, {} files, {} errors'.format(
+            self.mode, label, 100.0 * s['hits'] / max(s['items'], 1), s['items'], s['files'], s['errors'])
@@ -15,8 +15,13 @@ import src.data.transforms.seg_target_transforms as seg_target_t
 import src.data.transforms.det_target_transforms as det_target_t
 import src.data.transforms.ins_target_transforms as ins_target_t
 import src.data.transforms.keypoint_target_transforms as kyp_target_t
+import src.data.transforms.batch_transforms as batch_t
 
-def build_transforms(dict_name, cfg, mode='train'):
+def build_transforms(dict_name, cfg, mode='train', uint8=False):
+    '''
+        With uint8, ToTensor keeps images as H x W x C uint8 and Normalize is left to the device,
+        see build_batch_transforms.
+    '''
     _params = []
 
     if dict_name == 'CLS_CLASSES':
@@ -34,6 +39,10 @@ def build_transforms(dict_name, cfg, mode='train'):
 
     transform_cfg = copy.deepcopy(cfg)
     for t, v in transform_cfg.items():
+        if uint8 and t == 'Normalize':
+            continue
+        if uint8 and t == 'ToTensor':
+            v = dict(v or {}, uint8=True)
         t = getattr(trans, t)(**v) if v is not None else getattr(trans, t)()
         if hasattr(t, 'set_load_image_func'):
             t.set_load_image_func()
@@ -61,4 +70,40 @@ def build_targets_transforms(dict_name, cfg, mode='train'):
     for t, v in transform_cfg.items():
         t = getattr(trans, t)(**v) if v is not None else getattr(trans, t)()
         _params.append(t)
-    return trans.Compose(_params)
\ No newline at end of file
+    return trans.Compose(_params)
+
+
+def build_batch_transforms(cfg, transforms_cfg=None, uint8=False):
+    '''
+        Batched photometric ops from a BATCH_TRANSFORMS section, applied by the trainer on the
+        collated batch on device. None when there is nothing to apply.
+
+        With uint8 (transforms built by build_transforms(..., uint8=True)) the batch is first
+        converted by FromUint8, with the scale of ToTensor and the mean/std of Normalize from
+        transforms_cfg: fused into the conversion without batch ops, else applied after them.
+    '''
+    _params = []
+    if cfg is not None:
+        transform_cfg = copy.deepcopy(cfg)
+        for t, v in transform_cfg.items():
+            t = getattr(batch_t, t)(**v) if v is not None else getattr(batch_t, t)()
+            _params.append(t)
+
+    if uint8:
+        to_tensor, normalize = {}, {}
+        if transforms_cfg is not None:
+            if transforms_cfg.__contains__('ToTensor') and transforms_cfg['ToTensor'] is not None:
+                to_tensor = dict(transforms_cfg['ToTensor'])
+            if transforms_cfg.__contains__('Normalize') and transforms_cfg['Normalize'] is not None:
+                normalize = dict(transforms_cfg['Normalize'])
+        scale = 1 / 255.0 if to_tensor.get('normalize', True) else 1.0
+        if not _params:
+            _params = [batch_t.FromUint8(scale, **normalize)]
+        else:
+            _params = [batch_t.FromUint8(scale)] + _params
+            if normalize and not any(isinstance(t, batch_t.Normalize) for t in _params):
+                _params.append(batch_t.Normalize(**normalize))
+
+    if not _params:
+        return None
+    return batch_t.Compose(_params)
\ No newline at end of file
@@ -0,0 +1,290 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/21 9:30
+# @Author : liumin
+# @File : batch_transforms.py
+
+import numbers
+
+import torch
+import torch.nn.functional as F
+
+__all__ = ['Compose', 'FromUint8', 'ColorHSV', 'ColorJitter', 'PhotoMetricDistortion', 'RandomGrayscale',
+           'GaussianBlur', 'MedianBlur', 'Normalize']
+
+"""
+    Batched photometric augmentation, configured by BATCH_TRANSFORMS next to TRANSFORMS.
+
+    The ops run in the trainer on the collated batch, after it was moved to the device of the
+    model, so DataLoader workers only decode and apply geometry. Every op draws its parameters per
+    sample as vectors and applies them in one pass over the batch.
+
+    Input is a float N x 3 x H x W RGB batch in [0, 1], i.e. the output of ToTensor with
+    normalize: True; Normalize, when used, comes last. Lists of differently sized images are
+    processed one image at a time. With UINT8_TRANSPORT the batch arrives as N x H x W x C uint8
+    and FromUint8 is put first.
+"""
+
+
+def _uniform(n, low, high, device):
+    return torch.empty(n, device=device).uniform_(low, high)
+
+
+def _select(p, n, device):
+    return torch.rand(n, device=device) < p
+
+
+def _where(mask, new, old):
+    return torch.where(mask.view(-1, 1, 1, 1), new, old)
+
+
+def _range(value, name, center=1, bound=(0, float('inf')), clip_first_on_zero=True):
+    # same conventions as seg_transforms.ColorJitter._check_input
+    if isinstance(value, numbers.Number):
+        if value < 0:
+            raise ValueError("If {} is a single number, it must be non negative.".format(name))
+        value = [center - value, center + value]
+        if clip_first_on_zero:
+            value[0] = max(value[0], 0)
+    elif isinstance(value, (tuple, list)) and len(value) == 2:
+        if not bound[0] <= value[0] <= value[1] <= bound[1]:
+            raise ValueError("{} values should be between {}".format(name, bound))
+    else:
+        raise TypeError("{} should be a single number or a list/tuple with lenght 2.".format(name))
+    if value[0] == value[1] == center:
+        return None
+    return value
+
+
+def rgb_to_grayscale(img):
+    r, g, b = img.unbind(1)
+    return (0.299 * r + 0.587 * g + 0.114 * b).unsqueeze(1)
+
+
+def rgb_to_hsv(img):
+    '''
+        N x 3 x H x W RGB in [0, 1] to HSV, all channels in [0, 1].
+    '''
+    r, g, b = img.unbind(1)
+    maxc, _ = img.max(1)
+    minc, _ = img.min(1)
+    delta = maxc - minc
+    s = delta / maxc.clamp(min=1e-8)
+    safe = delta.clamp(min=1e-8)
+    rc, gc, bc = (maxc - r) / safe, (maxc - g) / safe, (maxc - b) / safe
+    h = torch.where(maxc == r, bc - gc, torch.where(maxc == g, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = torch.where(delta > 0, (h / 6.0) % 1.0, torch.zeros_like(h))
+    return torch.stack((h, s, maxc), 1)
+
+
+def hsv_to_rgb(img):
+    h, s, v = img.unbind(1)
+    i = torch.floor(h * 6.0)
+    f = h * 6.0 - i
+    i = i.long() % 6
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    # rows: r, g, b for each of the 6 hue sectors
+    table = torch.stack((torch.stack((v, q, p, p, t, v), 1),
+                         torch.stack((t, v, v, q, p, p), 1),
+                         torch.stack((p, p, t, v, v, q), 1)), 1)
+    return table.gather(2, i.unsqueeze(1).unsqueeze(1).expand(-1, 3, 1, -1, -1)).squeeze(2)
+
+
+def _per_ksize(img, mask, ksize, fn):
+    # blurs samples in mask, grouped by their randomly drawn kernel size
+    if not mask.any():
+        return img
+    choice = torch.randint(len(ksize), (img.shape[0],), device=img.device)
+    out = img.clone()
+    for j, k in enumerate(ksize):
+        idx = torch.nonzero(mask & (choice == j)).flatten()
+        if len(idx):
+            out[idx] = fn(img[idx], int(k))
+    return out
+
+
+def gaussian_blur(img, k):
+    # sigma as cv2.GaussianBlur(img, (k, k), 0), borders reflected like BORDER_REFLECT_101
+    sigma = 0.3 * ((k - 1) * 0.5 - 1) + 0.8
+    x = torch.arange(k, device=img.device, dtype=img.dtype) - (k - 1) / 2
+    kernel = torch.exp(-x ** 2 / (2 * sigma ** 2))
+    kernel = kernel / kernel.sum()
+    c = img.shape[1]
+    img = F.pad(img, [k // 2] * 4, mode='reflect')
+    img = F.conv2d(img, kernel.view(1, 1, 1, k).expand(c, 1, 1, k), groups=c)
+    return F.conv2d(img, kernel.view(1, 1, k, 1).expand(c, 1, k, 1), groups=c)
+
+
+def median_blur(img, k):
+    # borders replicated like cv2.medianBlur
+    n, c, h, w = img.shape
+    patches = F.unfold(F.pad(img, [k // 2] * 4, mode='replicate'), k)
+    return patches.view(n, c, k * k, h * w).median(2)[0].view(n, c, h, w)
+
+
+class Compose(object):
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    @torch.no_grad()
+    def __call__(self, imgs):
+        if isinstance(imgs, (list, tuple)):
+            return [self(img.unsqueeze(0)).squeeze(0) for img in imgs]
+        for t in self.transforms:
+            imgs = t(imgs)
+        return imgs
+
+
+class FromUint8(object):
+    '''
+        N x H x W x C uint8 to N x C x H x W float, x * scale normalized with mean and std, in one
+        converting copy and one in-place pass. ToTensor(uint8=True) batches reach the model as
+        ToTensor + Normalize would have produced them.
+    '''
+    def __init__(self, scale=1 / 255.0, mean=(0., 0., 0.), std=(1., 1., 1.)):
+        self.scale = scale
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, img):
+        # (x * scale - mean) / std == x * a + b
+        std = torch.as_tensor(self.std, dtype=torch.float32, device=img.device).view(1, -1, 1, 1)
+        a = self.scale / std
+        b = -torch.as_tensor(self.mean, dtype=torch.float32, device=img.device).view(1, -1, 1, 1) / std
+        img = img.permute(0, 3, 1, 2).to(dtype=torch.float32, memory_format=torch.contiguous_format)
+        return img.mul_(a).add_(b)
+
+
+class ColorHSV(object):
+    '''
+        det_transforms.ColorHSV: random gains on hue, saturation and value.
+    '''
+    def __init__(self, p=0.5, hue=0, saturation=0, value=0):
+        self.p = p
+        self.gains = (hue, saturation, value)
+
+    def __call__(self, img):
+        n = img.shape[0]
+        mask = _select(self.p, n, img.device)
+        if not mask.any():
+            return img
+        r = torch.empty(n, 3, device=img.device).uniform_(-1, 1) * img.new_tensor(self.gains) + 1
+        r = r.view(n, 3, 1, 1)
+        hsv = rgb_to_hsv(img)
+        hsv = torch.stack(((hsv[:, 0] * r[:, 0]) % 1.0, (hsv[:, 1] * r[:, 1]).clamp(0, 1),
+                           (hsv[:, 2] * r[:, 2]).clamp(0, 1)), 1)
+        return _where(mask, hsv_to_rgb(hsv), img)
+
+
+class ColorJitter(object):
+    '''
+        Brightness, contrast, saturation and hue factors as in torchvision's ColorJitter, applied
+        in that fixed order.
+    '''
+    def __init__(self, p=0.5, brightness=0, contrast=0, saturation=0, hue=0):
+        self.p = p
+        self.brightness = _range(brightness, 'brightness')
+        self.contrast = _range(contrast, 'contrast')
+        self.saturation = _range(saturation, 'saturation')
+        self.hue = _range(hue, 'hue', center=0, bound=(-0.5, 0.5), clip_first_on_zero=False)
+
+    def __call__(self, img):
+        n, device = img.shape[0], img.device
+        mask = _select(self.p, n, device)
+        if not mask.any():
+            return img
+        out = img
+        if self.brightness is not None:
+            out = (out * _uniform(n, *self.brightness, device).view(-1, 1, 1, 1)).clamp(0, 1)
+        if self.contrast is not None:
+            mean = rgb_to_grayscale(out).mean((1, 2, 3), keepdim=True)
+            f = _uniform(n, *self.contrast, device).view(-1, 1, 1, 1)
+            out = (mean + (out - mean) * f).clamp(0, 1)
+        if self.saturation is not None:
+            gray = rgb_to_grayscale(out)
+            f = _uniform(n, *self.saturation, device).view(-1, 1, 1, 1)
+            out = (gray + (out - gray) * f).clamp(0, 1)
+        if self.hue is not None:
+            hsv = rgb_to_hsv(out)
+            shift = _uniform(n, *self.hue, device).view(-1, 1, 1)
+            out = hsv_to_rgb(torch.stack(((hsv[:, 0] + shift) % 1.0, hsv[:, 1], hsv[:, 2]), 1))
+        return _where(mask, out, img)
+
+
+class PhotoMetricDistortion(object):
+    '''
+        seg_transforms.PhotoMetricDistortion: every step applied with probability 0.5 per sample,
+        contrast before or after saturation/hue with probability 0.5. Deltas are in 0-255 (brightness)
+        and 0-180 (hue) units like the per-sample version.
+    '''
+    def __init__(self, brightness_delta=32, contrast_range=(0.5, 1.5), saturation_range=(0.5, 1.5), hue_delta=18):
+        self.brightness_delta = brightness_delta
+        self.contrast_lower, self.contrast_upper = contrast_range
+        self.saturation_lower, self.saturation_upper = saturation_range
+        self.hue_delta = hue_delta
+
+    def _contrast(self, img, mask):
+        f = _uniform(img.shape[0], self.contrast_lower, self.contrast_upper, img.device)
+        f = torch.where(mask, f, torch.ones_like(f)).view(-1, 1, 1, 1)
+        return (img * f).clamp(0, 1)
+
+    def __call__(self, img):
+        n, device = img.shape[0], img.device
+        coin = torch.rand(n, 5, device=device) < 0.5  # brightness, mode, contrast, saturation, hue
+
+        delta = _uniform(n, -self.brightness_delta, self.brightness_delta, device) / 255.0
+        img = (img + (delta * coin[:, 0]).view(-1, 1, 1, 1)).clamp(0, 1)
+
+        contrast_first = coin[:, 1]
+        img = self._contrast(img, coin[:, 2] & contrast_first)
+
+        hsv = rgb_to_hsv(img)
+        sat = _uniform(n, self.saturation_lower, self.saturation_upper, device)
+        sat = torch.where(coin[:, 3], sat, torch.ones_like(sat)).view(-1, 1, 1)
+        shift = torch.randint(-self.hue_delta, self.hue_delta + 1, (n,), device=device).float() / 180.0
+        shift = (shift * coin[:, 4]).view(-1, 1, 1)
+        img = hsv_to_rgb(torch.stack(((hsv[:, 0] + shift) % 1.0, (hsv[:, 1] * sat).clamp(0, 1), hsv[:, 2]), 1))
+
+        return self._contrast(img, coin[:, 2] & ~contrast_first)
+
+
+class RandomGrayscale(object):
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def __call__(self, img):
+        mask = _select(self.p, img.shape[0], img.device)
+        if not mask.any():
+            return img
+        return _where(mask, rgb_to_grayscale(img).expand_as(img), img)
+
+
+class GaussianBlur(object):
+    def __init__(self, p=0.01, ksize=[3, 5, 7]):
+        self.p = p
+        self.ksize = ksize
+
+    def __call__(self, img):
+        return _per_ksize(img, _select(self.p, img.shape[0], img.device), self.ksize, gaussian_blur)
+
+
+class MedianBlur(object):
+    def __init__(self, p=0.01, ksize=[3, 5, 7]):
+        self.p = p
+        self.ksize = ksize
+
+    def __call__(self, img):
+        return _per_ksize(img, _select(self.p, img.shape[0], img.device), self.ksize, median_blur)
+
+
+class Normalize(object):
+    def __init__(self, mean=(0., 0., 0.), std=(1., 1., 1.)):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, img):
+        mean = img.new_tensor(self.mean).view(1, -1, 1, 1)
+        std = img.new_tensor(self.std).view(1, -1, 1, 1)
+        return (img - mean) / std
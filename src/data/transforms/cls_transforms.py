@@ -46,10 +46,23 @@ def clip_boxes_to_image(boxes, size):
 class Compose(object):
     def __init__(self, transforms):
         self.transforms = transforms
+        # per-stage timing with PROFILE, see src/data/profiling.py
+        self.profiler = None
 
-    def __call__(self, sample):
+    def set_size(self, size):
+        '''
+            Output size (h, w) of the transforms with a fixed output size, see MultiScaleBatchSampler.
+        '''
         for t in self.transforms:
-            sample = t(sample)
+            if hasattr(t, 'set_size'):
+                t.set_size(size)
+
+    def __call__(self, sample):
+        if self.profiler is not None:
+            sample = self.profiler.run(self, self.transforms, sample)
+        else:
+            for t in self.transforms:
+                sample = t(sample)
         return sample
 
 
@@ -84,12 +97,16 @@ class DeNormalize(object):
 
 class ToTensor(object):
     """Convert ndarrays in sample to Tensors."""
+    def __init__(self, uint8=False):
+        self.uint8 = uint8  # H x W x C uint8 image, see det_transforms.ToTensor
 
     def __call__(self, sample):
         # swap color axis because
         # numpy image: H x W x C
         # torch image: C X H X W
         img, target = sample['image'], sample['target']
+        if self.uint8:
+            return {'image': torch.from_numpy(np.ascontiguousarray(img, dtype=np.uint8)), 'target': torch.tensor(target)}
         img = F.to_tensor(img.astype(np.uint8))
         target = torch.tensor(target)
         return {'image': img, 'target': target}
@@ -99,6 +116,9 @@ class Resize(object):
     def __init__(self, size): # size: (h, w)
         self.size = (size, size) if isinstance(size, int) else (size)
 
+    def set_size(self, size):
+        self.size = tuple(int(s) for s in size)
+
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
         img = cv2.resize(img, tuple(self.size[::-1]), interpolation=cv2.INTER_LINEAR)
@@ -146,6 +166,9 @@ class RandomResizedCrop(object):
         self.fill = fill
         self.min_size = min_size
 
+    def set_size(self, size):
+        self.size = tuple(int(s) for s in size)
+
     @staticmethod
     def get_params(img, scale, ratio):
         """Get parameters for ``crop`` for a random sized crop.
@@ -307,6 +330,9 @@ class RandomCrop(object):
         else:
             self.size = size
 
+    def set_size(self, size):
+        self.size = tuple(int(s) for s in size)
+
     def __call__(self, sample): # [h, w]
         img, target = sample['image'], sample['target']
         h, w,_ = img.shape
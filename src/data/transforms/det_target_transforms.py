@@ -16,8 +16,12 @@ __all__ = ['Compose']
 class Compose(object):
     def __init__(self, transforms):
         self.transforms = transforms
+        # per-stage timing with PROFILE, see src/data/profiling.py
+        self.profiler = None
 
     def __call__(self, sample):
+        if self.profiler is not None:
+            return self.profiler.run(self, self.transforms, sample)
         for t in self.transforms:
             sample = t(sample)
         return sample
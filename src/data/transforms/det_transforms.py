@@ -19,6 +19,9 @@ from torchvision import transforms as T
 from torchvision.transforms import functional as F
 from pycocotools import mask as coco_mask
 
+from src.data.transforms.geometry import translate_matrix, scale_matrix, center_scale_matrix, flip_matrix, \
+    group_geometric, plan_geometry, warp, warp_points, warp_boxes, linear_scale
+
 
 __all__ = ['RandomHorizontalFlip', 'RandomVerticalFlip',
         'Resize', 'RandomResizedCrop', 'RandomCrop',
@@ -67,25 +70,122 @@ def clip_boxes_to_image(boxes, size):
     return boxes
 
 
-class Compose(object):
+def restore_source_size(target):
+    '''
+        Folds the src_scales of an image read from a pre-resized cache into scales, and sets
+        height/width back to the source image, so predictions map to original coordinates.
+    '''
+    src_scales = target.pop("src_scales")
+    target["height"] = torch.tensor(int(round(float(target["height"]) / float(src_scales[0]))))
+    target["width"] = torch.tensor(int(round(float(target["width"]) / float(src_scales[1]))))
+    if "scales" in target:
+        target["scales"] = target["scales"] * src_scales
+    else:
+        target["pads"] = torch.tensor([0, 0])
+        target["scales"] = src_scales
+    return target
+
+
+class GeometricChain(object):
+    '''
+        Consecutive geometric transforms applied as a single warp, see geometry.py. Lists of
+        samples (mosaic inputs) go through the transforms one by one.
+    '''
     def __init__(self, transforms):
         self.transforms = transforms
+        self.fill = next((t.fill for t in reversed(transforms) if hasattr(t, 'fill')), [0, 0, 0])
 
     def __call__(self, sample):
+        if not isinstance(sample, dict) or not isinstance(sample.get('target'), dict):
+            for t in self.transforms:
+                sample = t(sample)
+            return sample
+
+        img, target = sample['image'], sample['target']
+        M, (h, w), metas, B = plan_geometry(self.transforms, img.shape)
+        if M is None:
+            return sample
+        img = warp(img, M, (h, w), cv2.INTER_LINEAR, self.fill)
+
+        filter_boxes = False
+        for meta in metas:
+            meta = dict(meta)
+            filter_boxes |= meta.pop('filter_boxes', False)
+            target.update(meta)
+
+        boxes = target["boxes"]
+        new = warp_boxes(boxes, B)
+        keep = None
+        if filter_boxes and len(new):
+            new[:, [0, 2]] = new[:, [0, 2]].clip(0, w)
+            new[:, [1, 3]] = new[:, [1, 3]].clip(0, h)
+            keep = box_candidates(box1=boxes.T * linear_scale(M), box2=new.T, area_thr=0.10)
+            new = new[keep]
+            target["labels"] = target["labels"][keep]
+        target["boxes"] = new.astype(np.float32)
+
+        if target.__contains__("masks"):
+            masks = target["masks"] if keep is None else target["masks"][keep]
+            if len(masks):
+                masks = warp(np.ascontiguousarray(masks.transpose((1, 2, 0)), dtype=np.uint8), M, (h, w),
+                             cv2.INTER_NEAREST, 0).reshape(h, w, -1).transpose((2, 0, 1)).astype(masks.dtype)
+            else:
+                masks = np.zeros((0, h, w), dtype=np.uint8)
+            target["masks"] = masks
+        if target.__contains__("keypoints"):
+            keypoints = target["keypoints"] if keep is None else target["keypoints"][keep]
+            if len(keypoints):
+                keypoints = keypoints.clone()
+                xy = warp_points(keypoints[..., :2].numpy(), B).reshape(keypoints.shape[:-1] + (2,))
+                keypoints[..., :2] = torch.from_numpy(xy)
+            target["keypoints"] = keypoints
+        return {'image': img, 'target': target}
+
+
+class Compose(object):
+    def __init__(self, transforms):
+        self.transforms = transforms
+        # per-stage timing with PROFILE, see src/data/profiling.py
+        self.profiler = None
+        # consecutive geometric transforms (get_matrix) resample the image only once
+        self.stages = [GeometricChain(t) if isinstance(t, list) else t for t in group_geometric(transforms)]
+
+    def set_size(self, size):
+        '''
+            Output size (h, w) of the transforms with a fixed output size, see MultiScaleBatchSampler.
+        '''
         for t in self.transforms:
-            sample = t(sample)
+            if hasattr(t, 'set_size'):
+                t.set_size(size)
+
+    def __call__(self, sample):
+        if self.profiler is not None:
+            sample = self.profiler.run(self, self.stages, sample)
+        else:
+            for t in self.stages:
+                sample = t(sample)
+        if isinstance(sample, dict) and isinstance(sample.get('target'), dict) and "src_scales" in sample['target']:
+            restore_source_size(sample['target'])
         return sample
 
 
 class ToTensor(object):
-    def __init__(self, normalize=True, target_type='uint8'):
+    '''
+        With uint8 the image stays an H x W x C uint8 RGB tensor, a quarter of the float bytes through
+        the DataLoader and the host to device copy; batch_transforms.FromUint8 converts it on device.
+    '''
+    def __init__(self, normalize=True, target_type='uint8', uint8=False):
         self.normalize = normalize
         self.target_type = target_type
+        self.uint8 = uint8
 
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
-        img = img.transpose((2, 0, 1))[::-1] # HWC to CHW, BGR to RGB
-        img = np.ascontiguousarray(img)
+        if self.uint8:
+            img = np.ascontiguousarray(img[..., ::-1])  # BGR to RGB
+        else:
+            img = img.transpose((2, 0, 1))[::-1] # HWC to CHW, BGR to RGB
+            img = np.ascontiguousarray(img)
 
         target["boxes"] = torch.from_numpy(target["boxes"])
         if target.__contains__("masks"):
@@ -93,6 +193,8 @@ class ToTensor(object):
             mask = mask.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
             mask = np.ascontiguousarray(mask)
             target["masks"] = torch.from_numpy(mask)
+        if self.uint8:
+            return {'image': torch.from_numpy(img), 'target': target}
         if self.normalize:
             return {'image': torch.from_numpy(img.astype(np.float32)).div_(255.0), 'target': target}
         else:
@@ -138,6 +240,11 @@ class RandomHorizontalFlip(object):
             return {'image': cv2.flip(img, 1),'target': target}
         return {'image': img,'target': target}
 
+    def get_matrix(self, shape):
+        if random.random() < self.p:
+            return flip_matrix(shape, horizontal=True), shape, None
+        return None
+
 
 class RandomVerticalFlip(object):
     def __init__(self, p=0.5):
@@ -157,6 +264,11 @@ class RandomVerticalFlip(object):
             return {'image': cv2.flip(img, 0), 'target': target}
         return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        if random.random() < self.p:
+            return flip_matrix(shape, horizontal=False, vertical=True), shape, None
+        return None
+
 
 
 class Resize(object):
@@ -168,6 +280,9 @@ class Resize(object):
         self.scaleup = scaleup # only valid when the keep_ratio is True
         self.fill = fill
 
+    def set_size(self, size):
+        self.size = [int(s) for s in size]
+
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
         h, w, _ = img.shape
@@ -207,6 +322,27 @@ class Resize(object):
             target["scales"] = torch.tensor([scale_h, scale_w])
             return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        h, w = shape[:2]
+        if self.keep_ratio:
+            scale = min(self.size[0] / h, self.size[1] / w)
+            if not self.scaleup:
+                scale = min(scale, 1.0)
+            oh, ow = int(round(h * scale)), int(round(w * scale))
+            top = int(round((self.size[0] - oh) / 2 - 0.1))
+            left = int(round((self.size[1] - ow) / 2 - 0.1))
+            T = translate_matrix(left, top)
+            # the image is resized to (ow, oh), the boxes are scaled by scale
+            M = T @ center_scale_matrix(ow / w, oh / h)
+            meta = {"pads": torch.tensor([top, left]), "scales": torch.tensor([scale, scale]),
+                    "box_matrix": T @ scale_matrix(scale, scale)}
+        else:
+            scale_h, scale_w = self.size[0] / h, self.size[1] / w
+            M = center_scale_matrix(scale_w, scale_h)
+            meta = {"pads": torch.tensor([0, 0]), "scales": torch.tensor([scale_h, scale_w]),
+                    "box_matrix": scale_matrix(scale_w, scale_h)}
+        return M, tuple(self.size), meta
+
 
 class RandomCrop(object):
     """Crop the given image at a random location.
@@ -259,6 +395,9 @@ class RandomCrop(object):
         self.fill = fill
         self.min_size = min_size
 
+    def set_size(self, size):
+        self.size = [int(s) for s in size]
+
     @staticmethod
     def get_params(img, output_size):
         """Get parameters for ``crop`` for a random crop.
@@ -464,6 +603,9 @@ class RandomResizedCrop(object):
         self.fill = fill
         self.min_size = min_size
 
+    def set_size(self, size):
+        self.size = [int(s) for s in size]
+
     @staticmethod
     def get_params(img, scale, ratio):
         """Get parameters for ``crop`` for a random sized crop.
@@ -636,15 +778,13 @@ class ColorHSV(object):
         img, target = sample['image'], sample['target']
         if random.random() < self.p:
             r = np.random.uniform(-1, 1, 3) * [self.hue, self.saturation, self.value] + 1  # random gains
-            hue, sat, val = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+            im_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
             dtype = img.dtype  # uint8
 
+            # one 3-channel LUT over the interleaved image instead of split, 3 LUTs and merge
             x = np.arange(0, 256, dtype=r.dtype)
-            lut_hue = ((x * r[0]) % 180).astype(dtype)
-            lut_sat = np.clip(x * r[1], 0, 255).astype(dtype)
-            lut_val = np.clip(x * r[2], 0, 255).astype(dtype)
-
-            im_hsv = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val)))
+            lut = np.stack(((x * r[0]) % 180, np.clip(x * r[1], 0, 255), np.clip(x * r[2], 0, 255)), 1)
+            cv2.LUT(im_hsv, lut.astype(dtype).reshape(256, 1, 3), dst=im_hsv)
             return {'image': cv2.cvtColor(im_hsv, cv2.COLOR_HSV2BGR, dst=img), 'target': target}
         return {'image': img, 'target': target}
 
@@ -811,16 +951,16 @@ def box_candidates(box1, box2, wh_thr=2, ar_thr=20, area_thr=0.1, eps=1e-16):  #
     return (w2 > wh_thr) & (h2 > wh_thr) & (w2 * h2 / (w1 * h1 + eps) > area_thr) & (ar < ar_thr)  # candidates
 
 
-def random_perspective(img, boxes, labels, degrees=[0., 0.], translate=0., scale=[0.5, 1.5], shear=[0., 0.],
-                       perspective=[0., 0.], border=(0, 0), fill=[0, 0, 0]):
-    # im, targets = (), segments = (), degrees = 10, translate = .1, scale = .1, shear = 10, perspective = 0.0, border = (0, 0)
-    height = img.shape[0] + border[0] * 2  # shape(h,w,c)
-    width = img.shape[1] + border[1] * 2
+def random_perspective_matrix(shape, degrees=[0., 0.], translate=0., scale=[0.5, 1.5], shear=[0., 0.],
+                              perspective=[0., 0.], border=(0, 0)):
+    # returns M, the random scale s and the output (height, width) for an input of shape
+    height = shape[0] + border[0] * 2  # shape(h,w,c)
+    width = shape[1] + border[1] * 2
 
     # Center
     C = np.eye(3)
-    C[0, 2] = -img.shape[1] / 2  # x translation (pixels)
-    C[1, 2] = -img.shape[0] / 2  # y translation (pixels)
+    C[0, 2] = -shape[1] / 2  # x translation (pixels)
+    C[1, 2] = -shape[0] / 2  # y translation (pixels)
 
     # Perspective
     P = np.eye(3)
@@ -847,27 +987,15 @@ def random_perspective(img, boxes, labels, degrees=[0., 0.], translate=0., scale
 
     # Combined rotation matrix
     M = T @ S @ R @ P @ C  # order of operations (right to left) is IMPORTANT
-    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
-        if any(perspective):
-            img = cv2.warpPerspective(img, M, dsize=(width, height), borderValue=fill)
-        else:  # affine
-            img = cv2.warpAffine(img, M[:2], dsize=(width, height), borderValue=fill)
+    return M, s, height, width
+
 
+def random_perspective_boxes(boxes, labels, M, s, height, width):
     # Transform label coordinates
     n = len(boxes)
     if n:
-        new = np.zeros((n, 4))
-        # warp boxes
-        xy = np.ones((n * 4, 3))
-        # xy[:, :2] = targets[:, [1, 2, 3, 4, 1, 4, 3, 2]].reshape(n * 4, 2)  # x1y1, x2y2, x1y2, x2y1
-        xy[:, :2] = boxes[:, [0, 1, 2, 3, 0, 3, 2, 1]].reshape(n * 4, 2)  # x1y1, x2y2, x1y2, x2y1
-        xy = xy @ M.T  # transform
-        xy = (xy[:, :2] / xy[:, 2:3] if any(perspective) else xy[:, :2]).reshape(n, 8)  # perspective rescale or affine
-
-        # create new boxes
-        x = xy[:, [0, 2, 4, 6]]
-        y = xy[:, [1, 3, 5, 7]]
-        new = np.concatenate((x.min(1), y.min(1), x.max(1), y.max(1))).reshape(4, n).T
+        # warp boxes, x1y1, x2y2, x1y2, x2y1 corners
+        new = warp_boxes(boxes.astype(np.float64), M)
 
         # clip
         new[:, [0, 2]] = new[:, [0, 2]].clip(0, width)
@@ -878,11 +1006,31 @@ def random_perspective(img, boxes, labels, degrees=[0., 0.], translate=0., scale
         # boxes = boxes[i]
         boxes = new[i]
         labels = labels[i]
+    return boxes, labels
+
+
+def random_perspective(img, boxes, labels, degrees=[0., 0.], translate=0., scale=[0.5, 1.5], shear=[0., 0.],
+                       perspective=[0., 0.], border=(0, 0), fill=[0, 0, 0]):
+    # im, targets = (), segments = (), degrees = 10, translate = .1, scale = .1, shear = 10, perspective = 0.0, border = (0, 0)
+    M, s, height, width = random_perspective_matrix(img.shape, degrees, translate, scale, shear, perspective, border)
+    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
+        if any(perspective):
+            img = cv2.warpPerspective(img, M, dsize=(width, height), borderValue=fill)
+        else:  # affine
+            img = cv2.warpAffine(img, M[:2], dsize=(width, height), borderValue=fill)
+    boxes, labels = random_perspective_boxes(boxes, labels, M, s, height, width)
     return img, boxes, labels
 
 
 class RandomAffineWithMosaic(object):
-    '''torchvision.transforms.RandomAffine(degrees=(-10, 10), translate=(.1, .1), scale=(.9, 1.1), shear=(-10, 10))'''
+    '''
+        torchvision.transforms.RandomAffine(degrees=(-10, 10), translate=(.1, .1), scale=(.9, 1.1), shear=(-10, 10))
+
+        The final affine is drawn before any pixel is copied. Each tile is then described by its
+        visible rectangle on the mosaic canvas and warped from its source image straight into the
+        output, so only the pixels that survive the affine are resampled, once. Rotation, shear or
+        perspective fall back to pasting the tiles into a canvas that is reused between calls.
+    '''
     def __init__(self, p=1.0, size=[640, 640], degrees=[0., 0.], translate=0., scale=[0.5, 1.5],
                  shear=[0., 0.], perspective=[0., 0.], fill=[0, 0, 0]):
         self.p = p
@@ -894,10 +1042,63 @@ class RandomAffineWithMosaic(object):
         self.perspective = perspective if isinstance(perspective, list) else (-perspective, perspective)
         self.border = (-self.size[0] // 2, -self.size[1] // 2)
         self.fill = fill
+        self._canvas = {}
+
+    def set_size(self, size):
+        self.size = [int(s) for s in size]
+        self.border = (-self.size[0] // 2, -self.size[1] // 2)
+
+    def _get_canvas(self, shape):
+        canvas = self._canvas.get(shape)
+        if canvas is None:
+            canvas = self._canvas[shape] = np.empty(shape, dtype=np.uint8)
+        canvas[...] = self.fill
+        return canvas
+
+    def _render(self, tiles, canvas_shape):
+        '''
+            tiles: (img, r, (x1, y1, x2, y2), (padw, padh)), canvas pixel = (img pixel + 0.5) * r - 0.5 + pad
+            as with cv2.resize, only the rectangle x1:x2, y1:y2 of the canvas is taken from img. Draws the
+            affine and returns (img, M, s, height, width).
+        '''
+        M, s, height, width = random_perspective_matrix(canvas_shape, self.degrees, self.translate, self.scale,
+                                                        self.shear, self.perspective, self.border)
+        c = canvas_shape[2]
+        if M[0, 1] != 0 or M[1, 0] != 0 or M[2, 0] != 0 or M[2, 1] != 0:
+            canvas = self._get_canvas(canvas_shape)
+            for img_t, r, (x1, y1, x2, y2), (padw, padh) in tiles:
+                if x2 <= x1 or y2 <= y1:
+                    continue
+                h, w = int(round(img_t.shape[0] * r)), int(round(img_t.shape[1] * r))
+                if (img_t.shape[0] != h) or (img_t.shape[1] != w):
+                    img_t = cv2.resize(img_t, (w, h), interpolation=cv2.INTER_LINEAR if r > 1 else cv2.INTER_AREA)
+                canvas[y1:y2, x1:x2] = img_t[y1 - padh:y2 - padh, x1 - padw:x2 - padw]
+            return warp(canvas, M, (height, width), cv2.INTER_LINEAR, self.fill), M, s, height, width
+
+        # axis aligned: output pixel u samples canvas x = (u - tx) / sx, a tile owns the pixels
+        # whose sample falls inside its rectangle
+        sx, sy, tx, ty = M[0, 0], M[1, 1], M[0, 2], M[1, 2]
+        img = np.empty((height, width, c), dtype=np.uint8)
+        img[...] = self.fill
+        for img_t, r, (x1, y1, x2, y2), (padw, padh) in tiles:
+            u0, u1 = (min(max(int(math.ceil(sx * (x - 0.5) + tx)), 0), width) for x in (x1, x2))
+            v0, v1 = (min(max(int(math.ceil(sy * (y - 0.5) + ty)), 0), height) for y in (y1, y2))
+            if u1 <= u0 or v1 <= v0:
+                continue
+            if r * min(sx, sy) < 0.5:
+                # bilinear alone would alias, shrink the source first
+                h, w = int(round(img_t.shape[0] * r)), int(round(img_t.shape[1] * r))
+                img_t = cv2.resize(img_t, (w, h), interpolation=cv2.INTER_AREA)
+                r = 1
+            A = translate_matrix(-u0, -v0) @ M @ translate_matrix(padw, padh) @ center_scale_matrix(r, r)
+            img[v0:v1, u0:u1] = cv2.warpAffine(img_t, A[:2], (u1 - u0, v1 - v0), flags=cv2.INTER_LINEAR,
+                                               borderMode=cv2.BORDER_REPLICATE).reshape(v1 - v0, u1 - u0, c)
+        return img, M, s, height, width
 
     def mosaic4(self, sample):
         labels4 = []
         boxes4 = []
+        tiles = []
         yc, xc = [int(random.uniform(x * 0.5, x * 1.5)) for x in self.size]
         for i, sp in enumerate(sample):
             img_t, target_t = sp['image'], sp['target']
@@ -906,15 +1107,10 @@ class RandomAffineWithMosaic(object):
 
             r = min(self.size[0] / h0, self.size[1] / w0)
             h, w = int(round(h0 * r)), int(round(w0 * r))
-            if (h0 != h) or (w0 != w):
-                img_t = cv2.resize(img_t, (w, h),
-                                   interpolation=cv2.INTER_LINEAR if r > 1 else cv2.INTER_AREA)
             boxes_t *= r
 
             # place img in img4
             if i == 0:  # top left
-                img4 = np.full((self.size[0] * 2, self.size[1] * 2, c), self.fill,
-                               dtype=np.uint8)  # base image with 4 tiles
                 x1a, y1a, x2a, y2a = max(xc - w, 0), max(yc - h, 0), xc, yc  # xmin, ymin, xmax, ymax (large image)
                 x1b, y1b, x2b, y2b = w - (x2a - x1a), h - (y2a - y1a), w, h  # xmin, ymin, xmax, ymax (small image)
             elif i == 1:  # top right
@@ -927,10 +1123,10 @@ class RandomAffineWithMosaic(object):
                 x1a, y1a, x2a, y2a = xc, yc, min(xc + w, self.size[1] * 2), min(self.size[0] * 2, yc + h)
                 x1b, y1b, x2b, y2b = 0, 0, min(w, x2a - x1a), min(y2a - y1a, h)
 
-            # image
-            img4[y1a:y2a, x1a:x2a] = img_t[y1b:y2b, x1b:x2b]  # img4[ymin:ymax, xmin:xmax]
+            # image, img4[y1a:y2a, x1a:x2a] = img_t[y1b:y2b, x1b:x2b]
             padw = x1a - x1b
             padh = y1a - y1b
+            tiles.append((img_t, r, (x1a, y1a, x2a, y2a), (padw, padh)))
 
             boxes_t[:, 0::2] += padw
             boxes_t[:, 1::2] += padh
@@ -946,8 +1142,8 @@ class RandomAffineWithMosaic(object):
         # clip when using random_perspective()
         boxes = clip_boxes_to_image(boxes, [s * 2 for s in self.size])
 
-        img, boxes, labels = random_perspective(img4, boxes, labels, self.degrees, self.translate, self.scale,
-                                                self.shear, self.perspective, self.border, self.fill)
+        img, M, s, height, width = self._render(tiles, (self.size[0] * 2, self.size[1] * 2, c))
+        boxes, labels = random_perspective_boxes(boxes, labels, M, s, height, width)
 
         target = {}
         target["boxes"] = boxes.astype(np.float32)
@@ -957,21 +1153,18 @@ class RandomAffineWithMosaic(object):
     def mosaic9(self, sample):
         labels9 = []
         boxes9 = []
+        tiles = []
         for i, sp in enumerate(sample):
             img_t, target_t = sp['image'], sp['target']
             boxes_t = target_t["boxes"]
             labels_t = target_t["labels"]
-            h0, w0, c = img_t.shape
+            h0, w0, ch = img_t.shape
 
             r = min(self.size[0] / h0, self.size[1] / w0)
             h, w = int(round(h0 * r)), int(round(w0 * r))
-            if (h0 != h) or (w0 != w):
-                img_t = cv2.resize(img_t, (w, h), interpolation=cv2.INTER_LINEAR if r > 1 else cv2.INTER_AREA)
             boxes_t *= r
 
             if i == 0:  # center
-                img9 = np.full((self.size[0] * 3, self.size[1] * 3, c), self.fill,
-                               dtype=np.uint8)  # base image with 4 tiles
                 h0, w0 = h, w
                 c = self.size[1], self.size[0], self.size[1] + w, self.size[
                     0] + h  # xmin, ymin, xmax, ymax (base) coordinates
@@ -1000,14 +1193,18 @@ class RandomAffineWithMosaic(object):
             boxes9.append(boxes_t)
             labels9.append(labels_t)
 
-            # Image
-            x1, y1, x2, y2 = (max(x, 0) for x in c)  # allocate coords
-            img9[y1:y2, x1:x2] = img_t[y1 - padh:, x1 - padw:]  # img9[ymin:ymax, xmin:xmax]
+            # Image, img9[y1:y2, x1:x2] = img_t[y1 - padh:, x1 - padw:] on a 3x canvas
+            x1, y1 = (max(x, 0) for x in c[:2])
+            x2, y2 = min(c[2], self.size[1] * 3), min(c[3], self.size[0] * 3)
+            tiles.append((img_t, r, (x1, y1, x2, y2), (padw, padh)))
             hp, wp = h, w  # height, width previous
 
         # Offset
         yc, xc = (int(random.uniform(0, ss)) for _, ss in zip(self.border, self.size))  # mosaic center x, y
-        img9 = img9[yc:yc + 2 * self.size[0], xc:xc + 2 * self.size[1]]
+        # img9 = img9[yc:yc + 2 * self.size[0], xc:xc + 2 * self.size[1]]
+        tiles = [(img_t, r, (min(max(x1 - xc, 0), self.size[1] * 2), min(max(y1 - yc, 0), self.size[0] * 2),
+                             min(max(x2 - xc, 0), self.size[1] * 2), min(max(y2 - yc, 0), self.size[0] * 2)),
+                  (padw - xc, padh - yc)) for img_t, r, (x1, y1, x2, y2), (padw, padh) in tiles]
 
         # Concat/clip labels
         boxes = np.concatenate(boxes9, 0)
@@ -1015,13 +1212,12 @@ class RandomAffineWithMosaic(object):
 
         boxes[:, [0, 2]] -= xc
         boxes[:, [1, 3]] -= yc
-        c = np.array([xc, yc])  # centers
 
         # clip when using random_perspective()
         boxes = clip_boxes_to_image(boxes, [s * 2 for s in self.size])
 
-        img, boxes, labels = random_perspective(img9, boxes, labels, self.degrees, self.translate, self.scale,
-                                                self.shear, self.perspective, self.border, self.fill)
+        img, M, s, height, width = self._render(tiles, (self.size[0] * 2, self.size[1] * 2, ch))
+        boxes, labels = random_perspective_boxes(boxes, labels, M, s, height, width)
 
         target = {}
         target["boxes"] = boxes.astype(np.float32)
@@ -1207,45 +1403,23 @@ class RandomAffine(object):
         self.border = border if isinstance(border, list) else (border, border)
         self.fill = fill
 
+    def _get_params(self, shape):
+        return random_perspective_matrix(shape, self.degrees, self.translate, self.scale, self.shear,
+                                         self.perspective, self.border)
+
+    def get_matrix(self, shape):
+        if random.random() < self.p:
+            M, _, height, width = self._get_params(shape)
+            return M, (height, width), {'filter_boxes': True}
+        return None
+
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
         if random.random() < self.p:
             boxes = target["boxes"]
             labels = target["labels"]
 
-            height = img.shape[0] + self.border[0] * 2  # shape(h,w,c)
-            width = img.shape[1] + self.border[1] * 2
-
-            # Center
-            C = np.eye(3)
-            C[0, 2] = -img.shape[1] / 2  # x translation (pixels)
-            C[1, 2] = -img.shape[0] / 2  # y translation (pixels)
-
-            # Perspective
-            P = np.eye(3)
-            P[2, 0] = random.uniform(self.perspective[0], self.perspective[1])  # x perspective (about y)
-            P[2, 1] = random.uniform(self.perspective[0], self.perspective[1])  # y perspective (about x)
-
-            # Rotation and Scale
-            R = np.eye(3)
-            a = random.uniform(self.degrees[0], self.degrees[1])
-            # a += random.choice([-180, -90, 0, 90])  # add 90deg rotations to small rotations
-            s = random.uniform(self.scale[0], self.scale[1])
-            # s = 2 ** random.uniform(-scale, scale)
-            R[:2] = cv2.getRotationMatrix2D(angle=a, center=(0, 0), scale=s)
-
-            # Shear
-            S = np.eye(3)
-            S[0, 1] = math.tan(random.uniform(self.shear[0], self.shear[1]) * math.pi / 180)  # x shear (deg)
-            S[1, 0] = math.tan(random.uniform(self.shear[0], self.shear[1]) * math.pi / 180)  # y shear (deg)
-
-            # Translation
-            T = np.eye(3)
-            T[0, 2] = random.uniform(0.5 - self.translate, 0.5 + self.translate) * width  # x translation (pixels)
-            T[1, 2] = random.uniform(0.5 - self.translate, 0.5 + self.translate) * height  # y translation (pixels)
-
-            # Combined rotation matrix
-            M = T @ S @ R @ P @ C  # order of operations (right to left) is IMPORTANT
+            M, s, height, width = self._get_params(img.shape)
             if (self.border[0] != 0) or (self.border[1] != 0) or (M != np.eye(3)).any():  # image changed
                 if any(self.perspective):
                     img = cv2.warpPerspective(img, M, dsize=(width, height), borderValue=self.fill)
@@ -1630,12 +1804,15 @@ class ConvertCocoPolysToMask(object):
             boxes = boxes[keep]
             labels = labels[keep]
 
+            src_scales = target.get("src_scales")
             target = {}
             target["image_id"] = torch.tensor([image_id])
             target["height"] = torch.tensor(h)
             target["width"] = torch.tensor(w)
             target["boxes"] = boxes
             target["labels"] = labels
+            if src_scales is not None:
+                target["src_scales"] = src_scales
             if self.use_mask:
                 segmentations = [obj["segmentation"] for obj in anno]
                 masks = convert_coco_poly_to_mask(segmentations, h, w)
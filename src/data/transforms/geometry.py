@@ -0,0 +1,146 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/20 15:10
+# @Author : liumin
+# @File : geometry.py
+
+import cv2
+import numpy as np
+
+"""
+    Fused geometric transforms.
+
+    Resize, flips, crops, rotations and affines each resample the whole image into a new buffer,
+    so a sample that passes through three of them is interpolated three times at full resolution.
+    A geometric transform can instead describe itself with get_matrix(shape), returning
+
+        (M, out_shape, meta)    M: 3x3 matrix from input to output pixel coordinates,
+                                out_shape: (h, w) of the output, meta: target keys to set
+        None                    the transform leaves this sample unchanged
+
+    drawing its random parameters exactly as __call__ would. Compose chains the matrices of
+    consecutive geometric transforms and warps the image, and its boxes, masks and keypoints,
+    once into the final output size.
+
+    M maps pixel indices, as cv2.warpAffine reads it. A resize maps pixel centers, (i + 0.5) * s - 0.5
+    like cv2.resize (center_scale_matrix), while the boxes of the unfused transforms scale as continuous
+    coordinates, x * s. Such a transform puts the matrix for its boxes and keypoints in meta under
+    'box_matrix', and plan_geometry chains those separately.
+"""
+
+
+def translate_matrix(tx, ty):
+    M = np.eye(3)
+    M[0, 2], M[1, 2] = tx, ty
+    return M
+
+
+def scale_matrix(sx, sy):
+    return np.diag([sx, sy, 1.0])
+
+
+def center_scale_matrix(sx, sy):
+    # pixel centers stay aligned, (i + 0.5) * s - 0.5, like cv2.resize
+    return translate_matrix(-0.5, -0.5) @ scale_matrix(sx, sy) @ translate_matrix(0.5, 0.5)
+
+
+def flip_matrix(shape, horizontal=True, vertical=False):
+    # pixel index i goes to (size - 1 - i), like cv2.flip
+    h, w = shape[:2]
+    M = np.eye(3)
+    if horizontal:
+        M[0, 0], M[0, 2] = -1, w - 1
+    if vertical:
+        M[1, 1], M[1, 2] = -1, h - 1
+    return M
+
+
+def is_geometric(t):
+    return callable(getattr(t, 'get_matrix', None))
+
+
+def group_geometric(transforms, min_run=2):
+    '''
+        Splits transforms into single transforms and lists of at least min_run consecutive
+        geometric transforms, in order.
+    '''
+    groups, run = [], []
+    for t in list(transforms) + [None]:
+        if t is not None and is_geometric(t):
+            run.append(t)
+            continue
+        if len(run) >= min_run:
+            groups.append(run)
+        else:
+            groups.extend(run)
+        run = []
+        if t is not None:
+            groups.append(t)
+    return groups
+
+
+def plan_geometry(transforms, shape):
+    '''
+        Composes the matrices of transforms for an input of shape. Returns (M, out_shape, metas, B),
+        B is the matrix for boxes and keypoints; M and B are None when every transform left the
+        sample unchanged.
+    '''
+    M, B, out_shape, metas = None, None, tuple(shape[:2]), []
+    for t in transforms:
+        plan = t.get_matrix(out_shape)
+        if plan is None:
+            continue
+        m, out_shape, meta = plan
+        b = m
+        if meta and 'box_matrix' in meta:
+            meta = dict(meta)
+            b = meta.pop('box_matrix')
+        M = m if M is None else m @ M
+        B = b if B is None else b @ B
+        out_shape = tuple(int(s) for s in out_shape)
+        if meta:
+            metas.append(meta)
+    return M, out_shape, metas, B
+
+
+def is_perspective(M):
+    return M[2, 0] != 0 or M[2, 1] != 0
+
+
+def warp(img, M, out_shape, interpolation=cv2.INTER_LINEAR, fill=0):
+    h, w = out_shape
+    if np.array_equal(M, np.eye(3)) and img.shape[:2] == (h, w):
+        return img
+    if not isinstance(fill, (int, float)):
+        fill = tuple(fill)
+    if img.ndim == 3 and img.shape[2] > 4:
+        # cv2 warps at most 4 channels at once
+        return np.concatenate([warp(img[..., i:i + 4], M, out_shape, interpolation, fill).reshape(h, w, -1)
+                               for i in range(0, img.shape[2], 4)], axis=2)
+    if is_perspective(M):
+        return cv2.warpPerspective(img, M, (w, h), flags=interpolation, borderValue=fill)
+    return cv2.warpAffine(img, M[:2], (w, h), flags=interpolation, borderValue=fill)
+
+
+def warp_points(xy, M):
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    xy = np.concatenate([xy, np.ones((len(xy), 1))], axis=1) @ M.T
+    return xy[:, :2] / xy[:, 2:3] if is_perspective(M) else xy[:, :2]
+
+
+def warp_boxes(boxes, M):
+    '''
+        xyxy boxes through M: the bounding box of the four warped corners.
+    '''
+    n = len(boxes)
+    if not n:
+        return boxes
+    xy = warp_points(boxes[:, [0, 1, 2, 3, 0, 3, 2, 1]].reshape(n * 4, 2), M).reshape(n, 8)
+    x = xy[:, [0, 2, 4, 6]]
+    y = xy[:, [1, 3, 5, 7]]
+    return np.stack((x.min(1), y.min(1), x.max(1), y.max(1)), axis=1).astype(boxes.dtype)
+
+
+def linear_scale(M):
+    # area scale of the linear part, for box filtering after arbitrary affines
+    return float(np.sqrt(abs(np.linalg.det(M[:2, :2]))))
@@ -24,21 +24,30 @@ __all__ = ['RandomHorizontalFlip',
 class Compose(object):
     def __init__(self, transforms):
         self.transforms = transforms
+        # per-stage timing with PROFILE, see src/data/profiling.py
+        self.profiler = None
 
     def __call__(self, sample):
-        for t in self.transforms:
-            sample = t(sample)
+        if self.profiler is not None:
+            sample = self.profiler.run(self, self.transforms, sample)
+        else:
+            for t in self.transforms:
+                sample = t(sample)
         return sample
 
 
 class ToTensor(object):
     """Convert ndarrays in sample to Tensors."""
+    def __init__(self, uint8=False):
+        self.uint8 = uint8  # H x W x C uint8 image, see det_transforms.ToTensor
 
     def __call__(self, sample):
         # swap color axis because
         # numpy image: H x W x C
         # torch image: C X H X W
         img, target = sample['image'], sample['target']
+        if self.uint8:
+            return {'image': torch.from_numpy(np.ascontiguousarray(img, dtype=np.uint8)), 'target': target}
         img = F.to_tensor(img)
         return {'image': img, 'target': target}
 
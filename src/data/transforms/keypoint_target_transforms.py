@@ -15,8 +15,12 @@ import torch
 class Compose(object):
     def __init__(self, transforms):
         self.transforms = transforms
+        # per-stage timing with PROFILE, see src/data/profiling.py
+        self.profiler = None
 
     def __call__(self, sample):
+        if self.profiler is not None:
+            return self.profiler.run(self, self.transforms, sample)
         for t in self.transforms:
             sample = t(sample)
         return sample
@@ -114,97 +118,99 @@ def add_neck(keypoint):
     return keypoint
 
 
-def putGaussianMaps(center, accumulate_confid_map, sigma, grid_y, grid_x, stride):
-    """Implement the generate of every channel of ground truth heatmap.
-    :param centerA: int with shape (2,), every coordinate of person's keypoint.
-    :param accumulate_confid_map: one channel of heatmap, which is accumulated,
-           np.log(100) is the max value of heatmap.
-    :param params_transform: store the value of stride and crop_szie_y, crop_size_x
+# a gaussian is cut off where exp(-d2 / 2 / sigma^2) < 0.01
+GAUSSIAN_THRE = 4.6052
+
+
+def put_gaussian_maps(heatmaps, keypoints, sigma, stride):
+    """Accumulates the gaussians of all visible joints into heatmaps.
+    :param heatmaps: grid_y x grid_x x C, channel k collects joint k of every person.
+    :param keypoints: P x K x 3 joints (x, y, v) in input pixels, K < C.
+    Every gaussian is only evaluated on the grid cells around its joint that can pass the cut off,
+    all joints in one broadcast; values above 1 are clipped.
     """
+    grid_y, grid_x, channels = heatmaps.shape
+    person, part = np.nonzero(keypoints[:, :, 2] > 0.5)
+    if not len(part):
+        return heatmaps
     start = stride / 2.0 - 0.5
-    y_range = [i for i in range(int(grid_y))]
-    x_range = [i for i in range(int(grid_x))]
-    xx, yy = np.meshgrid(x_range, y_range)
-    xx = xx * stride + start
-    yy = yy * stride + start
-    d2 = (xx - center[0]) ** 2 + (yy - center[1]) ** 2
+    centers = keypoints[person, part, :2].astype(float)  # J x 2
+
+    # cells within the cut off radius, plus one for rounding
+    radius = int(np.ceil(sigma * np.sqrt(2 * GAUSSIAN_THRE) / stride)) + 1
+    offsets = np.arange(-radius, radius + 1)
+    cells = np.floor((centers - start) / stride).astype(int)
+    xs = cells[:, 0:1] + offsets  # J x W
+    ys = cells[:, 1:2] + offsets
+    d2 = ((xs * stride + start - centers[:, 0:1]) ** 2)[:, None, :] + \
+         ((ys * stride + start - centers[:, 1:2]) ** 2)[:, :, None]  # J x W x W
     exponent = d2 / 2.0 / sigma / sigma
-    mask = exponent <= 4.6052
-    cofid_map = np.exp(-exponent)
-    cofid_map = np.multiply(mask, cofid_map)
-    accumulate_confid_map += cofid_map
-    accumulate_confid_map[accumulate_confid_map > 1.0] = 1.0
-
-    return accumulate_confid_map
-
-
-def putVecMaps(centerA, centerB, accumulate_vec_map, count, grid_y, grid_x, stride):
-    """Implement Part Affinity Fields
-    :param centerA: int with shape (2,), centerA will pointed by centerB.
-    :param centerB: int with shape (2,), centerB will point to centerA.
-    :param accumulate_vec_map: one channel of paf.
-    :param count: store how many pafs overlaped in one coordinate of accumulate_vec_map.
-    :param params_transform: store the value of stride and crop_szie_y, crop_size_x
+    mask = (exponent <= GAUSSIAN_THRE) & ((xs >= 0) & (xs < grid_x))[:, None, :] & ((ys >= 0) & (ys < grid_y))[:, :, None]
+
+    # nonzero is ordered by joint, so every cell sums its persons in order
+    j, y, x = np.nonzero(mask)
+    index = (ys[j, y] * grid_x + xs[j, x]) * channels + part[j]
+    heatmaps += np.bincount(index, weights=np.exp(-exponent[j, y, x]),
+                            minlength=heatmaps.size).reshape(heatmaps.shape)
+    np.minimum(heatmaps[:, :, :keypoints.shape[1]], 1.0, out=heatmaps[:, :, :keypoints.shape[1]])
+    return heatmaps
+
+
+def put_vec_maps(pafs, keypoints, limbs, stride, thre=1):
+    """Part Affinity Fields of all limbs of all persons.
+    :param pafs: grid_y x grid_x x 2L, channels 2i, 2i + 1 hold the (x, y) field of limb i.
+    :param keypoints: P x K x 3 joints (x, y, v) in input pixels.
+    :param limbs: L pairs (a, b), the field points from joint a to joint b.
+    :param thre: limb width in grid cells.
+    Every limb instance is evaluated on its bounding window of the grid, padded to a common size so
+    all instances run in one broadcast. Cells covered by several instances get their mean vector.
     """
-    centerA = centerA.astype(float)
-    centerB = centerB.astype(float)
-
-    thre = 1  # limb width
-    centerB = centerB / stride
-    centerA = centerA / stride
-
+    grid_y, grid_x = pafs.shape[:2]
+    limbs = np.asarray(limbs)
+    num_limbs = len(limbs)
+    ka, kb = keypoints[:, limbs[:, 0]], keypoints[:, limbs[:, 1]]  # P x L x 3
+    person, limb = np.nonzero((ka[..., 2] > 0.5) & (kb[..., 2] > 0.5))
+    centerA = ka[person, limb, :2].astype(float) / stride
+    centerB = kb[person, limb, :2].astype(float) / stride
     limb_vec = centerB - centerA
-    norm = np.linalg.norm(limb_vec)
-    if (norm == 0.0):
-        # print 'limb is too short, ignore it...'
-        return accumulate_vec_map, count
-    limb_vec_unit = limb_vec / norm
-    # print 'limb unit vector: {}'.format(limb_vec_unit)
+    norm = np.linalg.norm(limb_vec, axis=1)
+    keep = norm != 0.0  # limb is too short, ignore it
+    if not keep.any():
+        return pafs
+    limb, centerA, centerB = limb[keep], centerA[keep], centerB[keep]
+    limb_vec_unit = limb_vec[keep] / norm[keep, None]
 
     # To make sure not beyond the border of this two points
-    min_x = max(int(round(min(centerA[0], centerB[0]) - thre)), 0)
-    max_x = min(int(round(max(centerA[0], centerB[0]) + thre)), grid_x)
-    min_y = max(int(round(min(centerA[1], centerB[1]) - thre)), 0)
-    max_y = min(int(round(max(centerA[1], centerB[1]) + thre)), grid_y)
-
-    range_x = list(range(int(min_x), int(max_x), 1))
-    range_y = list(range(int(min_y), int(max_y), 1))
-    xx, yy = np.meshgrid(range_x, range_y)
-    ba_x = xx - centerA[0]  # the vector from (x,y) to centerA
-    ba_y = yy - centerA[1]
-    limb_width = np.abs(ba_x * limb_vec_unit[1] - ba_y * limb_vec_unit[0])
-    mask = limb_width < thre  # mask is 2D
-
-    vec_map = np.copy(accumulate_vec_map) * 0.0
-
-    vec_map[yy, xx] = np.repeat(mask[:, :, np.newaxis], 2, axis=2)
-    vec_map[yy, xx] *= limb_vec_unit[np.newaxis, np.newaxis, :]
-
-    mask = np.logical_or.reduce(
-        (np.abs(vec_map[:, :, 0]) > 0, np.abs(vec_map[:, :, 1]) > 0))
-
-    accumulate_vec_map = np.multiply(
-        accumulate_vec_map, count[:, :, np.newaxis])
-    accumulate_vec_map += vec_map
-    count[mask == True] += 1
-
-    mask = count == 0
-
-    count[mask == True] = 1
-
-    accumulate_vec_map = np.divide(accumulate_vec_map, count[:, :, np.newaxis])
-    count[mask == True] = 0
-    return accumulate_vec_map, count
+    lo = np.maximum(np.round(np.minimum(centerA, centerB) - thre).astype(int), 0)  # I x (x, y)
+    hi = np.minimum(np.round(np.maximum(centerA, centerB) + thre).astype(int), [grid_x, grid_y])
+    size = np.maximum(hi - lo, 0)
+    xs = lo[:, 0:1] + np.arange(size[:, 0].max())  # I x Wx
+    ys = lo[:, 1:2] + np.arange(size[:, 1].max())  # I x Wy
+    ba_x = xs - centerA[:, 0:1]  # the vector from (x,y) to centerA
+    ba_y = ys - centerA[:, 1:2]
+    limb_width = np.abs(ba_x[:, None, :] * limb_vec_unit[:, 1, None, None] - ba_y[:, :, None] * limb_vec_unit[:, 0, None, None])
+    mask = (limb_width < thre) & (xs < hi[:, 0:1])[:, None, :] & (ys < hi[:, 1:2])[:, :, None]
+
+    i, y, x = np.nonzero(mask)
+    index = (ys[i, y] * grid_x + xs[i, x]) * num_limbs + limb[i]
+    length = grid_y * grid_x * num_limbs
+    count = np.maximum(np.bincount(index, minlength=length), 1)
+    for c in range(2):
+        vec = np.bincount(index, weights=limb_vec_unit[i, c], minlength=length) / count
+        pafs[:, :, c::2] += vec.reshape(grid_y, grid_x, num_limbs)
+    return pafs
+
+
+def prepare_keypoints(anns, input_x, input_y):
+    """P x 17 x 3 COCO keypoints to P x 18 x 3 in the order of get_keypoints(), with the neck added
+    and joints outside of the input marked invisible."""
+    keypoints = [add_neck(single_keypoints) for single_keypoints in anns]
+    keypoints = np.array(keypoints).reshape(-1, len(get_keypoints()), 3)
+    return remove_illegal_joint(keypoints, input_x, input_y)
 
 
 def get_openpose_ground_truth(anns, input_x, input_y, stride):
-    keypoints = []
-    for single_keypoints in anns:
-        # single_keypoints = np.array(ann['keypoints']).reshape(17, 3)
-        single_keypoints = add_neck(single_keypoints)
-        keypoints.append(single_keypoints)
-    keypoints = np.array(keypoints)
-    keypoints = remove_illegal_joint(keypoints, input_x, input_y)
+    keypoints = prepare_keypoints(anns, input_x, input_y)
 
     grid_y = int(input_y / stride)
     grid_x = int(input_x / stride)
@@ -219,42 +225,95 @@ def get_openpose_ground_truth(anns, input_x, input_y, stride):
     pafs = np.zeros((int(grid_y), int(grid_x), channels_paf))
 
     # confidance maps for body parts
-    for i in range(HEATMAP_COUNT):
-        joints = [jo[i] for jo in keypoints]
-        for joint in joints:
-            if joint[2] > 0.5:
-                center = joint[:2]
-                gaussian_map = heatmaps[:, :, i]
-                heatmaps[:, :, i] = putGaussianMaps(center, gaussian_map, 7.0, grid_y, grid_x, stride)
+    put_gaussian_maps(heatmaps, keypoints, 7.0, stride)
 
     # pafs
-    for i, (k1, k2) in enumerate(LIMB_IDS):
-        # limb
-        count = np.zeros((int(grid_y), int(grid_x)), dtype=np.uint32)
-        for joint in keypoints:
-            if joint[k1, 2] > 0.5 and joint[k2, 2] > 0.5:
-                centerA = joint[k1, :2]
-                centerB = joint[k2, :2]
-                vec_map = pafs[:, :, 2 * i:2 * (i + 1)]
-
-                pafs[:, :, 2 * i:2 * (i + 1)], count = putVecMaps(
-                    centerA=centerA, centerB=centerB, accumulate_vec_map=vec_map,
-                    count=count, grid_y=grid_y, grid_x=grid_x, stride=stride)
+    put_vec_maps(pafs, keypoints, LIMB_IDS, stride)
 
     # background
     heatmaps[:, :, -1] = np.maximum(1 - np.max(heatmaps[:, :, :HEATMAP_COUNT], axis=2), 0.)
     return heatmaps, pafs  # [46, 46, 38], [46, 46, 38]
 
 
+def get_openpose_ground_truth_on_device(keypoints, grid_y, grid_x, stride, sigma=7.0, thre=1):
+    """get_openpose_ground_truth for a batch on the device of keypoints.
+    :param keypoints: list of P x 18 x 3 tensors from prepare_keypoints().
+    :return: heatmaps B x 19 x grid_y x grid_x, pafs B x 38 x grid_y x grid_x, both float32.
+    Evaluated densely over the grid, the result matches the numpy version up to float32 rounding.
+    """
+    KEYPOINTS = get_keypoints()
+    HEATMAP_COUNT = len(KEYPOINTS)
+    limbs = torch.tensor(kp_connections(KEYPOINTS))
+    num_limbs = len(limbs)
+    device = keypoints[0].device if len(keypoints) else torch.device('cpu')
+    limbs = limbs.to(device)
+
+    start = stride / 2.0 - 0.5
+    cell_x = torch.arange(grid_x, device=device, dtype=torch.float32)
+    cell_y = torch.arange(grid_y, device=device, dtype=torch.float32)
+    heatmaps = torch.zeros(len(keypoints), HEATMAP_COUNT + 1, grid_y, grid_x, device=device)
+    pafs = torch.zeros(len(keypoints), 2 * num_limbs, grid_y, grid_x, device=device)
+    for b, kps in enumerate(keypoints):
+        if not len(kps):
+            heatmaps[b, -1] = 1.
+            continue
+        kps = kps.float()
+
+        # heatmaps, every joint over the whole grid
+        joints = kps.reshape(-1, 3)
+        part = torch.arange(HEATMAP_COUNT, device=device).repeat(len(kps))
+        d2 = (cell_x * stride + start - joints[:, 0:1]).pow(2)[:, None, :] + \
+             (cell_y * stride + start - joints[:, 1:2]).pow(2)[:, :, None]
+        exponent = d2 / 2.0 / sigma / sigma
+        gaussian = torch.exp(-exponent) * ((exponent <= GAUSSIAN_THRE) & (joints[:, 2:3, None] > 0.5))
+        heatmaps[b, :HEATMAP_COUNT].index_add_(0, part, gaussian).clamp_(max=1.0)
+
+        # pafs, every limb instance over the whole grid
+        ka, kb = kps[:, limbs[:, 0]].reshape(-1, 3), kps[:, limbs[:, 1]].reshape(-1, 3)
+        limb = torch.arange(num_limbs, device=device).repeat(len(kps))
+        centerA, centerB = ka[:, :2] / stride, kb[:, :2] / stride
+        limb_vec = centerB - centerA
+        norm = limb_vec.norm(dim=1, keepdim=True)
+        valid = (ka[:, 2] > 0.5) & (kb[:, 2] > 0.5) & (norm[:, 0] != 0)
+        limb_vec_unit = limb_vec / norm.clamp(min=1e-12)
+        lo = torch.round(torch.min(centerA, centerB) - thre)
+        hi = torch.round(torch.max(centerA, centerB) + thre)
+        ba_x = cell_x - centerA[:, 0:1]
+        ba_y = cell_y - centerA[:, 1:2]
+        limb_width = (ba_x[:, None, :] * limb_vec_unit[:, 1, None, None] - ba_y[:, :, None] * limb_vec_unit[:, 0, None, None]).abs()
+        mask = (limb_width < thre) & valid[:, None, None] & \
+               ((cell_x >= lo[:, 0:1]) & (cell_x < hi[:, 0:1]))[:, None, :] & \
+               ((cell_y >= lo[:, 1:2]) & (cell_y < hi[:, 1:2]))[:, :, None]
+        mask = mask.float()
+        count = torch.zeros(num_limbs, grid_y, grid_x, device=device).index_add_(0, limb, mask).clamp_(min=1)
+        for c in range(2):
+            vec = torch.zeros(num_limbs, grid_y, grid_x, device=device)
+            vec.index_add_(0, limb, mask * limb_vec_unit[:, c, None, None])
+            pafs[b, c::2] = vec / count
+
+        # background
+        heatmaps[b, -1] = (1 - heatmaps[b, :HEATMAP_COUNT].max(0)[0]).clamp(min=0.)
+    return heatmaps, pafs
+
+
 class OpenPoseTargetTransform(object):
-    def __init__(self, input_x=368, input_y=368, stride=8):
+    '''
+        With on_device, only the keypoints are prepared here and OpenPose.forward generates the
+        heatmaps and pafs for the whole batch on the GPU.
+    '''
+    def __init__(self, input_x=368, input_y=368, stride=8, on_device=False):
         super(OpenPoseTargetTransform, self).__init__()
         self.input_x = input_x
         self.input_y = input_y
         self.stride = stride
+        self.on_device = on_device
 
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
+        if self.on_device:
+            keypoints = prepare_keypoints(target["keypoints"], self.input_x, self.input_y)
+            target["keypoints"] = torch.from_numpy(keypoints.astype(np.float32))
+            return {'image': img, 'target': target}
 
         heatmaps, pafs = get_openpose_ground_truth(target["keypoints"], self.input_x, self.input_y, self.stride)
         # torch.from_numpy(target["keypoints"])
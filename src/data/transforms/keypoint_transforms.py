@@ -61,22 +61,31 @@ def clip_boxes_to_image(boxes, size):
 class Compose(object):
     def __init__(self, transforms):
         self.transforms = transforms
+        # per-stage timing with PROFILE, see src/data/profiling.py
+        self.profiler = None
 
     def __call__(self, sample):
-        for t in self.transforms:
-            sample = t(sample)
+        if self.profiler is not None:
+            sample = self.profiler.run(self, self.transforms, sample)
+        else:
+            for t in self.transforms:
+                sample = t(sample)
         return sample
 
 
 class ToTensor(object):
-    def __init__(self, normalize=True, target_type='uint8'):
+    def __init__(self, normalize=True, target_type='uint8', uint8=False):
         self.normalize = normalize
         self.target_type = target_type
+        self.uint8 = uint8  # H x W x C uint8 RGB image, see det_transforms.ToTensor
 
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
-        img = img.transpose((2, 0, 1))[::-1] # HWC to CHW, BGR to RGB
-        img = np.ascontiguousarray(img)
+        if self.uint8:
+            img = np.ascontiguousarray(img[..., ::-1])  # BGR to RGB
+        else:
+            img = img.transpose((2, 0, 1))[::-1] # HWC to CHW, BGR to RGB
+            img = np.ascontiguousarray(img)
 
         if target.__contains__("boxes"):
             target["boxes"] = torch.from_numpy(target["boxes"])
@@ -87,6 +96,8 @@ class ToTensor(object):
             target["masks"] = torch.from_numpy(mask)
         # if target.__contains__("keypoints"):
         #     target["keypoints"] = torch.from_numpy(target["keypoints"])
+        if self.uint8:
+            return {'image': torch.from_numpy(img), 'target': target}
         if self.normalize:
             return {'image': torch.from_numpy(img.astype(np.float32)).div_(255.0), 'target': target}
         else:
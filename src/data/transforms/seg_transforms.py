@@ -20,6 +20,9 @@ from torchvision import transforms as T
 from torchvision.transforms import functional as TF
 from PIL import Image, ImageOps, ImageEnhance
 
+from src.data.transforms.geometry import translate_matrix, center_scale_matrix, flip_matrix, group_geometric, \
+    plan_geometry, warp
+
 __all__ = ['Compose', 'ToTensor', 'Normalize',
            'RandomHorizontalFlip', 'RandomVerticalFlip', 'RandomDiagonalFlip',
            'Resize', 'RandomScaleResize', 'RandomScaleCrop',
@@ -43,6 +46,28 @@ def pad_img_and_target(img, target, size, fill, ignore_label, borderType=cv2.BOR
     return img, target
 
 
+def pad_matrix(shape, size):
+    # matrix and output shape of pad_img_and_target
+    h, w = shape[:2]
+    if h < size[0] or w < size[1]:
+        padh, padw = max(size[0] - h, 0) / 2, max(size[1] - w, 0) / 2
+        top, bottom = int(round(padh - 0.1)), int(round(padh + 0.1))
+        left, right = int(round(padw - 0.1)), int(round(padw + 0.1))
+        return translate_matrix(left, top), (h + top + bottom, w + left + right)
+    return np.eye(3), (h, w)
+
+
+def resize_matrix(shape, size, keep_ratio=True):
+    # matrix and output shape of resize_img_and_target
+    h, w = shape[:2]
+    if keep_ratio:
+        ratio = min(size[0] / h, size[1] / w)
+        oh, ow = int(round(h * ratio)), int(round(w * ratio))
+    else:
+        oh, ow = size
+    return center_scale_matrix(ow / w, oh / h), (oh, ow)
+
+
 def resize_img_and_target(img, target, size, keep_ratio=True,
                           interpolation_img=cv2.INTER_LINEAR, interpolation_target=cv2.INTER_NEAREST):
     h, w = img.shape[:2]
@@ -76,23 +101,65 @@ class Compose(object):
 
     def __init__(self, transforms):
         self.transforms = transforms
+        # per-stage timing with PROFILE, see src/data/profiling.py
+        self.profiler = None
+        # consecutive geometric transforms (get_matrix) resample the image only once
+        self.stages = [GeometricChain(t) if isinstance(t, list) else t for t in group_geometric(transforms)]
+
+    def set_size(self, size):
+        '''
+            Output size (h, w) of the transforms with a fixed output size, see MultiScaleBatchSampler.
+        '''
+        for t in self.transforms:
+            if hasattr(t, 'set_size'):
+                t.set_size(size)
 
     def __call__(self, sample):
-        for t in self.transforms:
-            sample = t(sample)
+        if self.profiler is not None:
+            sample = self.profiler.run(self, self.stages, sample)
+        else:
+            for t in self.stages:
+                sample = t(sample)
         return sample
 
 
+class GeometricChain(object):
+    """Consecutive geometric transforms applied as a single warp, see geometry.py.
+    The image is interpolated linearly, the label with nearest neighbour; pixels
+    outside the source get the fill and ignore_label of the last transform.
+    """
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+        self.fill = next((t.fill for t in reversed(transforms) if hasattr(t, 'fill')), 0)
+        self.ignore_label = next((t.ignore_label for t in reversed(transforms) if hasattr(t, 'ignore_label')), 255)
+
+    def __call__(self, sample):
+        img, target = sample['image'], sample.get('target')
+        if not isinstance(img, np.ndarray) or not isinstance(target, np.ndarray):
+            for t in self.transforms:
+                sample = t(sample)
+            return sample
+
+        M, out_shape, _, _ = plan_geometry(self.transforms, img.shape)
+        if M is None:
+            return sample
+        img = warp(img, M, out_shape, cv2.INTER_LINEAR, self.fill)
+        target = warp(target, M, out_shape, cv2.INTER_NEAREST, self.ignore_label)
+        return {'image': img, 'target': target}
+
+
 class ToTensor(object):
     """Convert a ``PIL Image`` or ``numpy.ndarray`` to tensor.
     Converts a PIL Image or numpy.ndarray (H x W x C) in the range
     [0, 255] to a torch.FloatTensor of shape (C x H x W) in the range [0.0, 1.0].
     """
 
-    def __init__(self, normalize=True, to_rgb=False, target_type='uint8'):
+    def __init__(self, normalize=True, to_rgb=False, target_type='uint8', uint8=False):
         self.normalize = normalize
         self.to_rgb = to_rgb
         self.target_type = target_type
+        self.uint8 = uint8  # H x W x C uint8 image, see det_transforms.ToTensor
 
     def __call__(self, sample):
         """
@@ -104,6 +171,10 @@ class ToTensor(object):
             Tensor: Converted image and label
         """
         img, target = sample['image'], sample['target']
+        if self.uint8:
+            img = np.ascontiguousarray(img[..., ::-1] if self.to_rgb else img)
+            return {'image': torch.from_numpy(img),
+                    'target': torch.from_numpy(target.astype(self.target_type))}
         if self.to_rgb:
             # img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # inplace
             img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
@@ -165,6 +236,11 @@ class RandomHorizontalFlip(object):
             return {'image': np.flip(img, 1), 'target': np.flip(target, 1)}
         return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        if random.random() < self.p:
+            return flip_matrix(shape, horizontal=True), shape, None
+        return None
+
     def __repr__(self):
         return self.__class__.__name__ + '(p={})'.format(self.p)
 
@@ -192,6 +268,11 @@ class RandomVerticalFlip(object):
             return {'image': np.flip(img, 0), 'target': np.flip(target, 0)}
         return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        if random.random() < self.p:
+            return flip_matrix(shape, horizontal=False, vertical=True), shape, None
+        return None
+
     def __repr__(self):
         return self.__class__.__name__ + '(p={})'.format(self.p)
 
@@ -218,6 +299,11 @@ class RandomDiagonalFlip(object):
         if random.random() < self.p:
             return {'image': np.flip(img, (0, 1)), 'target': np.flip(target, (0, 1))}
         return {'image': img, 'target': target}
+
+    def get_matrix(self, shape):
+        if random.random() < self.p:
+            return flip_matrix(shape, horizontal=True, vertical=True), shape, None
+        return None
     def __repr__(self):
         return self.__class__.__name__ + '(p={})'.format(self.p)
 
@@ -242,10 +328,14 @@ class RandomScaleCrop(object):
         self.fill = fill
         self.ignore_label = ignore_label
 
-    def get_crop_bbox(self, img, crop_size):
+    def set_size(self, size):
+        if self.size is not None:
+            self.size = tuple(int(s) for s in size)
+
+    def get_crop_bbox(self, shape, crop_size):
         """Randomly get a crop bounding box."""
-        margin_h = max(img.shape[0] - crop_size[0], 0)
-        margin_w = max(img.shape[1] - crop_size[1], 0)
+        margin_h = max(shape[0] - crop_size[0], 0)
+        margin_w = max(shape[1] - crop_size[1], 0)
         offset_h = np.random.randint(0, margin_h + 1)
         offset_w = np.random.randint(0, margin_w + 1)
         crop_y1, crop_y2 = offset_h, offset_h + crop_size[0]
@@ -279,7 +369,7 @@ class RandomScaleCrop(object):
         img, target = resize_img_and_target(img, target, new_size, self.keep_ratio)
 
         # crop
-        crop_bbox = self.get_crop_bbox(img, self.size)
+        crop_bbox = self.get_crop_bbox(img.shape, self.size)
         # crop the image
         img = self.crop(img, crop_bbox)
         target = self.crop(target, crop_bbox)
@@ -289,6 +379,24 @@ class RandomScaleCrop(object):
 
         return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        h, w = shape[:2]
+        if self.scale is not None:
+            scale = random.uniform(self.scale[0], self.scale[1])
+            new_size = int(round(h * scale)), int(round(w * scale))
+        else:
+            new_size = self.size
+        M, (oh, ow) = resize_matrix(shape, new_size, self.keep_ratio)
+
+        crop_y1, crop_y2, crop_x1, crop_x2 = self.get_crop_bbox((oh, ow), self.size)
+        M = translate_matrix(-crop_x1, -crop_y1) @ M
+        out_shape = min(crop_y2, oh) - crop_y1, min(crop_x2, ow) - crop_x1
+
+        if self.pad_if_needed:
+            P, out_shape = pad_matrix(out_shape, self.size)
+            M = P @ M
+        return M, out_shape, None
+
 
 class RandomScaleResize(object):
     """Resize the input PIL Image to the given size.
@@ -310,6 +418,10 @@ class RandomScaleResize(object):
         self.fill = fill
         self.ignore_label = ignore_label
 
+    def set_size(self, size):
+        if self.size is not None:
+            self.size = tuple(int(s) for s in size)
+
     def __call__(self, sample):
         """
         Args:
@@ -337,6 +449,23 @@ class RandomScaleResize(object):
 
         return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        h, w = shape[:2]
+        if self.scale is not None:
+            scale = random.uniform(self.scale[0], self.scale[1])
+            if self.size is None:
+                new_size = int(round(h * scale)), int(round(w * scale))
+            else:
+                new_size = int(round(self.size[0] * scale)), int(round(self.size[1] * scale))
+        else:
+            new_size = self.size
+        M, out_shape = resize_matrix(shape, new_size, self.keep_ratio)
+
+        if self.keep_ratio and self.pad_if_needed:
+            P, out_shape = pad_matrix(out_shape, self.size)
+            M = P @ M
+        return M, out_shape, None
+
 
 class Resize(object):
     """Resize the input img to the given size."""
@@ -349,6 +478,9 @@ class Resize(object):
         self.fill = fill
         self.ignore_label = ignore_label
 
+    def set_size(self, size):
+        self.size = tuple(int(s) for s in size)
+
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
         h, w, _ = img.shape
@@ -360,6 +492,13 @@ class Resize(object):
 
         return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        M, out_shape = resize_matrix(shape, self.size, self.keep_ratio)
+        if self.keep_ratio and self.pad_if_needed:
+            P, out_shape = pad_matrix(out_shape, self.size)
+            M = P @ M
+        return M, out_shape, None
+
 
 class RandomCrop(object):
     """Crop the given PIL Image at a random location.
@@ -384,10 +523,13 @@ class RandomCrop(object):
         self.fill = fill
         self.ignore_label = ignore_label
 
-    def get_crop_bbox(self, img, crop_size):
+    def set_size(self, size):
+        self.size = tuple(int(s) for s in size)
+
+    def get_crop_bbox(self, shape, crop_size):
         """Randomly get a crop bounding box."""
-        margin_h = max(img.shape[0] - crop_size[0], 0)
-        margin_w = max(img.shape[1] - crop_size[1], 0)
+        margin_h = max(shape[0] - crop_size[0], 0)
+        margin_w = max(shape[1] - crop_size[1], 0)
         offset_h = np.random.randint(0, margin_h + 1)
         offset_w = np.random.randint(0, margin_w + 1)
         crop_y1, crop_y2 = offset_h, offset_h + crop_size[0]
@@ -404,7 +546,7 @@ class RandomCrop(object):
     def __call__(self, sample):
         img, target = sample['image'], sample['target']
 
-        crop_bbox = self.get_crop_bbox(img, self.size)
+        crop_bbox = self.get_crop_bbox(img.shape, self.size)
 
         # crop the image
         img = self.crop(img, crop_bbox)
@@ -415,6 +557,16 @@ class RandomCrop(object):
 
         return { 'image': img, 'target': target }
 
+    def get_matrix(self, shape):
+        h, w = shape[:2]
+        crop_y1, crop_y2, crop_x1, crop_x2 = self.get_crop_bbox(shape, self.size)
+        M = translate_matrix(-crop_x1, -crop_y1)
+        out_shape = min(crop_y2, h) - crop_y1, min(crop_x2, w) - crop_x1
+        if self.pad_if_needed:
+            P, out_shape = pad_matrix(out_shape, self.size)
+            M = P @ M
+        return M, out_shape, None
+
     def __repr__(self):
         return self.__class__.__name__ + '(size={0})'.format(self.size)
 
@@ -436,10 +588,10 @@ class CenterCrop(object):
         self.fill = fill
         self.ignore_label = ignore_label
 
-    def get_crop_bbox(self, img, crop_size):
+    def get_crop_bbox(self, shape, crop_size):
         """Randomly get a crop bounding box."""
-        margin_h = max(img.shape[0] - crop_size[0], 0)
-        margin_w = max(img.shape[1] - crop_size[1], 0)
+        margin_h = max(shape[0] - crop_size[0], 0)
+        margin_w = max(shape[1] - crop_size[1], 0)
 
         crop_y1, crop_x1 = margin_h // 2, margin_w // 2
         crop_y2, crop_x2 = crop_y1 + crop_size[0], crop_x1 + crop_size[1]
@@ -460,7 +612,7 @@ class CenterCrop(object):
         """
         img, target = sample['image'], sample['target']
 
-        crop_bbox = self.get_crop_bbox(img, self.size)
+        crop_bbox = self.get_crop_bbox(img.shape, self.size)
 
         # crop the image
         img = self.crop(img, crop_bbox)
@@ -471,6 +623,16 @@ class CenterCrop(object):
 
         return {'image': img, 'target': target}
 
+    def get_matrix(self, shape):
+        h, w = shape[:2]
+        crop_y1, crop_y2, crop_x1, crop_x2 = self.get_crop_bbox(shape, self.size)
+        M = translate_matrix(-crop_x1, -crop_y1)
+        out_shape = min(crop_y2, h) - crop_y1, min(crop_x2, w) - crop_x1
+        if self.pad_if_needed:
+            P, out_shape = pad_matrix(out_shape, self.size)
+            M = P @ M
+        return M, out_shape, None
+
     def __repr__(self):
         return self.__class__.__name__ + '(size={0})'.format(self.size)
 
@@ -520,6 +682,9 @@ class PhotoMetricDistortion(object):
     6. convert color from HSV to BGR
     7. random contrast (mode 1)
 
+    Brightness and a contrast next to it are applied as one 256-entry LUT, saturation and hue
+    share one BGR->HSV->BGR round trip with a per-channel LUT.
+
     Args:
         brightness_delta (int): delta of brightness.
         contrast_range (tuple): range of contrast.
@@ -539,63 +704,72 @@ class PhotoMetricDistortion(object):
         img = np.clip(img, 0, 255)
         return img.astype(np.uint8)
 
-    def brightness(self, img):
-        """Brightness distortion."""
-        if random.randint(0, 1):
-            return self.convert(img, beta=random.uniform(-self.brightness_delta, self.brightness_delta))
-        return img
+    @staticmethod
+    def linear_lut(alpha=1, beta=0, lut=None):
+        """convert() as a 256-entry table, applied after lut when given."""
+        x = np.arange(256, dtype=np.float32) if lut is None else lut.astype(np.float32)
+        return np.clip(x * alpha + beta, 0, 255).astype(np.uint8)
 
-    def contrast(self, img):
-        """Contrast distortion."""
+    def brightness(self):
+        """Brightness delta, None when skipped."""
         if random.randint(0, 1):
-            return self.convert(img, alpha=random.uniform(self.contrast_lower, self.contrast_upper))
-        return img
+            return random.uniform(-self.brightness_delta, self.brightness_delta)
+        return None
 
-    def saturation(self, img):
-        """Saturation distortion."""
+    def contrast(self):
+        """Contrast factor, None when skipped."""
         if random.randint(0, 1):
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            img[:, :, 1] = self.convert(
-                img[:, :, 1],
-                alpha=random.uniform(self.saturation_lower,
-                                     self.saturation_upper))
+            return random.uniform(self.contrast_lower, self.contrast_upper)
+        return None
 
-            img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
-        return img
+    def saturation(self):
+        """Saturation factor, None when skipped."""
+        if random.randint(0, 1):
+            return random.uniform(self.saturation_lower, self.saturation_upper)
+        return None
 
-    def hue(self, img):
-        """Hue distortion."""
+    def hue(self):
+        """Hue shift, None when skipped."""
         if random.randint(0, 1):
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            img[:, :,
-            0] = (img[:, :, 0].astype(int) +
-                  random.randint(-self.hue_delta, self.hue_delta)) % 180
-            img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
-        return img
+            return random.randint(-self.hue_delta, self.hue_delta)
+        return None
 
     def __call__(self, sample):
         """Call function to perform photometric distortion on images."""
         img, target = sample['image'], sample['target']
 
-        # random brightness
-        img = self.brightness(img)
+        # parameters are drawn in the order the steps are applied
+        lut = None
+        beta = self.brightness()
+        if beta is not None:
+            lut = self.linear_lut(beta=beta)
 
-        # mode == 0 --> do random contrast first
-        # mode == 1 --> do random contrast last
+        # mode == 1 --> do random contrast first
+        # mode == 0 --> do random contrast last
         mode = random.randint(0, 1)
         if mode == 1:
-            img = self.contrast(img)
-
-        # random saturation
-        img = self.saturation(img)
+            alpha = self.contrast()
+            if alpha is not None:
+                lut = self.linear_lut(alpha=alpha, lut=lut)
+
+        sat, hue = self.saturation(), self.hue()
+        if sat is not None or hue is not None:
+            if lut is not None:
+                img, lut = cv2.LUT(img, lut), None
+            x = np.arange(256)
+            lut_hsv = np.stack((((x + hue) % 180) if hue is not None else x,
+                                self.linear_lut(alpha=sat) if sat is not None else x, x), 1)
+            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            hsv = cv2.LUT(hsv, lut_hsv.astype(np.uint8).reshape(256, 1, 3), dst=hsv)
+            img = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
 
-        # random hue
-        img = self.hue(img)
-
-        # random contrast
         if mode == 0:
-            img = self.contrast(img)
+            alpha = self.contrast()
+            if alpha is not None:
+                lut = self.linear_lut(alpha=alpha, lut=lut)
 
+        if lut is not None:
+            img = cv2.LUT(img, lut)
         return {'image': img, 'target': target}
 
     def __repr__(self):
@@ -744,7 +918,7 @@ class RandomRotate(torch.nn.Module):
 
     def __init__(self, p, degree, center=None, auto_bound=False, fill=0, ignore_label=255):
         super().__init__()
-        self.prpob = p
+        self.p = p
         assert p >= 0 and p <= 1
         if isinstance(degree, (float, int)):
             assert degree > 0, f'degree {degree} should be positive'
@@ -771,26 +945,35 @@ class RandomRotate(torch.nn.Module):
         img, target = sample['image'], sample['target']
 
         if random.random() < self.p:
-            angle = random.uniform(self.degree[0], self.degree[1])
-            h, w = img.shape[:2]
-            if self.center is None:
-                self.center = ((w - 1) * 0.5, (h - 1) * 0.5)
-
-            matrix = cv2.getRotationMatrix2D(self.center, -angle, 1.0)
-            if self.auto_bound:
-                cos = np.abs(matrix[0, 0])
-                sin = np.abs(matrix[0, 1])
-                new_w = h * sin + w * cos
-                new_h = h * cos + w * sin
-                matrix[0, 2] += (new_w - w) * 0.5
-                matrix[1, 2] += (new_h - h) * 0.5
-                w = int(np.round(new_w))
-                h = int(np.round(new_h))
+            matrix, (h, w) = self._get_params(img.shape)
             img = cv2.warpAffine(img, matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=self.fill)
             target = cv2.warpAffine(target, matrix, (w, h), flags=cv2.INTER_NEAREST, borderValue=self.ignore_label)
 
         return {'image': img, 'target': target}
 
+    def _get_params(self, shape):
+        angle = random.uniform(self.degree[0], self.degree[1])
+        h, w = shape[:2]
+        center = self.center if self.center is not None else ((w - 1) * 0.5, (h - 1) * 0.5)
+
+        matrix = cv2.getRotationMatrix2D(center, -angle, 1.0)
+        if self.auto_bound:
+            cos = np.abs(matrix[0, 0])
+            sin = np.abs(matrix[0, 1])
+            new_w = h * sin + w * cos
+            new_h = h * cos + w * sin
+            matrix[0, 2] += (new_w - w) * 0.5
+            matrix[1, 2] += (new_h - h) * 0.5
+            w = int(np.round(new_w))
+            h = int(np.round(new_h))
+        return matrix, (h, w)
+
+    def get_matrix(self, shape):
+        if random.random() < self.p:
+            matrix, out_shape = self._get_params(shape)
+            return np.vstack([matrix, [0, 0, 1]]), out_shape, None
+        return None
+
 
 # Minimum value for posterize (0 in EfficientNet implementation)
 POSTERIZE_MIN = 1
@@ -24,16 +24,12 @@ from .base_evaluator import BaseEvaluator
 
 class CocoEvaluator(BaseEvaluator):
     def __init__(self, dataset, iou_types):
-        coco_gt = dataset.coco
         assert isinstance(iou_types, (list, tuple))
-        coco_gt = copy.deepcopy(coco_gt)
-        self.coco_gt = coco_gt
         self.dataset = dataset
-
         self.iou_types = iou_types
+        # the ground truth api is only built on the first update, training epochs without predictions never pay for it
+        self.coco_gt = None
         self.coco_eval = {}
-        for iou_type in iou_types:
-            self.coco_eval[iou_type] = COCOeval(coco_gt, iouType=iou_type)
 
         self.img_ids = []
         self.eval_imgs = {k: [] for k in iou_types}
@@ -41,7 +37,18 @@ class CocoEvaluator(BaseEvaluator):
             , 'Recall_1', 'Recall_10', 'Recall_100', 'Recall_small', 'Recall_medium', 'Recall_large']
         self.count = 0
 
+    def _build_coco_gt(self):
+        if hasattr(self.dataset, 'coco_index'):
+            # a fresh api from the compiled index, no deepcopy of the dataset api needed
+            self.coco_gt = self.dataset.coco_index.to_coco()
+        else:
+            self.coco_gt = copy.deepcopy(self.dataset.coco)
+        for iou_type in self.iou_types:
+            self.coco_eval[iou_type] = COCOeval(self.coco_gt, iouType=iou_type)
+
     def update(self, targets, outputs):
+        if self.coco_gt is None:
+            self._build_coco_gt()
         outputs = [{k: v.to(torch.device("cpu")) for k, v in t.items()} for t in outputs]
         predictions = {target["image_id"].item(): output for target, output in zip(targets, outputs)}
 
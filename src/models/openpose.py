@@ -7,7 +7,7 @@
 import torch
 import torch.nn as nn
 
-from src.data.transforms.keypoint_target_transforms import get_openpose_ground_truth
+from src.data.transforms.keypoint_target_transforms import get_openpose_ground_truth_on_device
 from src.losses.openpose_loss import OpenPoseLoss
 from src.models.backbones import build_backbone
 from src.models.heads import build_head
@@ -29,6 +29,8 @@ class OpenPose(nn.Module):
         self.weight = [d[v] for d in self.dictionary for v in d.keys() if v in self.category]
 
         self.setup_extra_params()
+        # stride of the heatmaps and pafs, for targets generated on device
+        self.stride = self.model_cfg.BACKBONE.get('output_stride', 8)
         self.backbone = build_backbone(self.model_cfg.BACKBONE)
         self.backbone.layer3[-4] = nn.Conv2d(512, 256, kernel_size=(3, 3), stride=(1, 1), padding=(1, 1))
         self.backbone.layer3[-2] = nn.Conv2d(256, 128, kernel_size=(3, 3), stride=(1, 1), padding=(1, 1))
@@ -56,13 +58,18 @@ class OpenPose(nn.Module):
     def trans_specific_format(self, imgs, targets):
         new_heatmaps = []
         new_pafs = []
+        new_keypoints = []
         new_scales = []
         new_pads = []
         new_heights = []
         new_widths = []
         for i, target in enumerate(targets):
-            new_heatmaps.append(target['heatmaps'])
-            new_pafs.append(target['pafs'])
+            if target.__contains__('heatmaps'):
+                new_heatmaps.append(target['heatmaps'])
+                new_pafs.append(target['pafs'])
+            else:
+                # OpenPoseTargetTransform with on_device
+                new_keypoints.append(target['keypoints'])
             if target.__contains__('scales'):
                 new_scales.append(target['scales'])
             if target.__contains__('pads'):
@@ -71,8 +78,13 @@ class OpenPose(nn.Module):
             new_widths.append(target['width'])
 
         t_targets = {}
-        t_targets["heatmaps"] = torch.stack(new_heatmaps, 0)
-        t_targets["pafs"] = torch.stack(new_pafs, 0)
+        if len(new_keypoints) > 0:
+            height, width = imgs.shape[-2:]
+            t_targets["heatmaps"], t_targets["pafs"] = get_openpose_ground_truth_on_device(
+                new_keypoints, int(height / self.stride), int(width / self.stride), self.stride)
+        else:
+            t_targets["heatmaps"] = torch.stack(new_heatmaps, 0)
+            t_targets["pafs"] = torch.stack(new_pafs, 0)
         t_targets["scales"] = new_scales if len(new_scales) > 0 else []
         t_targets["pads"] = new_pads if len(new_pads) > 0 else []
         t_targets["height"] = new_heights
@@ -217,6 +217,9 @@ class YOLOv5(nn.Module):
         self.model_cfg.LOSS.__setitem__('num_classes', self.num_classes)
 
     def trans_specific_format(self, imgs, targets):
+        if isinstance(targets, dict):
+            # already packed by collate_packed_targets
+            return imgs, targets
         new_gts = []
         new_scales = []
         new_pads = []
@@ -161,6 +161,9 @@ class YOLOv6(nn.Module):
         self.model_cfg.HEAD.__setitem__('num_classes', self.num_classes)
 
     def trans_specific_format(self, imgs, targets):
+        if isinstance(targets, dict):
+            # already packed by collate_packed_targets
+            return imgs, targets
         new_gts = []
         new_scales = []
         new_pads = []
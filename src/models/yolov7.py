@@ -218,6 +218,9 @@ class YOLOv7(nn.Module):
 
 
     def trans_specific_format(self, imgs, targets):
+        if isinstance(targets, dict):
+            # already packed by collate_packed_targets
+            return imgs, targets
         new_gts = []
         new_scales = []
         new_pads = []
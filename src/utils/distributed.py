@@ -72,6 +72,9 @@ def torch_distributed_zero_first(local_rank: int):
     """
     Decorator to make all processes in distributed training wait for each local_master to do something.
     """
+    if not is_dist_avail_and_initialized():
+        yield
+        return
     if local_rank not in [-1, 0]:
         torch.distributed.barrier()
     yield
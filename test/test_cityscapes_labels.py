@@ -0,0 +1,52 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/19 11:20
+# @Author : liumin
+# @File : test_cityscapes_labels.py
+
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from src.data.datasets.cityscapes import INVALID_CLASSES, VALID_CLASSES, build_label_lut, encode_label, load_target
+
+"""
+    The labelId -> trainId lookup table against the per-class masked assignments it replaced.
+"""
+
+
+def reference_encode_label(target, ignore_index=255):
+    target = np.asarray(target, dtype=np.uint8).copy()
+    for _voidc in INVALID_CLASSES:
+        if _voidc >= 0:
+            target[target == _voidc] = ignore_index
+    for i, _validc in enumerate(VALID_CLASSES):
+        target[target == _validc] = i
+    return target
+
+
+def random_label(h=64, w=96, seed=0):
+    # every byte value, including the ids that are neither valid nor void
+    rng = np.random.RandomState(seed)
+    label = rng.randint(0, 256, (h, w)).astype(np.uint8)
+    label.flat[:256] = np.arange(256)
+    return label
+
+
+def test_lut_matches_reference():
+    label = random_label()
+    np.testing.assert_array_equal(encode_label(label), reference_encode_label(label))
+    np.testing.assert_array_equal(encode_label(label, build_label_lut(254)), reference_encode_label(label, 254))
+
+
+def test_load_target_remaps_once():
+    label = random_label(seed=1)
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'label.png')
+        cv2.imwrite(path, label)
+        np.testing.assert_array_equal(load_target(path, 'raw'), reference_encode_label(label))
+        np.testing.assert_array_equal(load_target(path, 'raw', remap=False), label)
+        encoded = load_target(path, 'encoded')
+        np.testing.assert_array_equal(cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED), reference_encode_label(label))
@@ -0,0 +1,103 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/20 15:10
+# @Author : liumin
+# @File : test_geometry.py
+
+from copy import deepcopy
+
+import cv2
+import numpy as np
+
+from src.data.transforms import det_transforms, seg_transforms
+from src.data.transforms.geometry import center_scale_matrix, warp
+
+"""
+    The fused geometric chain (one warp) against the same transforms applied one by one.
+    cv2.resize and cv2.warpAffine interpolate in fixed point and treat the image border differently,
+    so images are compared inside the resized area, away from its edge, with a small tolerance.
+"""
+
+
+def smooth_image(h, w, seed=0):
+    rng = np.random.RandomState(seed)
+    coarse = rng.randint(0, 256, (h // 8 + 2, w // 8 + 2, 3)).astype(np.uint8)
+    return cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC)
+
+
+def det_sample(h=97, w=131):
+    boxes = np.array([[10.5, 8.0, 60.0, 50.25], [70.0, 30.0, 130.0, 96.0]], dtype=np.float32)
+    return {'image': smooth_image(h, w), 'target': {'boxes': boxes, 'labels': np.array([1, 2])}}
+
+
+def run_sequential(transforms, sample):
+    for t in transforms:
+        sample = t(sample)
+    return sample
+
+
+def assert_images_close(a, b, region, margin=2, max_diff=3):
+    top, left, bottom, right = region
+    a = a[top + margin:bottom - margin, left + margin:right - margin].astype(np.int32)
+    b = b[top + margin:bottom - margin, left + margin:right - margin].astype(np.int32)
+    assert a.size > 0
+    diff = np.abs(a - b)
+    assert diff.max() <= max_diff, diff.max()
+    assert diff.mean() < 0.5, diff.mean()
+
+
+def assert_labels_agree(a, b, region, margin=2):
+    # cv2.resize picks nearest labels without the half pixel offset, so they may differ next to a class boundary
+    kernel = np.ones((3, 3), np.uint8)
+    boundary = cv2.dilate(b, kernel) != cv2.erode(b, kernel)
+    top, left, bottom, right = region
+    inside = (slice(top + margin, bottom - margin), slice(left + margin, right - margin))
+    assert (~boundary[inside]).sum() > 0.5 * boundary[inside].size
+    np.testing.assert_array_equal(a[inside][~boundary[inside]], b[inside][~boundary[inside]])
+
+
+def test_center_scale_matrix_matches_resize():
+    img = smooth_image(40, 52)
+    for oh, ow in ((80, 104), (23, 31)):
+        M = center_scale_matrix(ow / img.shape[1], oh / img.shape[0])
+        resized = cv2.resize(img, (ow, oh), interpolation=cv2.INTER_LINEAR)
+        assert_images_close(warp(img, M, (oh, ow)), resized, (0, 0, oh, ow))
+
+
+def test_det_chain_matches_sequential():
+    for size, keep_ratio in (([256, 256], True), ([64, 64], True), ([160, 224], False)):
+        transforms = [det_transforms.Resize(size, keep_ratio=keep_ratio), det_transforms.RandomHorizontalFlip(p=1.0)]
+        sample = det_sample()
+        sequential = run_sequential(transforms, deepcopy(sample))
+        fused = det_transforms.GeometricChain(transforms)(deepcopy(sample))
+
+        assert fused['image'].shape == sequential['image'].shape
+        np.testing.assert_allclose(fused['target']['boxes'], sequential['target']['boxes'], atol=1e-3)
+        np.testing.assert_array_equal(fused['target']['pads'].numpy(), sequential['target']['pads'].numpy())
+        np.testing.assert_allclose(fused['target']['scales'].numpy(), sequential['target']['scales'].numpy())
+
+        top, left = sequential['target']['pads'].tolist()
+        scale_h, scale_w = sequential['target']['scales'].tolist()
+        h, w = det_sample()['image'].shape[:2]
+        region = (top, left, top + int(round(h * scale_h)), left + int(round(w * scale_w)))
+        assert_images_close(fused['image'], sequential['image'], region)
+
+
+def test_seg_chain_matches_sequential():
+    for size in ((256, 256), (64, 64)):
+        transforms = [seg_transforms.Resize(size, keep_ratio=True, pad_if_needed=True),
+                      seg_transforms.RandomHorizontalFlip(p=1.0)]
+        img = smooth_image(97, 131)
+        # classes in blocks large enough to leave most pixels away from a boundary at 64x64
+        label = (np.arange(97)[:, None] // 32 * 5 + np.arange(131)[None, :] // 32).astype(np.uint8)
+        sample = {'image': img, 'target': label}
+        sequential = run_sequential(transforms, deepcopy(sample))
+        fused = seg_transforms.GeometricChain(transforms)(deepcopy(sample))
+
+        assert fused['image'].shape == sequential['image'].shape
+        assert fused['target'].shape == sequential['target'].shape
+        ratio = min(size[0] / 97, size[1] / 131)
+        oh, ow = int(round(97 * ratio)), int(round(131 * ratio))
+        top, left = int(round((size[0] - oh) / 2 - 0.1)), int(round((size[1] - ow) / 2 - 0.1))
+        assert_images_close(fused['image'], sequential['image'], (top, left, top + oh, left + ow))
+        assert_labels_agree(fused['target'], sequential['target'], (top, left, top + oh, left + ow))
@@ -0,0 +1,150 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/22 10:30
+# @Author : liumin
+# @File : test_openpose_targets.py
+
+import numpy as np
+import torch
+
+from src.data.transforms.keypoint_target_transforms import get_keypoints, kp_connections, prepare_keypoints, \
+    get_openpose_ground_truth, get_openpose_ground_truth_on_device
+
+"""
+    The vectorized OpenPose targets against the per-person loops they replaced (putGaussianMaps /
+    putVecMaps, kept below as the reference), on random multi-person keypoints.
+"""
+
+INPUT_X, INPUT_Y, STRIDE = 368, 368, 8
+
+
+def putGaussianMaps(center, accumulate_confid_map, sigma, grid_y, grid_x, stride):
+    start = stride / 2.0 - 0.5
+    y_range = [i for i in range(int(grid_y))]
+    x_range = [i for i in range(int(grid_x))]
+    xx, yy = np.meshgrid(x_range, y_range)
+    xx = xx * stride + start
+    yy = yy * stride + start
+    d2 = (xx - center[0]) ** 2 + (yy - center[1]) ** 2
+    exponent = d2 / 2.0 / sigma / sigma
+    mask = exponent <= 4.6052
+    cofid_map = np.exp(-exponent)
+    cofid_map = np.multiply(mask, cofid_map)
+    accumulate_confid_map += cofid_map
+    accumulate_confid_map[accumulate_confid_map > 1.0] = 1.0
+    return accumulate_confid_map
+
+
+def putVecMaps(centerA, centerB, accumulate_vec_map, count, grid_y, grid_x, stride):
+    centerA = centerA.astype(float)
+    centerB = centerB.astype(float)
+
+    thre = 1  # limb width
+    centerB = centerB / stride
+    centerA = centerA / stride
+
+    limb_vec = centerB - centerA
+    norm = np.linalg.norm(limb_vec)
+    if (norm == 0.0):
+        return accumulate_vec_map, count
+    limb_vec_unit = limb_vec / norm
+
+    min_x = max(int(round(min(centerA[0], centerB[0]) - thre)), 0)
+    max_x = min(int(round(max(centerA[0], centerB[0]) + thre)), grid_x)
+    min_y = max(int(round(min(centerA[1], centerB[1]) - thre)), 0)
+    max_y = min(int(round(max(centerA[1], centerB[1]) + thre)), grid_y)
+
+    range_x = list(range(int(min_x), int(max_x), 1))
+    range_y = list(range(int(min_y), int(max_y), 1))
+    xx, yy = np.meshgrid(range_x, range_y)
+    ba_x = xx - centerA[0]
+    ba_y = yy - centerA[1]
+    limb_width = np.abs(ba_x * limb_vec_unit[1] - ba_y * limb_vec_unit[0])
+    mask = limb_width < thre
+
+    vec_map = np.copy(accumulate_vec_map) * 0.0
+    vec_map[yy, xx] = np.repeat(mask[:, :, np.newaxis], 2, axis=2)
+    vec_map[yy, xx] *= limb_vec_unit[np.newaxis, np.newaxis, :]
+
+    mask = np.logical_or.reduce((np.abs(vec_map[:, :, 0]) > 0, np.abs(vec_map[:, :, 1]) > 0))
+
+    accumulate_vec_map = np.multiply(accumulate_vec_map, count[:, :, np.newaxis])
+    accumulate_vec_map += vec_map
+    count[mask == True] += 1
+    mask = count == 0
+    count[mask == True] = 1
+    accumulate_vec_map = np.divide(accumulate_vec_map, count[:, :, np.newaxis])
+    count[mask == True] = 0
+    return accumulate_vec_map, count
+
+
+def reference_ground_truth(anns, input_x, input_y, stride):
+    keypoints = prepare_keypoints(anns, input_x, input_y)
+    grid_y, grid_x = int(input_y / stride), int(input_x / stride)
+    KEYPOINTS = get_keypoints()
+    HEATMAP_COUNT = len(KEYPOINTS)
+    LIMB_IDS = kp_connections(KEYPOINTS)
+    heatmaps = np.zeros((grid_y, grid_x, HEATMAP_COUNT + 1))
+    pafs = np.zeros((grid_y, grid_x, 2 * len(LIMB_IDS)))
+
+    for i in range(HEATMAP_COUNT):
+        for joint in [jo[i] for jo in keypoints]:
+            if joint[2] > 0.5:
+                heatmaps[:, :, i] = putGaussianMaps(joint[:2], heatmaps[:, :, i], 7.0, grid_y, grid_x, stride)
+
+    for i, (k1, k2) in enumerate(LIMB_IDS):
+        count = np.zeros((grid_y, grid_x), dtype=np.uint32)
+        for joint in keypoints:
+            if joint[k1, 2] > 0.5 and joint[k2, 2] > 0.5:
+                pafs[:, :, 2 * i:2 * (i + 1)], count = putVecMaps(
+                    centerA=joint[k1, :2], centerB=joint[k2, :2], accumulate_vec_map=pafs[:, :, 2 * i:2 * (i + 1)],
+                    count=count, grid_y=grid_y, grid_x=grid_x, stride=stride)
+
+    heatmaps[:, :, -1] = np.maximum(1 - np.max(heatmaps[:, :, :HEATMAP_COUNT], axis=2), 0.)
+    return heatmaps, pafs
+
+
+def random_anns(rng, num_persons, integer=True):
+    '''
+        COCO-like 17 x 3 keypoints of persons clustered in the input, some joints out of frame.
+    '''
+    anns = []
+    for _ in range(num_persons):
+        center = rng.uniform(0, [INPUT_X, INPUT_Y])
+        xy = center + rng.normal(0, 40, (17, 2))
+        if integer:
+            xy = np.round(xy)
+        v = rng.choice([0, 1, 2], size=(17, 1), p=[0.2, 0.3, 0.5])
+        anns.append(np.concatenate([xy, v], axis=1))
+    return anns
+
+
+def test_numpy_targets_match_reference():
+    rng = np.random.RandomState(0)
+    for num_persons in (1, 3, 15):
+        for integer in (True, False):
+            anns = random_anns(rng, num_persons, integer)
+            heatmaps, pafs = get_openpose_ground_truth([a.copy() for a in anns], INPUT_X, INPUT_Y, STRIDE)
+            ref_heatmaps, ref_pafs = reference_ground_truth([a.copy() for a in anns], INPUT_X, INPUT_Y, STRIDE)
+            np.testing.assert_allclose(heatmaps, ref_heatmaps, rtol=0, atol=1e-12)
+            np.testing.assert_allclose(pafs, ref_pafs, rtol=0, atol=1e-12)
+
+
+def test_device_targets_match_reference():
+    rng = np.random.RandomState(1)
+    batch = [random_anns(rng, n, integer=False) for n in (1, 4, 15)]
+    keypoints = [torch.from_numpy(prepare_keypoints([a.copy() for a in anns], INPUT_X, INPUT_Y).astype(np.float32))
+                 for anns in batch]
+    heatmaps, pafs = get_openpose_ground_truth_on_device(keypoints, INPUT_Y // STRIDE, INPUT_X // STRIDE, STRIDE)
+    for b, anns in enumerate(batch):
+        ref_heatmaps, ref_pafs = reference_ground_truth([a.copy() for a in anns], INPUT_X, INPUT_Y, STRIDE)
+        np.testing.assert_allclose(heatmaps[b].permute(1, 2, 0).numpy(), ref_heatmaps, rtol=0, atol=1e-5)
+        np.testing.assert_allclose(pafs[b].permute(1, 2, 0).numpy(), ref_pafs, rtol=0, atol=1e-5)
+
+
+def test_targets_without_persons():
+    heatmaps, pafs = get_openpose_ground_truth([], INPUT_X, INPUT_Y, STRIDE)
+    assert (heatmaps[:, :, :-1] == 0).all() and (heatmaps[:, :, -1] == 1).all() and (pafs == 0).all()
+    keypoints = [torch.from_numpy(prepare_keypoints([], INPUT_X, INPUT_Y).astype(np.float32))]
+    heatmaps, pafs = get_openpose_ground_truth_on_device(keypoints, INPUT_Y // STRIDE, INPUT_X // STRIDE, STRIDE)
+    assert (heatmaps[0, :-1] == 0).all() and (heatmaps[0, -1] == 1).all() and (pafs == 0).all()
@@ -0,0 +1,115 @@
+# !/usr/bin/env python
+# -- coding: utf-8 --
+# @Time : 2026/10/22 10:40
+# @Author : liumin
+# @File : test_photometric.py
+
+import random
+
+import cv2
+import numpy as np
+
+from src.data.transforms.seg_transforms import PhotoMetricDistortion
+from src.data.transforms.det_transforms import ColorHSV
+
+"""
+    The LUT based seg PhotoMetricDistortion and det ColorHSV against the implementations they
+    replaced, kept below as the reference, with equal seeds.
+"""
+
+
+def convert(img, alpha=1, beta=0):
+    img = img.astype(np.float32) * alpha + beta
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def reference_photometric(t, img):
+    def contrast(img):
+        if random.randint(0, 1):
+            return convert(img, alpha=random.uniform(t.contrast_lower, t.contrast_upper))
+        return img
+
+    if random.randint(0, 1):
+        img = convert(img, beta=random.uniform(-t.brightness_delta, t.brightness_delta))
+    mode = random.randint(0, 1)
+    if mode == 1:
+        img = contrast(img)
+    if random.randint(0, 1):
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        img[:, :, 1] = convert(img[:, :, 1], alpha=random.uniform(t.saturation_lower, t.saturation_upper))
+        img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
+    if random.randint(0, 1):
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        img[:, :, 0] = (img[:, :, 0].astype(int) + random.randint(-t.hue_delta, t.hue_delta)) % 180
+        img = cv2.cvtColor(img, cv2.COLOR_HSV2BGR)
+    if mode == 0:
+        img = contrast(img)
+    return img
+
+
+def reference_color_hsv(t, img):
+    if random.random() < t.p:
+        r = np.random.uniform(-1, 1, 3) * [t.hue, t.saturation, t.value] + 1
+        hue, sat, val = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+        x = np.arange(0, 256, dtype=r.dtype)
+        lut_hue = ((x * r[0]) % 180).astype(img.dtype)
+        lut_sat = np.clip(x * r[1], 0, 255).astype(img.dtype)
+        lut_val = np.clip(x * r[2], 0, 255).astype(img.dtype)
+        im_hsv = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val)))
+        return cv2.cvtColor(im_hsv, cv2.COLOR_HSV2BGR)
+    return img
+
+
+class RecordingDistortion(PhotoMetricDistortion):
+    # remembers whether saturation and hue were both applied, the one case with a different round trip
+    def __call__(self, sample):
+        self.drawn = []
+        return super(RecordingDistortion, self).__call__(sample)
+
+    def saturation(self):
+        value = super(RecordingDistortion, self).saturation()
+        self.drawn.append(value)
+        return value
+
+    def hue(self):
+        value = super(RecordingDistortion, self).hue()
+        self.drawn.append(value)
+        return value
+
+
+def natural_image(h=120, w=160, seed=0):
+    rng = np.random.RandomState(seed)
+    coarse = rng.randint(0, 256, (h // 10, w // 10, 3)).astype(np.uint8)
+    img = cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC).astype(np.int16)
+    return np.clip(img + rng.randint(-8, 9, img.shape), 0, 255).astype(np.uint8)
+
+
+def test_photometric_distortion_matches_reference():
+    t = RecordingDistortion()
+    img = natural_image()
+    for seed in range(200):
+        random.seed(seed)
+        expected = reference_photometric(t, img.copy())
+        state = random.getstate()
+        random.seed(seed)
+        out = t({'image': img.copy(), 'target': None})['image']
+        # the same parameters are drawn from the same random stream
+        assert random.getstate() == state
+        if all(v is not None for v in t.drawn):
+            # one HSV round trip instead of two
+            assert np.abs(out.astype(int) - expected).mean() < 1.0
+        else:
+            np.testing.assert_array_equal(out, expected)
+
+
+def test_color_hsv_matches_reference():
+    t = ColorHSV(p=1.0, hue=0.015, saturation=0.7, value=0.4)
+    img = natural_image(seed=1)
+    for seed in range(50):
+        random.seed(seed)
+        np.random.seed(seed)
+        expected = reference_color_hsv(t, img.copy())
+        random.seed(seed)
+        np.random.seed(seed)
+        out = t({'image': img.copy(), 'target': None})['image']
+        np.testing.assert_array_equal(out, expected)
@@ -12,7 +12,7 @@ import torch
 from torch.nn.utils import clip_grad_norm_, clip_grad_value_
 from torch.utils.data.dataloader import default_collate
 from torch.utils.data.distributed import DistributedSampler
-from torch.utils.data import RandomSampler, SequentialSampler
+from torch.utils.data import RandomSampler, SequentialSampler, IterableDataset
 
 from importlib import import_module
 from datetime import datetime
@@ -32,15 +32,19 @@ from src.utils.global_logger import logger
 from src.utils.timer import Timer
 from src.utils.tensorboard import DummyWriter
 from src.utils.checkpoints import Checkpoints
-from src.utils.distributed import init_distributed, reduce_dict
+from src.utils.distributed import init_distributed, reduce_dict, torch_distributed_zero_first
 from src.evaluator import build_evaluator
 from src.utils.distributed import LossLogger
 from src.optimizers import build_optimizer, get_current_lr
 from src.lr_schedulers import build_lr_scheduler
-from src.data.transforms import build_transforms, build_targets_transforms
+from src.data.transforms import build_transforms, build_targets_transforms, build_batch_transforms
 from src.utils.freeze import freeze_models
 from src.lr_schedulers.warmup import get_warmup_lr
 from src.data.datasets.prefetch_dataLoader import PrefetchDataLoader
+from src.data.datasets.collate import collate_packed_targets, unpack_targets
+from src.data.datasets.shards import ShardDataset
+from src.data.profiling import TransformProfiler, ProfiledDataset
+from src.data.samplers import AspectRatioBatchSampler, MultiScaleBatchSampler, MultiScaleDataset, ReadAheadSampler, get_input_size
 
 torch.backends.cudnn.enabled = True
 torch.set_default_tensor_type(torch.FloatTensor)
@@ -56,6 +60,9 @@ class Trainer:
 
         self.n_iters_per_epoch = None
         self.iters_per_epoch = None
+        self.batch_transforms = {}
+        self.readahead = {}
+        self.profilers = {}
         if cfg.local_rank == 0:
             self.experiment_id = self.experiment_id(self.cfg)
             self.ckpts = Checkpoints(logger,self.cfg.CHECKPOINT_DIR,self.experiment_id)
@@ -75,15 +82,49 @@ class Trainer:
             return build_targets_transforms(cfg.DATASET.DICTIONARY_NAME, cfg.DATASET[mode.upper()].TARGET_TRANSFORMS,
                                             mode) if cfg.DATASET[mode.upper()].TARGET_TRANSFORMS is not None else None
         else:
-            return build_transforms(cfg.DATASET.DICTIONARY_NAME, cfg.DATASET[mode.upper()].TRANSFORMS, mode)
+            return build_transforms(cfg.DATASET.DICTIONARY_NAME, cfg.DATASET[mode.upper()].TRANSFORMS, mode,
+                                    self._uint8_transport(mode))
+
+    def _uint8_transport(self, mode):
+        # images cross the DataLoader and the host to device copy as uint8, normalized on device
+        data_cfg = cfg.DATASET[mode.upper()]
+        return bool(data_cfg.__contains__('UINT8_TRANSPORT') and data_cfg.UINT8_TRANSPORT)
+
+    def _parser_batch_transform(self, mode):
+        data_cfg = cfg.DATASET[mode.upper()]
+        batch_cfg = data_cfg.BATCH_TRANSFORMS if data_cfg.__contains__('BATCH_TRANSFORMS') else None
+        return build_batch_transforms(batch_cfg, data_cfg.TRANSFORMS, self._uint8_transport(mode))
+
+    def _report_profile(self, mode, dataset):
+        if mode not in self.profilers:
+            return
+        if self.cfg.local_rank == 0:
+            logger.info(self.profilers[mode].report(getattr(dataset, 'get_file_paths', None)))
+        self.profilers[mode].reset()
+
+    def _report_caches(self, epoch, dataset):
+        # counters of the per-worker caches of the dataset, see src/data/cache/stats.py
+        if self.cfg.local_rank != 0:
+            return
+        for name in ('lru', 'reservoir'):
+            cache = getattr(dataset, name, None)
+            if cache is not None:
+                logger.info(f'[epoch {epoch}] {cache.report()}')
 
     def _parser_datasets(self):
         *dataset_str_parts, dataset_class_str = cfg.DATASET.CLASS.split(".")
         dataset_class = getattr(import_module(".".join(dataset_str_parts)), dataset_class_str)
 
-        datasets = {x: dataset_class(data_cfg=cfg.DATASET[x.upper()], dictionary=self.dictionary,
-                                     transform=self._parser_transform(x),
-                                     target_transform=self._parser_transform(x, 'target'), stage=x) for x in ['train', 'val']}
+        # SHARDS streams the train samples sequentially from tar shards, see shards.py
+        dataset_classes = {'train': ShardDataset if cfg.DATASET.TRAIN.get('SHARDS') else dataset_class, 'val': dataset_class}
+        if cfg.DATASET.VAL.get('SHARDS') and cfg.local_rank == 0:
+            # the evaluators need the exact, map-style val set and its annotations
+            logger.warning('SHARDS is only supported for DATASET.TRAIN, it is ignored for DATASET.VAL.')
+        # local rank 0 builds (or stages into shared memory) the dataset caches, the other ranks then attach to them
+        with torch_distributed_zero_first(cfg.local_rank):
+            datasets = {x: dataset_classes[x](data_cfg=cfg.DATASET[x.upper()], dictionary=self.dictionary,
+                                         transform=self._parser_transform(x),
+                                         target_transform=self._parser_transform(x, 'target'), stage=x) for x in ['train', 'val']}
 
         data_samplers = defaultdict()
         if self.cfg.distributed:
@@ -92,13 +133,71 @@ class Trainer:
             data_samplers['train'] = RandomSampler(datasets['train'])
             data_samplers['val'] = SequentialSampler(datasets['val'])
 
+        loader_args = {x: dict(batch_size=cfg.DATASET[x.upper()].BATCH_SIZE, sampler=data_samplers[x],
+                               drop_last=(x=='train')) for x in ['train', 'val']}
+        # iterable datasets split and shuffle their shards themselves, no sampler
+        streaming = [x for x in ['train', 'val'] if isinstance(datasets[x], IterableDataset)]
+        for x in streaming:
+            loader_args[x] = dict(batch_size=cfg.DATASET[x.upper()].BATCH_SIZE, drop_last=(x=='train'))
+        if cfg.__contains__('MULTI_SCALE_SAMPLER') and cfg.MULTI_SCALE_SAMPLER and 'train' not in streaming:
+            # per-step input size and batch size at a constant pixel budget, the same on every rank
+            base_size = get_input_size(datasets['train'].transform)
+            if base_size is None:
+                if cfg.local_rank == 0:
+                    logger.warning('MULTI_SCALE_SAMPLER needs a train transform with a fixed output size, it is ignored.')
+            else:
+                data_samplers['train'] = MultiScaleBatchSampler(datasets['train'], base_size, cfg.DATASET.TRAIN.BATCH_SIZE,
+                                                                scale_range=cfg.SCALE_RANGE, shuffle=cfg.DATASET.TRAIN.SHUFFLE)
+                datasets['train'] = MultiScaleDataset(datasets['train'])
+                loader_args['train'] = dict(batch_sampler=data_samplers['train'])
+        if cfg.DATASET.VAL.__contains__('RECT') and cfg.DATASET.VAL.RECT and 'val' not in streaming:
+            # aspect-ratio grouped val batches, each padded only to its own letterboxed size
+            base_size = get_input_size(datasets['val'].transform)
+            if base_size is None or not hasattr(datasets['val'], 'get_img_shapes'):
+                if cfg.local_rank == 0:
+                    logger.warning('RECT needs a val transform with a fixed output size and a dataset with get_img_shapes, it is ignored.')
+            else:
+                data_samplers['val'] = AspectRatioBatchSampler(datasets['val'].get_img_shapes(), base_size, cfg.DATASET.VAL.BATCH_SIZE)
+                datasets['val'] = MultiScaleDataset(datasets['val'])
+                loader_args['val'] = dict(batch_sampler=data_samplers['val'])
+                if cfg.local_rank == 0:
+                    logger.info('val :RECT {} batches, {:.1%} of the letterboxed pixels'.format(len(data_samplers['val']), data_samplers['val'].pixel_ratio()))
+
+        for x in ['train', 'val']:
+            data_cfg = cfg.DATASET[x.upper()]
+            if data_cfg.__contains__('READAHEAD') and data_cfg.READAHEAD and x not in streaming:
+                # page cache warmed for the next samples of this rank's order, see readahead.py
+                if not hasattr(datasets[x], 'get_file_paths'):
+                    if cfg.local_rank == 0:
+                        logger.warning('READAHEAD needs a dataset with get_file_paths, it is ignored.')
+                    continue
+                key = 'batch_sampler' if 'batch_sampler' in loader_args[x] else 'sampler'
+                options = dict(data_cfg.READAHEAD) if hasattr(data_cfg.READAHEAD, 'keys') else {}
+                self.readahead[x] = ReadAheadSampler(loader_args[x][key], datasets[x].get_file_paths, **options)
+                loader_args[x][key] = self.readahead[x]
+
+        for x in ['train', 'val']:
+            if cfg.DATASET[x.upper()].get('PROFILE'):
+                # per-transform and per-sample timing in a shared-memory block, reported every epoch
+                self.profilers[x] = TransformProfiler(x)
+                for prefix, t in (('', datasets[x].transform), ('target:', datasets[x].target_transform)):
+                    if hasattr(t, 'profiler'):
+                        self.profilers[x].attach(t, prefix)
+                if x not in streaming:
+                    datasets[x] = ProfiledDataset(datasets[x], self.profilers[x])
+
+        collate_fns = {x: dataset_class.collate_fn if hasattr(dataset_class, 'collate_fn') else default_collate for x in ['train', 'val']}
+        for x in ['train', 'val']:
+            if cfg.DATASET[x.upper()].__contains__('PACKED_TARGETS') and cfg.DATASET[x.upper()].PACKED_TARGETS:
+                # detection targets as one N x 6 gts tensor plus per-image tensors, see collate.py
+                collate_fns[x] = collate_packed_targets
+
         dataloaders = {
-            x: PrefetchDataLoader(datasets[x], batch_size=cfg.DATASET[x.upper()].BATCH_SIZE, sampler=data_samplers[x],
-                          num_workers=cfg.DATASET[x.upper()].NUM_WORKER,
-                          collate_fn=dataset_class.collate_fn if hasattr(dataset_class,
-                                                                         'collate_fn') else default_collate,
-                          pin_memory=True, drop_last=(x=='train')) for x in ['train', 'val']}
+            x: PrefetchDataLoader(datasets[x], num_workers=cfg.DATASET[x.upper()].NUM_WORKER,
+                          collate_fn=collate_fns[x], pin_memory=True, **loader_args[x]) for x in ['train', 'val']}
         dataset_sizes = {x: len(datasets[x]) for x in ['train', 'val']}
+        # photometric ops that run on the collated batch on device, see batch_transforms.py
+        self.batch_transforms = {x: self._parser_batch_transform(x) for x in ['train', 'val']}
         return datasets, dataloaders, data_samplers, dataset_sizes
 
 
@@ -138,7 +237,9 @@ class Trainer:
             :return: losses, predicts
         '''
         imgs, targets = sample['image'], sample['target']
-        imgs = list(img.cuda() for img in imgs) if isinstance(imgs, list) else imgs.cuda()
+        imgs = list(img.cuda(non_blocking=True) for img in imgs) if isinstance(imgs, list) else imgs.cuda(non_blocking=True)
+        if self.batch_transforms.get(prefix) is not None:
+            imgs = self.batch_transforms[prefix](imgs)
         if isinstance(targets, list):
             if isinstance(targets[0], torch.Tensor):
                 targets = [t.cuda() for t in targets]
@@ -149,7 +250,7 @@ class Trainer:
         elif isinstance(targets, dict):
             for (k, v) in targets.items():
                 if isinstance(v, torch.Tensor):
-                    targets[k] = v.cuda()
+                    targets[k] = v.cuda(non_blocking=True)
                 elif isinstance(v, list):
                     if isinstance(v[0], torch.Tensor):
                         targets[k] = [t.cuda() for t in v]
@@ -199,6 +300,9 @@ class Trainer:
                 lossLogger.update(**losses)
 
         if performanceLogger is not None:
+            if isinstance(targets, dict) and 'offsets' in targets:
+                # the evaluators take the per-image dicts
+                targets = unpack_targets(targets)
             if predicts is not None:
                 if self.cfg.distributed:
                     # reduce performances over all GPUs for logging purposes
@@ -253,6 +357,8 @@ class Trainer:
         datasets, dataloaders,data_samplers, dataset_sizes = self._parser_datasets()
 
         self.iters_per_epoch = int(dataset_sizes['train'] // self.batch_size)
+        if isinstance(data_samplers['train'], MultiScaleBatchSampler):
+            self.iters_per_epoch = len(dataloaders['train'])
 
         ## parser_model
         model_ft = self._parser_model()
@@ -297,13 +403,23 @@ class Trainer:
         best_acc = 0.0
         best_perf_rst = None
         for epoch in range(self.start_epoch + 1, self.cfg.N_MAX_EPOCHS):
-            if cfg.distributed:
-                dataloaders['train'].sampler.set_epoch(epoch)
+            if hasattr(data_samplers['train'], 'set_epoch'):
+                data_samplers['train'].set_epoch(epoch)
+            if hasattr(datasets['train'], 'set_epoch'):
+                datasets['train'].set_epoch(epoch)
             self.train_epoch(scaler, epoch, model_ft,datasets['train'], dataloaders['train'], optimizer_ft)
             lr_scheduler_ft.step()
+            if 'train' in self.readahead and self.cfg.local_rank == 0:
+                logger.info(f"[epoch {epoch}] {self.readahead['train'].summary()}")
+            self._report_profile('train', datasets['train'])
+            self._report_caches(epoch, datasets['train'])
 
             if self.cfg.DATASET.VAL and (not (epoch+1) % cfg.EVALUATOR.EVAL_INTERVALS or epoch==self.cfg.N_MAX_EPOCHS-1 or stopper.possible_stop):
                 acc, perf_rst = self.val_epoch(epoch, self.ema.ema, datasets['val'], dataloaders['val'])
+                if 'val' in self.readahead and self.cfg.local_rank == 0:
+                    logger.info(f"[epoch {epoch}] val {self.readahead['val'].summary()}")
+                self._report_profile('val', datasets['val'])
+                self._report_caches(epoch, datasets['val'])
 
                 if cfg.local_rank == 0:
                     # start to save best performance model after learning rate decay to 1e-6